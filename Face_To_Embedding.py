@@ -2,20 +2,32 @@ from ultralytics import YOLO
 from deepface import DeepFace
 import cv2
 import numpy as np
-import faiss
-import os
-import pickle
-import requests
+import time
 from datetime import datetime
 
+from detections import from_faces, postprocess
+from embedding_cache import EmbeddingCache, face_quality
+from face_db import FaceDB
+from face_tracker import FaceTracker
+from server_client import ServerClient
+
 # ===== CONFIG =====
 YOLO_WEIGHTS = r"C:\YoLo-Face\runs\detect\train3\weights\best.pt"
 DB_PATH = "face_db.index"
 LABELS_PATH = "face_labels.pkl"
 CONF_THRESH = 0.5
 EMBED_MODEL = "ArcFace"   # ArcFace = better accuracy, no TensorFlow dependency
-DIST_THRESHOLD = 1.2      # Recommended for ArcFace embeddings
+METRIC = "cosine"         # "cosine" (inner product on normalized vectors) or "l2" for new DBs
+SIM_THRESHOLD = 0.4       # Min cosine similarity for a match (= squared L2 distance 1.2 on unit vectors)
+TOP_K = 5                 # Templates fetched per search, grouped into identities
 SERVER_URL = "https://noe-uninducible-cheerlessly.ngrok-free.dev"  # change as needed
+WIRE_FORMAT = "legacy"    # "legacy" (JSON float lists) / "json" / "msgpack" (see wire_format.py)
+MULTI_FACE = False        # True = embed/search every face in frame, not just the largest
+DETECT_EVERY = 1          # >1 = run YOLO every N frames and track faces in between
+INDEX_TYPE = "auto"       # "flat", "ivf", "hnsw" or "auto" (flat -> IVF -> HNSW as the DB grows)
+NPROBE = 16               # IVF lists probed per search (higher = better recall, slower)
+EF_SEARCH = 64            # HNSW search breadth (higher = better recall, slower)
+COMPRESSION = None        # None, "sq8", "fp16" or "pq": compressed index + exact re-ranking from disk
 # ===================
 
 # Load YOLO model
@@ -24,22 +36,80 @@ SERVER_URL = "https://noe-uninducible-cheerlessly.ngrok-free.dev"  # change as n
 model = YOLO(YOLO_WEIGHTS)
 
 # Initialize or load FAISS index
-# FAISS holds numeric embeddings for registered faces. `labels` keeps a parallel
-# Python list of string IDs/names so we can map an index search result back to
-# a human-readable label.
-index = None
-labels = []
-if os.path.exists(DB_PATH) and os.path.exists(LABELS_PATH):
-    # If we've previously saved an index and labels, load them so searches
-    # can be performed across runs.
-    print("[+] Loading existing FAISS index...")
-    index = faiss.read_index(DB_PATH)
-    with open(LABELS_PATH, "rb") as f:
-        labels = pickle.load(f)
-else:
-    # Otherwise we'll create the FAISS index lazily when the first face is
-    # registered (so we know the embedding dimension).
-    print("[+] No existing FAISS DB found. It will be created on first registration.")
+# FAISS holds numeric embeddings for registered faces under 64-bit face IDs.
+# `labels` maps those IDs to string names (and back) so we can turn an index
+# search result into a human-readable label.
+db = FaceDB(DB_PATH, LABELS_PATH, index_type=INDEX_TYPE, nprobe=NPROBE, ef_search=EF_SEARCH, metric=METRIC,
+            compression=COMPRESSION)
+index = db.index
+labels = db.labels
+
+# Background sender (see server_client.py): 'v' queues the request and
+# returns at once; the server's answer is shown on the frames after it
+# arrives, so a slow or unreachable server never freezes the video.
+client = ServerClient(SERVER_URL, WIRE_FORMAT, timeout=20)
+banner = None  # (text, color, shown until)
+
+
+def embed_crops(crops):
+    """Embed several BGR face crops with a single ArcFace forward pass.
+
+    Returns an (N, d) float32 matrix of L2-normalized embeddings, one row per
+    crop, in the same order as `crops`.
+    """
+    rgbs = [cv2.cvtColor(crop, cv2.COLOR_BGR2RGB) for crop in crops]
+    # Passing a list makes DeepFace stack the preprocessed crops into one batch
+    # and returns one result list per input image.
+    reps = DeepFace.represent(
+        rgbs,
+        model_name=EMBED_MODEL,
+        detector_backend="skip",
+        enforce_detection=False
+    )
+    embs = [r[0]["embedding"] if isinstance(r, list) else r["embedding"] for r in reps]
+    embs = np.array(embs, dtype="float32").reshape(len(crops), -1)
+    return embs / np.linalg.norm(embs, axis=1, keepdims=True)
+
+
+def cached_embeddings(crops, track_ids, qualities):
+    """Like `embed_crops`, but reuses cached embeddings per track ID.
+
+    Only crops without a usable cache entry are sent to ArcFace (as one
+    batch); their fresh embeddings are stored for next time.
+    """
+    embs = [embedding_cache.get(tid, q) for tid, q in zip(track_ids, qualities)]
+    todo = [i for i, e in enumerate(embs) if e is None]
+    if todo:
+        fresh = embed_crops([crops[i] for i in todo])
+        for i, emb in zip(todo, fresh):
+            embs[i] = emb.reshape(1, -1)
+            embedding_cache.put(track_ids[i], embs[i], qualities[i])
+    return np.vstack(embs)
+
+
+# Face tracker
+# With DETECT_EVERY > 1 YOLO only runs every N frames (or sooner when tracks
+# lose confidence); the tracker moves the boxes along in between. Either way
+# it gives each face a stable track ID.
+tracker = FaceTracker(detect_every=DETECT_EVERY)
+
+# Embedding cache
+# Embeddings are cached per track ID so 'r', 's' and 'v' on the same person
+# reuse one ArcFace pass; a new one is computed when the track is new, the
+# entry expires, or a noticeably better crop comes along.
+embedding_cache = EmbeddingCache()
+
+
+def detect_faces(frame):
+    # Run YOLO on the frame to get detections. `results[0].boxes` contains
+    # bounding boxes along with confidence scores.
+    results = model(frame, verbose=False)
+
+    # Filter by CONF_THRESH, compute areas and padded crop boxes for all
+    # detections at once (see detections.py). Returns a Detections tuple of
+    # arrays: xyxy, padded, area, conf and the index of the largest face.
+    return postprocess(results[0].boxes, frame.shape, CONF_THRESH)
+
 
 # Open webcam
 # Open the default webcam (device 0). Change the index if you have multiple
@@ -49,6 +119,16 @@ print("[INFO] Press 'r' to register face, 's' to search, 'q' to quit")
 
 # `current_crop` stores the most recently-detected face crop (BGR image).
 current_crop = None
+# Track ID and quality (area x confidence) of `current_crop`; they key the
+# embedding cache.
+current_track_id = None
+current_quality = 0.0
+# In MULTI_FACE mode `current_crops`/`current_boxes` hold every face of the
+# latest frame (padded box coordinates, same order as the crops).
+current_crops = []
+current_boxes = []
+current_track_ids = []
+current_qualities = []
 # `register_counter` is used to create unique autogenerated labels when the
 # user registers a new face with the 'r' key.
 register_counter = 0
@@ -60,32 +140,37 @@ while True:
         # If the read failed, exit the loop.
         break
 
-    # Run YOLO on the frame to get detections. `results[0].boxes` contains
-    # bounding boxes along with confidence scores.
-    results = model(frame, verbose=False)
-    boxes = results[0].boxes
-
-    # Convert YOLO detections into a simpler list we can use: (x1,y1,x2,y2,area,conf)
-    faces = []
-    for box in boxes:
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        conf = float(box.conf[0])
-        # Skip weak detections below the configured confidence threshold.
-        if conf < CONF_THRESH:
-            continue
-        area = (x2 - x1) * (y2 - y1)
-        faces.append((int(x1), int(y1), int(x2), int(y2), area, conf))
+    # Detect faces, or (in tracking mode) only detect every DETECT_EVERY
+    # frames and predict the tracked boxes otherwise. Tracked faces carry a
+    # 7th element, the stable track ID.
+    if tracker.needs_detection():
+        dets = detect_faces(frame)
+        faces = tracker.update_arrays(dets.xyxy, dets.conf)
+    else:
+        faces = tracker.predict(frame.shape)
+    embedding_cache.prune(t.track_id for t in tracker.tracks)
+    # Padded crop boxes (10 px, clipped to the frame) and the largest face
+    # for the detected or tracked faces, in the order of `faces`.
+    boxes = from_faces(faces, frame.shape)
+
+    # In multi-face mode keep a crop for every detection so they can be
+    # embedded together in one batch.
+    if MULTI_FACE:
+        current_boxes = [tuple(box) for box in boxes.padded.tolist()]
+        current_crops = [frame[by1:by2, bx1:bx2] for bx1, by1, bx2, by2 in current_boxes]
+        current_track_ids = [f[6] for f in faces]
+        current_qualities = [face_quality(f) for f in faces]
+        for bx1, by1, bx2, by2 in current_boxes:
+            cv2.rectangle(frame, (bx1, by1), (bx2, by2), (0, 255, 0), 2)
 
     # If multiple faces were found, pick the largest by area (assumed closest/
-    # most prominent). We add a small padding before cropping so the face isn't
-    # tightly clipped.
+    # most prominent). Its padded box keeps the face from being tightly
+    # clipped.
     if faces:
-        x1, y1, x2, y2, area, conf = max(faces, key=lambda f: f[4])
-        pad = 10
-        x1p = max(x1 - pad, 0)
-        y1p = max(y1 - pad, 0)
-        x2p = min(x2 + pad, frame.shape[1])
-        y2p = min(y2 + pad, frame.shape[0])
+        largest = faces[boxes.largest]
+        x1, y1, x2, y2, area, conf, current_track_id = largest
+        current_quality = face_quality(largest)
+        x1p, y1p, x2p, y2p = boxes.padded[boxes.largest].tolist()
         # Save the cropped face (BGR color as returned by OpenCV)
         current_crop = frame[y1p:y2p, x1p:x2p]
 
@@ -94,6 +179,19 @@ while True:
         cv2.putText(frame, f"Face ({conf:.2f})", (x1p, y1p - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
+    # Server replies that arrived since the last frame.
+    for job in client.poll():
+        reply = job.reply
+        if reply is not None and reply.ok:
+            print("[✅] Authentication verified — Biometrics UNLOCKED")
+            banner = ("UNLOCKED", (0, 255, 0), time.monotonic() + 1.5)
+        else:
+            detail = job.error if reply is None else f"status {reply.status_code}"
+            print(f"[❌] Authentication failed — Access DENIED ({detail})")
+            banner = ("ACCESS DENIED ❌", (0, 0, 255), time.monotonic() + 1.5)
+    if banner is not None and time.monotonic() < banner[2]:
+        cv2.putText(frame, banner[0], (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.1, banner[1], 3)
+
     # Show the live frame
     cv2.imshow("YOLO + ArcFace + FAISS", frame)
     key = cv2.waitKey(1) & 0xFF
@@ -116,41 +214,23 @@ while True:
         print(f"[+] Capturing embedding for {name}...")
 
         try:
-            # DeepFace expects RGB images, while OpenCV uses BGR.
-            rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            # Get a numeric face embedding using DeepFace. We skip the internal
-            # detector since the crop already contains the face.
-            emb = DeepFace.represent(
-                rgb,
-                model_name=EMBED_MODEL,
-                detector_backend="skip",
-                enforce_detection=False
-            )[0]["embedding"]
-
-            # Convert to float32 numpy array and normalize to unit length. Many
-            # similarity metrics assume L2-normalized vectors.
-            emb_np = np.array(emb, dtype="float32").reshape(1, -1)
-            emb_np = emb_np / np.linalg.norm(emb_np)  # normalize embedding
-
-            # If the FAISS index doesn't exist yet, create a flat L2 index with
-            # the appropriate dimensionality (determined from the embedding).
+            # Normalized (1, d) embedding of the current face; reused from
+            # the cache if this track was already embedded.
+            emb_np = cached_embeddings([current_crop], [current_track_id], [current_quality])
+
+            # The FAISS index is created on the first add (see face_db.FaceDB).
             emb_dim = emb_np.shape[1]
-            if index is None:
-                print(f"[+] Creating FAISS index with dimension {emb_dim}")
-                index = faiss.IndexFlatL2(emb_dim)
 
             # Sanity check: ensure embedding dimension matches the index
             # dimension. If it doesn't match, skip this registration.
-            if index.d != emb_dim:
+            if index is not None and index.d != emb_dim:
                 print("[ERROR] Embedding dimension mismatch. Skipping registration.")
                 continue
 
-            # Add the embedding and label, then persist both to disk.
-            index.add(emb_np)
-            labels.append(name)
-            faiss.write_index(index, DB_PATH)
-            with open(LABELS_PATH, "wb") as f:
-                pickle.dump(labels, f)
+            # Append to the fsynced write-ahead log and the in-memory index;
+            # the snapshot files are rewritten by background compaction.
+            db.add(emb_np, name)
+            index = db.index
             print(f"[✓] {name} added to database.")
         except Exception as e:
             print("[ERROR] Registration failed:", e)
@@ -159,8 +239,9 @@ while True:
     # ===== Search for existing face =====
     elif key == ord('s'):
         # 's' computes an embedding for the currently-detected face and queries
-        # the FAISS index for the nearest neighbor. If the distance is below
-        # DIST_THRESHOLD we treat it as a match.
+        # the FAISS index for the TOP_K nearest templates, grouped by label
+        # into a ranked identity list. If the best identity's cosine
+        # similarity reaches SIM_THRESHOLD we treat it as a match.
         if current_crop is None:
             print("[!] No face detected to search.")
             continue
@@ -168,33 +249,45 @@ while True:
             print("[!] Database is empty.")
             continue
 
+        if MULTI_FACE and current_crops:
+            print(f"[+] Searching {len(current_crops)} faces...")
+            try:
+                # One ArcFace batch and one (N, d) FAISS query for all faces.
+                embs = cached_embeddings(current_crops, current_track_ids, current_qualities)
+                ranked = db.search_identities(embs, TOP_K)
+                for (bx1, by1, _, _), identities in zip(current_boxes, ranked):
+                    name, sim, _ = identities[0] if identities else (None, -1.0, 0)
+                    if sim >= SIM_THRESHOLD:
+                        print(f"[MATCH] {name} (similarity={sim:.4f})")
+                        cv2.putText(frame, f"{name}", (bx1, by1 - 30),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                    else:
+                        print(f"[NO MATCH] Unknown face (similarity={sim:.4f})")
+                        cv2.putText(frame, "Unknown", (bx1, by1 - 30),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+                cv2.imshow("YOLO + ArcFace + FAISS", frame)
+                cv2.waitKey(500)
+            except Exception as e:
+                print("[ERROR] Search failed:", e)
+            continue
+
         print("[+] Searching for closest match...")
         try:
-            rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            emb = DeepFace.represent(
-                rgb,
-                model_name=EMBED_MODEL,
-                detector_backend="skip",
-                enforce_detection=False
-            )[0]["embedding"]
-
-            emb_np = np.array(emb, dtype="float32").reshape(1, -1)
-            emb_np = emb_np / np.linalg.norm(emb_np)  # normalize embedding
-
-            # Search for the single nearest neighbor. `D` contains squared L2
-            # distances for IndexFlatL2, and `I` contains the indices.
-            D, I = index.search(emb_np, 1)
-            name = labels[I[0][0]]
-            dist = float(D[0][0])
-
-            # Compare against the configured distance threshold to decide if
-            # this is a confident match. Lower threshold = stricter matching.
-            if dist < DIST_THRESHOLD:
-                print(f"[MATCH] {name} (distance={dist:.4f})")
+            emb_np = cached_embeddings([current_crop], [current_track_id], [current_quality])
+
+            # One top-k search, grouped into identities ranked by their best
+            # template's cosine similarity (whatever metric the index uses).
+            identities = db.search_identities(emb_np, TOP_K)[0]
+            name, sim, _ = identities[0] if identities else (None, -1.0, 0)
+
+            # Compare against the configured similarity threshold to decide if
+            # this is a confident match. Higher threshold = stricter matching.
+            if sim >= SIM_THRESHOLD:
+                print(f"[MATCH] {name} (similarity={sim:.4f})")
                 cv2.putText(frame, f"{name}", (x1, y1 - 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
             else:
-                print(f"[NO MATCH] Unknown face (distance={dist:.4f})")
+                print(f"[NO MATCH] Unknown face (similarity={sim:.4f})")
                 cv2.putText(frame, "Unknown", (x1, y1 - 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
@@ -213,42 +306,25 @@ while True:
         print("[+] Capturing embedding & sending to server...")
 
         try:
-            rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            emb = DeepFace.represent(
-                rgb,
-                model_name=EMBED_MODEL,
-                detector_backend="skip",
-                enforce_detection=False
-            )[0]["embedding"]
-
-            emb_np = np.array(emb, dtype="float32").reshape(1, -1)
-            emb_np = emb_np / np.linalg.norm(emb_np)
-
-            # Nearest index (optional reference)
+            emb_np = cached_embeddings([current_crop], [current_track_id], [current_quality])
+
+            # Face ID of the nearest enrolled face (optional reference);
+            # removed faces and empty result slots are skipped.
             face_index = -1
             if index is not None and len(labels) > 0:
-                D, I = index.search(emb_np, 1)
-                face_index = int(I[0][0])
+                hits = db.search_labels(emb_np, 1)[0]
+                if hits:
+                    face_index = hits[0][1]
 
             payload = {
                 "face_index": face_index,
-                "embedding": emb_np.flatten().tolist(),
+                "embedding": emb_np,
                 "timestamp": datetime.now().isoformat()
             }
 
-            resp = requests.post(SERVER_URL, json=payload)
-
-            if resp.status_code == 200:
-                print("[✅] Authentication verified — Biometrics UNLOCKED")
-                cv2.putText(frame, "UNLOCKED", (50, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 255, 0), 3)
-            else:
-                print("[❌] Authentication failed — Access DENIED")
-                cv2.putText(frame, "ACCESS DENIED ❌", (50, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 0, 255), 3)
-
-            cv2.imshow("YOLO + ArcFace + FAISS", frame)
-            cv2.waitKey(800)
+            # Posted to SERVER_URL itself, as before; the result is shown
+            # when it arrives (see client.poll() above).
+            client.submit("", payload, tag=("verify", face_index))
 
         except Exception as e:
             print("[ERROR] Failed to process:", e)
@@ -258,3 +334,5 @@ while True:
 
 cap.release()
 cv2.destroyAllWindows()
+client.close()
+db.close()
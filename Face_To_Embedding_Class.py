@@ -2,79 +2,233 @@ from ultralytics import YOLO
 from deepface import DeepFace
 import cv2
 import numpy as np
-import faiss
-import os
-import pickle
 from datetime import datetime
 
+from detections import from_faces, postprocess, to_faces
+from embedding_cache import EmbeddingCache, face_quality
+from face_db import FaceDB
+from face_tracker import FaceTracker
+from metrics import REGISTRY
+
+# Hot-path metrics (see metrics.py); exported by whoever runs the system,
+# e.g. headless.py --metrics.
+DETECT_SECONDS = REGISTRY.histogram("face_detect_seconds", "YOLO forward pass + post-processing per frame")
+EMBED_SECONDS = REGISTRY.histogram("face_embed_seconds", "ArcFace pass per batch of crops")
+SEARCH_SECONDS = REGISTRY.histogram("face_search_seconds", "FAISS identity search per batch of queries")
+FACES = REGISTRY.counter("face_detections_total", "Faces detected or tracked")
+EMBEDDINGS = REGISTRY.counter("face_embeddings_total", "Crops run through ArcFace")
+CACHE_HITS = REGISTRY.counter("face_embedding_cache_hits_total", "Embeddings reused from the track cache")
+MATCHES = REGISTRY.counter("face_matches_total", "Searches at or above sim_thresh")
+MISSES = REGISTRY.counter("face_misses_total", "Searches below sim_thresh")
+ERRORS_REGISTER = REGISTRY.counter("face_errors_total", "Failed operations", op="register")
+ERRORS_SEARCH = REGISTRY.counter("face_errors_total", "Failed operations", op="search")
+
+
+def embed_crops(crops, embed_model="ArcFace"):
+    # All BGR crops go through the embedding model in a single forward pass
+    # and come back as an (N, d) L2-normalized matrix.
+    if not crops:
+        return np.empty((0, 0), dtype="float32")
+    return embed_rgbs([cv2.cvtColor(crop, cv2.COLOR_BGR2RGB) for crop in crops], embed_model)
+
+
+def embed_rgbs(rgbs, embed_model="ArcFace"):
+    # embed_crops for crops already converted to RGB.
+    reps = DeepFace.represent(
+        rgbs,
+        model_name=embed_model,
+        detector_backend="skip",
+        enforce_detection=False
+    )
+    # A batched call returns one result list per input image.
+    embs = [r[0]["embedding"] if isinstance(r, list) else r["embedding"] for r in reps]
+    embs = np.array(embs, dtype="float32").reshape(len(rgbs), -1)
+    embs = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs
+
 
 class FaceRecognitionSystem:
-    def __init__(self, yolo_weights, db_path, labels_path, conf_thresh=0.5, embed_model="ArcFace", dist_thresh=1.2):
+    def __init__(self, yolo_weights, db_path, labels_path, conf_thresh=0.5, embed_model="ArcFace", sim_thresh=0.4,
+                 multi_face=False, detect_every=1, index_type="auto", nprobe=16, ef_search=64, metric="cosine",
+                 top_k=5, agg="max", mmap=False, compression=None):
         self.yolo_weights = yolo_weights
         self.db_path = db_path
         self.labels_path = labels_path
         self.conf_thresh = conf_thresh
         self.embed_model = embed_model
-        self.dist_thresh = dist_thresh
+        # Cosine similarity a match must reach. 0.4 is the old squared-L2
+        # threshold of 1.2 on unit-length ArcFace embeddings.
+        self.sim_thresh = sim_thresh
+        # multi_face=True keeps every detected face (not just the largest) and
+        # embeds/searches them together in one batch.
+        self.multi_face = multi_face
+        # FAISS index selection (flat -> IVF -> HNSW as the gallery grows) and
+        # its latency/recall knobs; see face_db.FaceDB.
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        # Searches fetch top_k templates and rank identities by their max (or
+        # mean) similarity.
+        self.metric = metric
+        self.top_k = top_k
+        self.agg = agg
+        # mmap=True opens the snapshot read-only and memory-mapped (fast start,
+        # pages shared between processes); registration is then disabled.
+        self.mmap = mmap
+        # compression="sq8" / "fp16" / "pq" keeps compressed codes in RAM and
+        # re-ranks candidates against exact vectors on disk.
+        self.compression = compression
+        # detect_every > 1 runs YOLO only every N frames and lets the tracker
+        # propagate boxes in between. The tracker always assigns stable track
+        # IDs, which key the embedding cache.
+        self.tracker = FaceTracker(detect_every=detect_every)
+        self.embedding_cache = EmbeddingCache()
+        self.frames_seen = 0
+        self.detector_calls = 0
 
         self.model = YOLO(self.yolo_weights)
-        self.index = None
-        self.labels = []
+        self.db = None
         self.current_crop = None
+        self.current_track_id = None
+        self.current_quality = 0.0
+        self.current_crops = []
+        self.current_boxes = []
+        self.current_track_ids = []
+        self.current_qualities = []
         self.register_counter = 0
         self.load_db()
 
     def load_db(self):
-        if os.path.exists(self.db_path) and os.path.exists(self.labels_path):
-            print("[+] Loading existing FAISS index...")
-            self.index = faiss.read_index(self.db_path)
-            with open(self.labels_path, "rb") as f:
-                self.labels = pickle.load(f)
+        # Snapshot + write-ahead log; see face_db.FaceDB.
+        self.db = FaceDB(self.db_path, self.labels_path, index_type=self.index_type,
+                         nprobe=self.nprobe, ef_search=self.ef_search, metric=self.metric,
+                         mmap=self.mmap, compression=self.compression)
+
+    @property
+    def index(self):
+        return self.db.index
+
+    @property
+    def labels(self):
+        return self.db.labels
+
+    def detect(self, frame):
+        # Returns a detections.Detections (struct of arrays) above conf_thresh.
+        with DETECT_SECONDS.time():
+            results = self.model(frame, verbose=False)
+            return postprocess(results[0].boxes, frame.shape, self.conf_thresh)
+
+    def detect_faces(self, frame):
+        # Returns a list of (x1, y1, x2, y2, area, conf) above conf_thresh.
+        return to_faces(self.detect(frame))
+
+    def locate_faces(self, frame):
+        # Like detect_faces, but goes through the tracker. Tracked faces carry
+        # a 7th element: the track ID.
+        self.frames_seen += 1
+        if self.tracker.needs_detection():
+            self.detector_calls += 1
+            dets = self.detect(frame)
+            faces = self.tracker.update_arrays(dets.xyxy, dets.conf)
         else:
-            print("[+] No existing FAISS DB. It will be created on first registration.")
+            faces = self.tracker.predict(frame.shape)
+        self.embedding_cache.prune(t.track_id for t in self.tracker.tracks)
+        FACES.inc(len(faces))
+        return faces
 
     def get_embedding(self, crop):
         rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
-        emb = DeepFace.represent(
-            rgb,
-            model_name=self.embed_model,
-            detector_backend="skip",
-            enforce_detection=False
-        )[0]["embedding"]
+        with EMBED_SECONDS.time():
+            emb = DeepFace.represent(
+                rgb,
+                model_name=self.embed_model,
+                detector_backend="skip",
+                enforce_detection=False
+            )[0]["embedding"]
+        EMBEDDINGS.inc()
         emb = np.array(emb, dtype="float32").reshape(1, -1)
         emb = emb / np.linalg.norm(emb)
         return emb
 
+    def get_embeddings(self, crops):
+        # Batched version of get_embedding: one ArcFace pass for all crops.
+        with EMBED_SECONDS.time():
+            embs = embed_crops(crops, self.embed_model)
+        EMBEDDINGS.inc(len(crops))
+        return embs
+
+    def get_embeddings_cached(self, crops, track_ids, qualities):
+        # get_embeddings, but only crops whose track has no usable cached
+        # embedding go through ArcFace (still as one batch).
+        embs = [None] * len(crops)
+        todo = []
+        for i, (track_id, quality) in enumerate(zip(track_ids, qualities)):
+            if track_id is not None:
+                embs[i] = self.embedding_cache.get(track_id, quality)
+            if embs[i] is None:
+                todo.append(i)
+
+        CACHE_HITS.inc(len(crops) - len(todo))
+        if todo:
+            fresh = self.get_embeddings([crops[i] for i in todo])
+            for i, emb in zip(todo, fresh):
+                embs[i] = emb.reshape(1, -1)
+                if track_ids[i] is not None:
+                    self.embedding_cache.put(track_ids[i], embs[i], qualities[i])
+        return np.vstack(embs) if embs else np.empty((0, 0), dtype="float32")
+
+    def embed_current(self):
+        # Embedding of current_crop, reused from the cache while the same
+        # track is in view and the crop has not become noticeably better.
+        return self.get_embeddings_cached([self.current_crop], [self.current_track_id],
+                                          [self.current_quality])
+
+    def identify(self, embs):
+        # Best (label, similarity) per query row; label is None below sim_thresh.
+        results = []
+        with SEARCH_SECONDS.time():
+            identities = self.db.search_identities(embs, self.top_k, self.agg)
+        for ranked in identities:
+            name, sim, _ = ranked[0] if ranked else (None, -1.0, 0)
+            results.append((name if sim >= self.sim_thresh else None, sim))
+        matched = sum(1 for name, _ in results if name is not None)
+        MATCHES.inc(matched)
+        MISSES.inc(len(results) - matched)
+        return results
+
     def register_face(self):
         if self.current_crop is None:
             print("[!] No face detected to register.")
             return
 
-        self.register_counter += 1
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        name = f"face_{self.register_counter}_{timestamp}"
+        name = self.next_label()
 
         try:
-            emb = self.get_embedding(self.current_crop)
-            emb_dim = emb.shape[1]
-
-            if self.index is None:
-                print(f"[+] Creating FAISS index with dim {emb_dim}")
-                self.index = faiss.IndexFlatL2(emb_dim)
-
-            if self.index.d != emb_dim:
-                print("[ERROR] Embedding dimension mismatch.")
-                return
-
-            self.index.add(emb)
-            self.labels.append(name)
-            faiss.write_index(self.index, self.db_path)
-            with open(self.labels_path, "wb") as f:
-                pickle.dump(self.labels, f)
-            print(f"[✓] Registered {name}")
+            emb = self.embed_current()
+            self.register_embedding(emb, name)
         except Exception as e:
+            ERRORS_REGISTER.inc()
             print("[ERROR] Registration failed:", e)
 
+    def register_embedding(self, emb, name):
+        if self.db.read_only:
+            print("[ERROR] FAISS DB is open read-only (mmap); registration is disabled.")
+            return False
+        if self.index is not None and self.index.d != emb.shape[1]:
+            print("[ERROR] Embedding dimension mismatch.")
+            return False
+
+        # Fsynced append to the write-ahead log; the snapshot files are
+        # rewritten by background compaction, not on every registration.
+        self.db.add(emb, name)
+        print(f"[✓] Registered {name}")
+        return True
+
+    def next_label(self):
+        self.register_counter += 1
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return f"face_{self.register_counter}_{timestamp}"
+
     def search_face(self, frame, x1, y1):
         if self.current_crop is None:
             print("[!] No face detected.")
@@ -84,18 +238,40 @@ class FaceRecognitionSystem:
             return
 
         try:
-            emb = self.get_embedding(self.current_crop)
-            D, I = self.index.search(emb, 1)
-            name = self.labels[I[0][0]]
-            dist = float(D[0][0])
+            emb = self.embed_current()
+            name, sim = self.identify(emb)[0]
 
-            if dist < self.dist_thresh:
-                print(f"[MATCH] {name} ({dist:.4f})")
+            if name is not None:
+                print(f"[MATCH] {name} (similarity={sim:.4f})")
                 cv2.putText(frame, name, (x1, y1 - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,255), 2)
             else:
-                print(f"[NO MATCH] ({dist:.4f})")
+                print(f"[NO MATCH] (similarity={sim:.4f})")
                 cv2.putText(frame, "Unknown", (x1, y1 - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
         except Exception as e:
+            ERRORS_SEARCH.inc()
+            print("[ERROR] Search failed:", e)
+
+    def search_faces(self, frame):
+        if not self.current_crops:
+            print("[!] No face detected.")
+            return
+        if self.index is None or len(self.labels) == 0:
+            print("[!] Database empty.")
+            return
+
+        try:
+            embs = self.get_embeddings_cached(self.current_crops, self.current_track_ids,
+                                              self.current_qualities)
+            # One (N, d) query for all faces in the frame.
+            for (x1, y1, x2, y2), (name, sim) in zip(self.current_boxes, self.identify(embs)):
+                if name is not None:
+                    print(f"[MATCH] {name} (similarity={sim:.4f})")
+                    cv2.putText(frame, name, (x1, y1 - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,255), 2)
+                else:
+                    print(f"[NO MATCH] (similarity={sim:.4f})")
+                    cv2.putText(frame, "Unknown", (x1, y1 - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,255), 2)
+        except Exception as e:
+            ERRORS_SEARCH.inc()
             print("[ERROR] Search failed:", e)
 
     def run(self):
@@ -107,45 +283,51 @@ class FaceRecognitionSystem:
             if not ret:
                 break
 
-            results = self.model(frame, verbose=False)
-            boxes = results[0].boxes
-            faces = []
+            faces = self.locate_faces(frame)
+            boxes = from_faces(faces, frame.shape)
 
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                conf = float(box.conf[0])
-                if conf < self.conf_thresh:
-                    continue
-                area = (x2 - x1) * (y2 - y1)
-                faces.append((int(x1), int(y1), int(x2), int(y2), area, conf))
+            if self.multi_face:
+                self.current_boxes = [tuple(box) for box in boxes.padded.tolist()]
+                self.current_crops = [frame[y1p:y2p, x1p:x2p] for x1p, y1p, x2p, y2p in self.current_boxes]
+                self.current_track_ids = [f[6] for f in faces]
+                self.current_qualities = [face_quality(f) for f in faces]
+                for x1p, y1p, x2p, y2p in self.current_boxes:
+                    cv2.rectangle(frame, (x1p, y1p), (x2p, y2p), (0,255,0), 2)
 
             if faces:
-                x1, y1, x2, y2, area, conf = max(faces, key=lambda f: f[4])
-                pad = 10
-                x1p = max(x1 - pad, 0)
-                y1p = max(y1 - pad, 0)
-                x2p = min(x2 + pad, frame.shape[1])
-                y2p = min(y2 + pad, frame.shape[0])
+                largest = faces[boxes.largest]
+                track_id = largest[6]
+                x1p, y1p, x2p, y2p = boxes.padded[boxes.largest].tolist()
                 self.current_crop = frame[y1p:y2p, x1p:x2p]
-                cv2.rectangle(frame, (x1p, y1p), (x2p, y2p), (0,255,0), 2)
+                self.current_track_id = track_id
+                self.current_quality = face_quality(largest)
+                if not self.multi_face:
+                    cv2.rectangle(frame, (x1p, y1p), (x2p, y2p), (0,255,0), 2)
 
             cv2.imshow("Face Recognition", frame)
             key = cv2.waitKey(1) & 0xFF
             if key == ord('r'):
                 self.register_face()
             elif key == ord('s') and faces:
-                self.search_face(frame, x1p, y1p)
+                if self.multi_face:
+                    self.search_faces(frame)
+                else:
+                    self.search_face(frame, x1p, y1p)
             elif key == ord('q'):
                 break
 
         cap.release()
         cv2.destroyAllWindows()
+        self.db.close()
+        if self.tracker.detect_every > 1:
+            print(f"[INFO] Detector ran on {self.detector_calls}/{self.frames_seen} frames")
 
 
-app = FaceRecognitionSystem(
-    yolo_weights=r"C:\YoLo-Face\runs\detect\train3\weights\best.pt",
-    db_path="face_db.index",
-    labels_path="face_labels.pkl"
-)
+if __name__ == "__main__":
+    app = FaceRecognitionSystem(
+        yolo_weights=r"C:\YoLo-Face\runs\detect\train3\weights\best.pt",
+        db_path="face_db.index",
+        labels_path="face_labels.pkl"
+    )
 
-app.run()
+    app.run()
@@ -0,0 +1,82 @@
+# Send the enrolled templates of an existing FAISS DB to the server.
+#
+#     python backfill_templates.py https://server.example
+#     python backfill_templates.py http://localhost:5000 --db face_db.index --batch-size 256
+#
+# The server verifies /face-verify requests against the template it keeps for
+# each face_index (template_store.py), filled by /face-data at registration.
+# Faces registered before the server kept templates are not in its store and
+# are rejected as "not enrolled" until they are sent again. This posts the
+# latest template of every label in the local DB to /face-data, in batches.
+# Re-running it is harmless: a later record for a key replaces the earlier one.
+# Cosine DBs hold L2-normalized vectors and clients send RAW live embeddings;
+# that is fine, the server normalizes both before comparing (verifiers.py).
+import argparse
+import os
+import sys
+
+import requests
+
+from face_db import FaceDB, snapshot_exists
+from wire_format import FORMATS, pack, unpack
+
+DB_PATH = "face_db.index"
+LABELS_PATH = "face_labels.pkl"
+SERVER_URL = "http://localhost:5000"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register every face in the FAISS DB with the server.")
+    parser.add_argument("server", nargs="?", default=SERVER_URL)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--labels", default=LABELS_PATH)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--wire-format", default="msgpack", choices=[f for f in FORMATS if f != "legacy"])
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    if not snapshot_exists(args.db, args.labels) and not os.path.exists(args.db + ".wal"):
+        print("[!] No FAISS database found.")
+        return 1
+    db = FaceDB(args.db, args.labels, compact_every=0)
+    if db.index is None or db.ntotal == 0:
+        print("[!] FAISS database is empty.")
+        db.close()
+        return 1
+    # One template per face_index: the most recently enrolled.
+    latest = {}
+    for face_id, label in db.labels.items():
+        latest[label] = max(face_id, latest.get(label, -1))
+    entries = sorted(latest.items(), key=lambda e: e[1])
+    print(f"[+] Sending {len(entries)} templates to {args.server}/face-data")
+
+    session = requests.Session()
+    sent = failed = 0
+    for start in range(0, len(entries), args.batch_size):
+        batch = entries[start:start + args.batch_size]
+        vectors = db.get_vectors([face_id for _, face_id in batch])
+        items = [{"face_index": label, "embedding": vector} for (label, _), vector in zip(batch, vectors)]
+        body, headers = pack({"items": items}, args.wire_format)
+        try:
+            resp = session.post(args.server.rstrip("/") + "/face-data", data=body, headers=headers,
+                                timeout=args.timeout)
+            results = unpack(resp.content, resp.headers.get("Content-Type"))["results"]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            print(f"[ERROR] Batch at {start} failed: {e}")
+            failed += len(batch)
+            continue
+        for result in results:
+            if result.get("status") == "verified":
+                sent += 1
+            else:
+                failed += 1
+                print(f"[WARN] {result.get('face_index')}: {result.get('error')}")
+        print(f"  {sent + failed}/{len(entries)}")
+
+    db.close()
+    print(f"[✓] {sent} templates registered, {failed} failed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
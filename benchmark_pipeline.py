@@ -0,0 +1,365 @@
+# Per-stage latency benchmark for the recognition pipeline: no camera, no
+# display. Frames go one at a time through FaceRecognitionSystem's own
+# detect / embed / search steps, each stage timed on its own.
+#
+#     python benchmark_pipeline.py                            # synthetic frames
+#     python benchmark_pipeline.py footage.mp4 --frames 500   # or a directory / sequence pattern
+#     python benchmark_pipeline.py --gallery 100000           # search a synthetic gallery of that size
+#     python benchmark_pipeline.py --server https://xxxx.ngrok-free.app   # + the /face-verify POST
+#     python benchmark_pipeline.py --json new.json --compare old.json
+#
+# Stages:
+#   read    cap.read() (decode); synthetic frames are pre-rendered
+#   detect  locate_faces: YOLO + post-processing (+ tracker, --detect-every)
+#   crop    padded boxes (detections.from_faces) + slicing
+#   color   cv2.cvtColor BGR -> RGB
+#   embed   DeepFace.represent (ArcFace, one batch per frame) + normalization
+#   search  FAISS search grouped by identity (identify)
+#   post    verify request to server.py (only with --server)
+#   total   all of the above for one frame
+#
+# p50 / p95 / p99 per stage, frames/sec and peak RSS are printed and, with
+# --json, written as one JSON document (with the git commit) so runs of two
+# commits can be compared: --compare flags stages whose p50 / p95 grew by
+# more than --tolerance and exits with status 1.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from detections import from_faces
+from metrics import Window
+
+STAGES = ("read", "detect", "crop", "color", "embed", "search", "post", "total")
+# ArcFace embedding size, for the synthetic gallery.
+EMBED_DIM = 512
+SYNTHETIC_SIZE = (1280, 720)
+SYNTHETIC_POOL = 16
+WARMUP = 5
+# Latency changes smaller than this are timer noise, not regressions.
+MIN_DELTA_MS = 0.05
+
+
+def synthetic_frames(n, width, height, faces, seed=0):
+    """`n` distinct frames with `faces` skin-toned ellipses each; returns
+    [(frame, [(x1, y1, x2, y2), ...]), ...]."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(n):
+        frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+        frame = cv2.GaussianBlur(frame, (0, 0), 8)
+        boxes = []
+        for i in range(faces):
+            w = int(width / (faces + 1) * rng.uniform(0.4, 0.7))
+            h = int(w * 1.3)
+            x1 = int((i + 0.5) * width / (faces + 1))
+            y1 = int(rng.uniform(0.1, 0.9) * max(1, height - h))
+            center = (x1 + w // 2, y1 + h // 2)
+            cv2.ellipse(frame, center, (w // 2, h // 2), 0, 0, 360, (140, 170, 220), -1)
+            for dx in (-w // 5, w // 5):
+                cv2.circle(frame, (center[0] + dx, center[1] - h // 8), max(2, w // 12), (40, 40, 40), -1)
+            boxes.append((x1, y1, min(width, x1 + w), min(height, y1 + h)))
+        frames.append((frame, boxes))
+    return frames
+
+
+class SyntheticSource:
+    """cv2.VideoCapture look-alike cycling over pre-rendered frames."""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.pos = 0
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        frame, boxes = self.frames[self.pos % len(self.frames)]
+        self.pos += 1
+        self.boxes = boxes
+        return True, frame
+
+    def release(self):
+        pass
+
+
+def fill_gallery(db, n, seed=0):
+    from compression_report import synthetic_gallery
+
+    print(f"[+] Enrolling a synthetic gallery of {n} faces...")
+    embs = synthetic_gallery(n, EMBED_DIM, max(1, n // 100), 0.5, seed)
+    db.add_batch(embs, [f"bench_{i}" for i in range(n)], migrate=False)
+    db.migrate()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        # Windows: the peak working set, if psutil is available.
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2 ** 20, 1)
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes.
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Poster:
+    """Times the verify round trip to server.py with the clients' wire format."""
+
+    def __init__(self, base_url, wire_format, dtype, timeout):
+        import requests
+        from wire_format import pack
+
+        self.session = requests.Session()
+        self.url = base_url.rstrip("/") + "/face-verify"
+        self.pack = pack
+        self.wire_format = wire_format
+        self.dtype = dtype
+        self.timeout = timeout
+        self.errors = 0
+
+    def post(self, labels, embs):
+        items = [{"face_index": label or "bench_unknown", "embedding": emb} for label, emb in zip(labels, embs)]
+        payload = items[0] if len(items) == 1 else {"items": items}
+        body, headers = self.pack(payload, self.wire_format, self.dtype)
+        try:
+            resp = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+            if resp.status_code >= 500:
+                self.errors += 1
+        except Exception:
+            self.errors += 1
+
+    def close(self):
+        self.session.close()
+
+
+def run(system, cap, frames, warmup, planted, poster=None):
+    """Feed `frames` frames (after `warmup` untimed ones) through `system`;
+    returns ({stage: Window}, counters, seconds)."""
+    from Face_To_Embedding_Class import embed_rgbs
+
+    stats = {stage: Window(max(frames, 1)) for stage in STAGES}
+    counts = {"frames": 0, "faces": 0, "detected_frames": 0, "planted_frames": 0, "matches": 0}
+    started = None
+
+    for i in range(warmup + frames):
+        if i == warmup:
+            started = time.perf_counter()
+            counts = dict.fromkeys(counts, 0)
+        timed = i >= warmup
+        t = {}
+
+        t0 = time.perf_counter()
+        ret, frame = cap.read()
+        if not ret:
+            print("[!] Source ended.")
+            break
+        t["read"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        faces = system.locate_faces(frame)
+        t["detect"] = time.perf_counter() - t0
+        if faces:
+            counts["detected_frames"] += 1
+        elif planted and getattr(cap, "boxes", None):
+            # Synthetic frames rarely fool the detector; downstream stages
+            # then run on the planted face boxes instead.
+            faces = [(x1, y1, x2, y2, (x2 - x1) * (y2 - y1), 1.0, None) for x1, y1, x2, y2 in cap.boxes]
+            counts["planted_frames"] += 1
+        if faces:
+            t0 = time.perf_counter()
+            dets = from_faces(faces, frame.shape)
+            boxes = dets.padded.tolist()
+            if not system.multi_face:
+                faces = [faces[dets.largest]]
+                boxes = [boxes[dets.largest]]
+            crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+            t["crop"] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            rgbs = [cv2.cvtColor(crop, cv2.COLOR_BGR2RGB) for crop in crops]
+            t["color"] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            embs = embed_rgbs(rgbs, system.embed_model)
+            t["embed"] = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            results = system.identify(embs)
+            t["search"] = time.perf_counter() - t0
+
+            if poster is not None:
+                t0 = time.perf_counter()
+                poster.post([name for name, _ in results], embs)
+                t["post"] = time.perf_counter() - t0
+
+            counts["faces"] += len(faces)
+            counts["matches"] += sum(1 for name, _ in results if name is not None)
+
+        t["total"] = sum(t.values())
+        if timed:
+            counts["frames"] += 1
+            for stage, seconds in t.items():
+                stats[stage].record(seconds)
+
+    seconds = time.perf_counter() - started if started is not None else 0.0
+    return stats, counts, seconds
+
+
+def report(result):
+    print(f"\n=== Pipeline latency: {result['frames']} frames of {result['source']} ===")
+    print(f"{'stage':<8}{'n':>7}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}   ms")
+    for stage, s in result["stages_ms"].items():
+        print(f"{stage:<8}{s['count']:>7}{s['mean']:>10.2f}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}")
+    print(f"[STATS] {result['fps']:.1f} fps, {result['faces']} faces "
+          f"({result['detected_frames']} frames with detections, {result['planted_frames']} planted), "
+          f"peak RSS {result['peak_rss_mb']} MB")
+
+
+def compare(result, baseline, tolerance):
+    """Print p50 / p95 / fps changes against a previous --json run; returns
+    the list of regressions beyond `tolerance` (a fraction)."""
+    print(f"\n=== vs {baseline.get('commit') or '?'} ({baseline.get('timestamp', '?')}) ===")
+    for key in ("source", "config"):
+        if baseline.get(key) != result[key]:
+            print(f"[WARN] Baseline {key} differs: {baseline.get(key)}")
+    regressions = []
+    for stage, s in result["stages_ms"].items():
+        old = baseline.get("stages_ms", {}).get(stage)
+        if not old or not s["count"]:
+            continue
+        cells = []
+        for key in ("p50", "p95"):
+            change = (s[key] - old[key]) / old[key] if old[key] else 0.0
+            cells.append(f"{key} {old[key]:8.2f} -> {s[key]:8.2f} ({change:+6.1%})")
+            if change > tolerance and s[key] - old[key] > MIN_DELTA_MS:
+                regressions.append(f"{stage} {key} {change:+.1%}")
+        print(f"  {stage:<8}" + "   ".join(cells))
+    if baseline.get("fps"):
+        change = (result["fps"] - baseline["fps"]) / baseline["fps"]
+        print(f"  fps      {baseline['fps']:8.1f} -> {result['fps']:8.1f} ({change:+6.1%})")
+        if -change > tolerance:
+            regressions.append(f"fps {change:+.1%}")
+    for r in regressions:
+        print(f"[WARN] Regression: {r}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency benchmark of the recognition pipeline.")
+    parser.add_argument("source", nargs="?", default=None,
+                        help="video file, image directory or sequence pattern (default: synthetic frames)")
+    parser.add_argument("--frames", type=int, default=300, help="timed frames")
+    parser.add_argument("--warmup", type=int, default=WARMUP, help="untimed frames first (model warm-up)")
+    parser.add_argument("--faces", type=int, default=1, help="faces per synthetic frame")
+    parser.add_argument("--size", default=f"{SYNTHETIC_SIZE[0]}x{SYNTHETIC_SIZE[1]}", help="synthetic frame size")
+    parser.add_argument("--weights", default=r"C:\YoLo-Face\runs\detect\train3\weights\best.pt")
+    parser.add_argument("--db", default=None, help="FAISS DB to search (default: an empty scratch DB)")
+    parser.add_argument("--labels", default=None)
+    parser.add_argument("--gallery", type=int, default=0, help="enroll N synthetic faces into the scratch DB")
+    parser.add_argument("--largest-only", action="store_true", help="only the largest face per frame")
+    parser.add_argument("--detect-every", type=int, default=1)
+    parser.add_argument("--server", default=None, help="also time POST /face-verify to this server.py URL")
+    parser.add_argument("--wire-format", default="msgpack")
+    parser.add_argument("--wire-dtype", default="f32")
+    parser.add_argument("--json", default=None, help="write the results here")
+    parser.add_argument("--compare", default=None, help="previous --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed p50 / p95 / fps change")
+    args = parser.parse_args()
+
+    from Face_To_Embedding_Class import FaceRecognitionSystem
+    from headless import open_source
+
+    scratch = None
+    if args.db is None:
+        scratch = tempfile.mkdtemp(prefix="benchmark_pipeline_")
+        args.db, args.labels = os.path.join(scratch, "face_db.index"), os.path.join(scratch, "face_labels.pkl")
+    system = FaceRecognitionSystem(
+        yolo_weights=args.weights,
+        db_path=args.db,
+        labels_path=args.labels or "face_labels.pkl",
+        multi_face=not args.largest_only,
+        detect_every=args.detect_every
+    )
+    if args.gallery:
+        fill_gallery(system.db, args.gallery)
+    config = {"multi_face": not args.largest_only, "detect_every": args.detect_every,
+              "gallery": system.db.ntotal, "index": type(system.index).__name__ if system.index else None,
+              "server": args.server, "wire_format": args.wire_format if args.server else None}
+
+    if args.source is None:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        cap = SyntheticSource(synthetic_frames(SYNTHETIC_POOL, width, height, args.faces))
+        source = f"synthetic {width}x{height}, {args.faces} face(s)"
+    else:
+        cap = open_source(args.source)
+        if not cap.isOpened():
+            print(f"[ERROR] Cannot open {args.source}")
+            return 1
+        source = args.source
+    poster = Poster(args.server, args.wire_format, args.wire_dtype, timeout=30) if args.server else None
+
+    print(f"[+] {args.warmup} warm-up + {args.frames} timed frames from {source}")
+    try:
+        stats, counts, seconds = run(system, cap, args.frames, args.warmup, args.source is None, poster)
+    finally:
+        cap.release()
+        if poster is not None:
+            poster.close()
+        system.db.close()
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "source": source,
+        "platform": f"{platform.platform()}, Python {platform.python_version()}",
+        "config": config,
+        **counts,
+        "seconds": round(seconds, 3),
+        "fps": round(counts["frames"] / seconds, 2) if seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages_ms": {stage: s.summary(scale=1000, digits=3) for stage, s in stats.items() if s.count},
+    }
+    if poster is not None:
+        result["post_errors"] = poster.errors
+    report(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"[✓] Wrote {args.json}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# Bulk offline enrollment: register every face photo in a directory (or a
+# manifest) into the FAISS DB in one run.
+#
+#     python bulk_enroll.py photos/                 # photos/<label>/*.jpg or photos/<label>.jpg
+#     python bulk_enroll.py manifest.csv            # rows of: path,label
+#     python bulk_enroll.py photos/ --workers 8 --batch-size 64
+#
+# Worker processes decode images and run YOLO (same weights and post-processing
+# as FaceRecognitionSystem), keeping the largest face of each photo. The main
+# process embeds the crops in ArcFace batches and commits each batch with one
+# write-ahead-log fsync and one index add. Migration to IVF / HNSW and the
+# snapshot happen once, at the end.
+#
+# Re-running the same command resumes: a journal (`<db>.enrolled`) records
+# each photo with the face ID it was committed under, and photos whose ID
+# still holds their label (or that had no face) are skipped.
+import argparse
+import csv
+import multiprocessing as mp
+import os
+import time
+
+import cv2
+
+from detections import postprocess
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+YOLO_WEIGHTS = r"C:\YoLo-Face\runs\detect\train3\weights\best.pt"
+DB_PATH = "face_db.index"
+LABELS_PATH = "face_labels.pkl"
+
+# Per-worker YOLO model, loaded once by the pool initializer.
+_model = None
+_conf_thresh = 0.5
+
+
+def list_images(source):
+    """(path, label) pairs from a directory or a CSV manifest."""
+    if os.path.isdir(source):
+        items = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in IMAGE_EXTS:
+                    continue
+                # photos/alice/1.jpg -> "alice", photos/alice.jpg -> "alice"
+                label = os.path.basename(root) if os.path.abspath(root) != os.path.abspath(source) else stem
+                items.append((os.path.abspath(os.path.join(root, name)), label))
+        return items
+
+    base = os.path.dirname(os.path.abspath(source))
+    items = []
+    with open(source, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#") or row[:2] == ["path", "label"]:
+                continue
+            path = row[0] if os.path.isabs(row[0]) else os.path.join(base, row[0])
+            label = row[1] if len(row) > 1 and row[1] else os.path.splitext(os.path.basename(path))[0]
+            items.append((os.path.abspath(path), label))
+    return items
+
+
+def read_journal(path):
+    # path -> face ID (-1 = skipped: unreadable or no face)
+    done = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                face_id, _, image_path = line.rstrip("\n").partition("\t")
+                if image_path:
+                    done[image_path] = int(face_id)
+    return done
+
+
+def append_journal(journal, entries):
+    journal.write("".join(f"{face_id}\t{path}\n" for face_id, path in entries))
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def _init_worker(weights, conf_thresh):
+    global _model, _conf_thresh
+    from ultralytics import YOLO
+    _model = YOLO(weights)
+    _conf_thresh = conf_thresh
+
+
+def _detect(item):
+    """Worker: decode one photo and crop its largest face."""
+    path, label = item
+    img = cv2.imread(path)
+    if img is None:
+        return path, label, None, "unreadable"
+    results = _model(img, verbose=False)
+    dets = postprocess(results[0].boxes, img.shape, _conf_thresh)
+    if dets.largest < 0:
+        return path, label, None, "no face"
+    x1, y1, x2, y2 = dets.padded[dets.largest]
+    return path, label, img[y1:y2, x1:x2].copy(), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-enroll face photos into the FAISS DB.")
+    parser.add_argument("source", help="image directory, or a CSV manifest of path,label rows")
+    parser.add_argument("--weights", default=YOLO_WEIGHTS)
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--labels", default=LABELS_PATH)
+    parser.add_argument("--journal", default=None, help="resume journal (default: <db>.enrolled)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--embed-model", default="ArcFace")
+    parser.add_argument("--metric", default="cosine", help="metric for a new DB")
+    parser.add_argument("--index-type", default="auto")
+    parser.add_argument("--compression", default=None)
+    args = parser.parse_args()
+
+    # Heavy imports after argument parsing (and only in the main process).
+    from Face_To_Embedding_Class import embed_crops
+    from face_db import FaceDB
+
+    journal_path = args.journal or args.db + ".enrolled"
+    items = list_images(args.source)
+    db = FaceDB(args.db, args.labels, compact_every=0, index_type=args.index_type, metric=args.metric,
+                compression=args.compression)
+
+    # Resume: skip photos that had no usable face or whose journaled ID still
+    # holds their label. Anything else (a face removed since, or a journal
+    # written by an older version before its IDs were committed) is redone.
+    done = read_journal(journal_path)
+    todo = [(path, label) for path, label in items
+            if not (path in done and (done[path] < 0 or db.labels.get(done[path]) == label))]
+    print(f"[+] {len(items)} images, {len(items) - len(todo)} already enrolled, {len(todo)} to go")
+    if not todo:
+        db.close()
+        return
+
+    enrolled = skipped = 0
+    embed_s = 0.0
+    start = last_report = time.perf_counter()
+    batch = []
+
+    def commit(batch):
+        nonlocal enrolled, embed_s
+        t0 = time.perf_counter()
+        embs = embed_crops([crop for _, _, crop in batch], args.embed_model)
+        embed_s += time.perf_counter() - t0
+        # Journal only the IDs add_batch committed: IDs handed out by a batch
+        # that never reached the WAL are given to other photos on the next
+        # run. A crash between the two re-enrolls the batch (a duplicate
+        # template under the same label), never skips a photo.
+        face_ids = db.add_batch(embs, [label for _, label, _ in batch], migrate=False)
+        append_journal(journal, [(face_id, path) for face_id, (path, _, _) in zip(face_ids, batch)])
+        enrolled += len(batch)
+
+    with open(journal_path, "a", encoding="utf-8") as journal, \
+            mp.Pool(args.workers, initializer=_init_worker, initargs=(args.weights, args.conf)) as pool:
+        for path, label, crop, reason in pool.imap_unordered(_detect, todo, chunksize=4):
+            if crop is None:
+                print(f"[WARN] {path}: {reason}; skipped.")
+                append_journal(journal, [(-1, path)])
+                skipped += 1
+            else:
+                batch.append((path, label, crop))
+                if len(batch) >= args.batch_size:
+                    commit(batch)
+                    batch = []
+
+            now = time.perf_counter()
+            if now - last_report >= 5.0:
+                done_n = enrolled + skipped + len(batch)
+                print(f"[+] {done_n}/{len(todo)} images, {done_n / (now - start):.1f} img/s")
+                last_report = now
+        if batch:
+            commit(batch)
+
+    # One migration check and one snapshot for the whole run.
+    if not db.migrate():
+        db.compact(force=True)
+    db.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"[✓] Enrolled {enrolled} faces ({skipped} skipped) in {elapsed:.1f}s: "
+          f"{(enrolled + skipped) / elapsed:.1f} img/s, embedding {embed_s:.1f}s "
+          f"({enrolled / max(embed_s, 1e-9):.1f} faces/s), DB now holds {db.ntotal} faces.")
+
+
+if __name__ == "__main__":
+    main()
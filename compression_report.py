@@ -0,0 +1,111 @@
+import time
+
+import faiss
+import numpy as np
+
+from face_db import build_index, describe, index_codec, rerank
+
+# Recall@1 vs memory for the FaceDB index modes, on a synthetic gallery of
+# unit-length embeddings (identities grouped in clusters, queries are noisy
+# re-captures of enrolled identities). Recall@1 is agreement with an exact
+# flat search, so it measures only what compression / ANN search lose.
+GALLERY_SIZE = 100000
+DIM = 512
+CLUSTERS = 1000
+# Noise norms relative to the unit vectors: identities around their cluster
+# center, queries around their identity (cos ~0.55 to the enrolled face).
+CLUSTER_SPREAD = 0.5
+QUERIES = 1000
+QUERY_NOISE = 1.5
+REFINE_FACTOR = 8
+NPROBE = 16
+EF_SEARCH = 64
+# Gallery size the memory column is extrapolated to.
+TARGET_SIZE = 10_000_000
+
+MODES = [
+    ("flat", None), ("flat", "fp16"), ("flat", "sq8"), ("flat", "pq"),
+    ("ivf", None), ("ivf", "sq8"), ("ivf", "pq"),
+    ("hnsw", None), ("hnsw", "sq8"), ("hnsw", "pq"),
+]
+
+
+def normalize(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def noise(rng, n, d, scale):
+    return scale * rng.standard_normal((n, d)).astype("float32") / np.sqrt(d)
+
+
+def synthetic_gallery(n, d, clusters, spread, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, d)).astype("float32"))
+    return normalize(centers[rng.integers(0, clusters, n)] + noise(rng, n, d, spread))
+
+
+def queries_for(gallery, n, scale, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(gallery), n, replace=False)
+    return normalize(gallery[rows] + noise(rng, n, gallery.shape[1], scale))
+
+
+def tune(index):
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = NPROBE
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = EF_SEARCH
+
+
+def main():
+    print(f"[+] Synthetic gallery: {GALLERY_SIZE} x {DIM}, {QUERIES} queries")
+    gallery = synthetic_gallery(GALLERY_SIZE, DIM, CLUSTERS, CLUSTER_SPREAD)
+    queries = queries_for(gallery, QUERIES, QUERY_NOISE)
+
+    exact = build_index("flat", gallery, metric="cosine")
+    _, truth = exact.search(queries, 1)
+    truth = truth[:, 0]
+
+    rows = []
+    for kind, codec in MODES:
+        name = describe(kind, codec)
+        print(f"[+] Building {name}...")
+        t0 = time.perf_counter()
+        index = build_index(kind, gallery, metric="cosine", codec=codec)
+        build_s = time.perf_counter() - t0
+        tune(index)
+        bytes_per_face = faiss.serialize_index(index).nbytes / GALLERY_SIZE
+
+        t0 = time.perf_counter()
+        _, I = index.search(queries, 1)
+        search_ms = (time.perf_counter() - t0) * 1000 / QUERIES
+        recall = float(np.mean(I[:, 0] == truth))
+
+        # Two-stage search as FaceDB does it for compressed indexes.
+        recall_rerank = None
+        rerank_ms = None
+        if index_codec(index) is not None:
+            t0 = time.perf_counter()
+            _, C = index.search(queries, REFINE_FACTOR)
+            _, I = rerank(queries, C, gallery[np.where(C >= 0, C, 0)], 1, "cosine")
+            rerank_ms = (time.perf_counter() - t0) * 1000 / QUERIES
+            recall_rerank = float(np.mean(I[:, 0] == truth))
+
+        rows.append((name, bytes_per_face, recall, search_ms, recall_rerank, rerank_ms, build_s))
+
+    print(f"\n=== Recall@1 vs memory ({GALLERY_SIZE} faces, refine x{REFINE_FACTOR}) ===")
+    print(f"{'mode':<12}{'B/face':>9}{'RAM @ ' + format(TARGET_SIZE, ',') :>18}"
+          f"{'R@1':>8}{'ms/q':>8}{'R@1 rerank':>12}{'ms/q':>8}{'build s':>9}")
+    for name, bytes_per_face, recall, search_ms, recall_rerank, rerank_ms, build_s in rows:
+        ram_gb = bytes_per_face * TARGET_SIZE / 1e9
+        rr = f"{recall_rerank:.4f}" if recall_rerank is not None else "-"
+        rms = f"{rerank_ms:.3f}" if rerank_ms is not None else "-"
+        print(f"{name:<12}{bytes_per_face:>9.0f}{ram_gb:>15.1f} GB{recall:>8.4f}{search_ms:>8.3f}{rr:>12}{rms:>8}"
+              f"{build_s:>9.1f}")
+    print(f"\nRe-ranked modes also keep the exact vectors on disk (<db>.vectors): "
+          f"{4 * DIM * TARGET_SIZE / 1e9:.1f} GB @ {TARGET_SIZE:,}, memory-mapped, only candidates are read.")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,13 @@ from ultralytics import YOLO
 from deepface import DeepFace
 import cv2
 import numpy as np
-import faiss
-import os
-import pickle
-import requests
 from datetime import datetime
+import time
+
+from detections import postprocess
+from face_db import FaceDB
+from metrics import REGISTRY
+from server_client import ServerClient
 
 # ===== CONFIG =====
 YOLO_WEIGHTS = r"C:\\YoLo-Face\\runs\\detect\\train3\\weights\\best.pt"
@@ -14,21 +16,31 @@ DB_PATH = "face_db.index"
 LABELS_PATH = "face_labels.pkl"
 CONF_THRESH = 0.5
 EMBED_MODEL = "ArcFace"
-DIST_THRESHOLD = 1.2
+METRIC = "cosine"           # "cosine" or "l2" for new DBs
+SIM_THRESHOLD = 0.4         # Min cosine similarity for a match (= squared L2 distance 1.2 on unit vectors)
 SERVER_URL = "https://noe-uninducible-cheerlessly.ngrok-free.dev"
+WIRE_FORMAT = "msgpack"     # "msgpack" / "json" (base64 vectors) / "legacy" (float lists, old servers)
+WIRE_DTYPE = "f32"          # "f32" / "f16" / "q8" / "q16" (not used by "legacy")
+OUTBOX_PATH = "server_outbox.msgpack"  # registrations waiting for the server while offline
+METRICS_PATH = None        # e.g. "client_metrics.prom" (or .json): detector / embedding / server metrics
 # ===================
 
 model = YOLO(YOLO_WEIGHTS)
 
-index = None
-labels = []
-if os.path.exists(DB_PATH) and os.path.exists(LABELS_PATH):
-    print("[+] Loading existing FAISS index...")
-    index = faiss.read_index(DB_PATH)
-    with open(LABELS_PATH, "rb") as f:
-        labels = pickle.load(f)
-else:
-    print("[+] No existing FAISS DB found. It will be created on first registration.")
+db = FaceDB(DB_PATH, LABELS_PATH, metric=METRIC)
+index = db.index
+labels = db.labels
+
+# Background sender: server replies are shown on the frames after they arrive.
+client = ServerClient(SERVER_URL, WIRE_FORMAT, WIRE_DTYPE, timeout=20, offline_path=OUTBOX_PATH)
+banner = None  # (text, color, shown until)
+
+# Hot-path metrics (metrics.py), written to METRICS_PATH while running.
+FRAMES = REGISTRY.counter("face_frames_total", "Camera frames processed")
+DETECT_SECONDS = REGISTRY.histogram("face_detect_seconds", "YOLO forward pass + post-processing per frame")
+EMBED_SECONDS = REGISTRY.histogram("face_embed_seconds", "ArcFace pass per batch of crops")
+if METRICS_PATH:
+    REGISTRY.export(METRICS_PATH)
 
 cap = cv2.VideoCapture(0)
 print("[INFO] Press 'r' to register face, 's' to search, 'v' to verify, 'q' to quit")
@@ -41,29 +53,39 @@ while True:
     if not ret:
         break
 
-    results = model(frame, verbose=False)
-    boxes = results[0].boxes
+    FRAMES.inc()
+    with DETECT_SECONDS.time():
+        results = model(frame, verbose=False)
+        dets = postprocess(results[0].boxes, frame.shape, CONF_THRESH)
 
-    faces = []
-    for box in boxes:
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        conf = float(box.conf[0])
-        if conf < CONF_THRESH:
-            continue
-        area = (x2 - x1) * (y2 - y1)
-        faces.append((int(x1), int(y1), int(x2), int(y2), area, conf))
-
-    if faces:
-        x1, y1, x2, y2, area, conf = max(faces, key=lambda f: f[4])
-        pad = 10
-        x1p = max(x1 - pad, 0)
-        y1p = max(y1 - pad, 0)
-        x2p = min(x2 + pad, frame.shape[1])
-        y2p = min(y2 + pad, frame.shape[0])
+    if dets.largest >= 0:
+        x1p, y1p, x2p, y2p = dets.padded[dets.largest].tolist()
+        conf = float(dets.conf[dets.largest])
         current_crop = frame[y1p:y2p, x1p:x2p]
         cv2.rectangle(frame, (x1p, y1p), (x2p, y2p), (0, 255, 0), 2)
         cv2.putText(frame, f"Face ({conf:.2f})", (x1p, y1p - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
+    for job in client.poll():
+        kind, name = job.tag
+        reply = job.reply
+        if kind == "register":
+            if reply is not None and reply.ok:
+                print(f"[✅] Server commit OK for {name}")
+            elif reply is not None:
+                print(f"[❌] Server error {reply.status_code}: {reply.body}")
+            else:
+                print("[❌] Failed sending to server:", job.error)
+        elif reply is not None and reply.ok:
+            REGISTRY.counter("face_verifications_total", "Server verifications", result="unlocked").inc()
+            print("[✅] ZK Proof Valid — Biometrics UNLOCKED")
+            banner = ("UNLOCKED ✅", (0, 255, 0), time.monotonic() + 1.5)
+        else:
+            REGISTRY.counter("face_verifications_total", "Server verifications", result="denied").inc()
+            print("[❌] ZK Proof Failed — Access DENIED")
+            banner = ("ACCESS DENIED ❌", (0, 0, 255), time.monotonic() + 1.5)
+    if banner is not None and time.monotonic() < banner[2]:
+        cv2.putText(frame, banner[0], (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.1, banner[1], 3)
+
     cv2.imshow("YOLO + ArcFace + FAISS", frame)
     key = cv2.waitKey(1) & 0xFF
     if key == 255:
@@ -82,35 +104,24 @@ while True:
 
         try:
             rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            emb = DeepFace.represent(rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False)[0]["embedding"]
+            with EMBED_SECONDS.time():
+                emb = DeepFace.represent(rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False)[0]["embedding"]
             emb_np = np.array(emb, dtype="float32").reshape(1, -1)
             emb_np = emb_np / np.linalg.norm(emb_np)
 
+            # The FAISS index is created on the first add (see face_db.FaceDB).
             emb_dim = emb_np.shape[1]
-            if index is None:
-                print(f"[+] Creating FAISS index with dimension {emb_dim}")
-                index = faiss.IndexFlatL2(emb_dim)
 
-            if index.d != emb_dim:
+            if index is not None and index.d != emb_dim:
                 print("[ERROR] Embedding dimension mismatch.")
                 continue
 
-            index.add(emb_np)
-            labels.append(name)
-            faiss.write_index(index, DB_PATH)
-            with open(LABELS_PATH, "wb") as f:
-                pickle.dump(labels, f)
+            db.add(emb_np, name)
+            index = db.index
             print(f"[✓] {name} added to FAISS DB.")
 
-            try:
-                payload = {"face_index": name, "embedding": emb_np.flatten().tolist() }
-                resp = requests.post(f"{SERVER_URL}/face-data", json=payload, timeout=10)
-                if resp.status_code == 200:
-                    print(f"[✅] Server commit OK for {name}")
-                else:
-                    print(f"[❌] Server error {resp.status_code}: {resp.text}")
-            except Exception as e:
-                print("[❌] Failed sending to server:", e)
+            payload = {"face_index": name, "embedding": emb_np}
+            client.submit("/face-data", payload, tag=("register", name), buffer=True)
 
         except Exception as e:
             print("[ERROR] Registration failed:", e)
@@ -126,16 +137,16 @@ while True:
 
         try:
             rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            emb = DeepFace.represent(rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False)[0]["embedding"]
+            with EMBED_SECONDS.time():
+                emb = DeepFace.represent(rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False)[0]["embedding"]
             emb_np = np.array(emb, dtype="float32").reshape(1, -1)
             emb_np = emb_np / np.linalg.norm(emb_np)
-            D, I = index.search(emb_np, 1)
-            name = labels[I[0][0]]
-            dist = float(D[0][0])
-            if dist < DIST_THRESHOLD:
-                print(f"[MATCH] {name} ({dist:.4f})")
+            identities = db.search_identities(emb_np, 1)[0]
+            name, sim, _ = identities[0] if identities else (None, -1.0, 0)
+            if sim >= SIM_THRESHOLD:
+                print(f"[MATCH] {name} ({sim:.4f})")
             else:
-                print(f"[NO MATCH] ({dist:.4f})")
+                print(f"[NO MATCH] ({sim:.4f})")
             cv2.waitKey(500)
         except Exception as e:
             print("[ERROR] Search failed:", e)
@@ -150,7 +161,8 @@ while True:
 
         try:
             rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            emb = DeepFace.represent(rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False)[0]["embedding"]
+            with EMBED_SECONDS.time():
+                emb = DeepFace.represent(rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False)[0]["embedding"]
 
             emb_np = np.array(emb, dtype="float32").reshape(1, -1)
             emb_np = emb_np / np.linalg.norm(emb_np)
@@ -159,31 +171,21 @@ while True:
                 print("[!] No registered faces in DB.")
                 continue
 
-            D, I = index.search(emb_np, 1)
-            idx = int(I[0][0])
-            label = labels[idx]
-
-            print(f"[+] Closest match: {label}")
+            identities = db.search_identities(emb_np, 1)[0]
+            if not identities:
+                print("[!] No registered faces in DB.")
+                continue
+            label, sim, _ = identities[0]
 
-            enrolled_vector = index.reconstruct(idx).tolist()
+            print(f"[+] Closest match: {label} (similarity={sim:.4f})")
 
+            # The server verifies against its own enrolled template for label.
             payload = {
                 "face_index": label,
-                "embedding": emb_np.flatten().tolist(),
-                "enrolled": enrolled_vector,
+                "embedding": emb_np,
             }
 
-            resp = requests.post(f"{SERVER_URL}/face-verify", json=payload, timeout=20)
-
-            if resp.status_code == 200:
-                print("[✅] ZK Proof Valid — Biometrics UNLOCKED")
-                cv2.putText(frame, "UNLOCKED ✅", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 255, 0), 3)
-            else:
-                print("[❌] ZK Proof Failed — Access DENIED")
-                cv2.putText(frame, "ACCESS DENIED ❌", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 0, 255), 3)
-
-            cv2.imshow("YOLO + ArcFace + FAISS", frame)
-            cv2.waitKey(800)
+            client.submit("/face-verify", payload, tag=("verify", label))
 
         except Exception as e:
             print("[ERROR] Verification failed:", e)
@@ -193,3 +195,7 @@ while True:
 
 cap.release()
 cv2.destroyAllWindows()
+client.close()
+if METRICS_PATH:
+    REGISTRY.write(METRICS_PATH)
+db.close()
@@ -2,11 +2,15 @@ from ultralytics import YOLO
 from deepface import DeepFace
 import cv2
 import numpy as np
-import faiss
-import os
-import pickle
-import requests
 from datetime import datetime
+import time
+
+from detections import from_faces, postprocess
+from embedding_cache import EmbeddingCache, face_quality
+from face_db import FaceDB
+from face_tracker import FaceTracker
+from metrics import REGISTRY
+from server_client import ServerClient
 
 # ===== CONFIG =====
 YOLO_WEIGHTS = r"C:\YoLo-Face\runs\detect\train3\weights\best.pt"
@@ -14,61 +18,130 @@ DB_PATH = "face_db.index"
 LABELS_PATH = "face_labels.pkl"
 CONF_THRESH = 0.5
 EMBED_MODEL = "ArcFace"       # ArcFace model via DeepFace
-DIST_THRESHOLD = 5          # Tune for raw (non-normalized) embeddings if needed
+METRIC = "cosine"           # "cosine" or "l2" for new DBs; the server normalizes what it compares
+SIM_THRESHOLD = 0.4         # Min cosine similarity for a local match
 SERVER_URL = "https://noe-uninducible-cheerlessly.ngrok-free.dev"
+WIRE_FORMAT = "msgpack"     # "msgpack" / "json" (base64 vectors) / "legacy" (float lists, old servers)
+WIRE_DTYPE = "f32"          # "f32" / "f16" / "q8" / "q16" (not used by "legacy")
+OUTBOX_PATH = "server_outbox.msgpack"  # registrations waiting for the server while offline
+METRICS_PATH = None        # e.g. "client_metrics.prom" (or .json): detector / embedding / server metrics
+DETECT_EVERY = 1            # >1 = run YOLO every N frames and track faces in between
 # ===================
 
 # Load YOLO model
 model = YOLO(YOLO_WEIGHTS)
 
 # Load or init FAISS + labels
-index = None
-labels = []
-if os.path.exists(DB_PATH) and os.path.exists(LABELS_PATH):
-    print("[+] Loading existing FAISS index...")
-    index = faiss.read_index(DB_PATH)
-    with open(LABELS_PATH, "rb") as f:
-        labels = pickle.load(f)
-else:
-    print("[+] No existing FAISS DB found. It will be created on first registration.")
+db = FaceDB(DB_PATH, LABELS_PATH, metric=METRIC)
+index = db.index
+labels = db.labels
+if db.metric == "l2" and db.ntotal:
+    # Similarities from an L2 index assume unit vectors; an older DB of RAW
+    # embeddings needs re-enrolling (or a new DB) for SIM_THRESHOLD to hold.
+    print("[WARN] FAISS DB uses the l2 metric; similarities assume normalized embeddings.")
+
+# Tracker gives each face a stable ID; embeddings are cached per track so
+# 'r', 's' and 'v' on the same person share one ArcFace pass.
+tracker = FaceTracker(detect_every=DETECT_EVERY)
+embedding_cache = EmbeddingCache()
+
+# Server calls go through a background sender so the video loop never waits
+# on the network; replies are shown on the frames after they arrive.
+client = ServerClient(SERVER_URL, WIRE_FORMAT, WIRE_DTYPE, timeout=30, offline_path=OUTBOX_PATH)
+banner = None  # (text, color, shown until)
+
+# Hot-path metrics (metrics.py), written to METRICS_PATH while running.
+FRAMES = REGISTRY.counter("face_frames_total", "Camera frames processed")
+DETECT_SECONDS = REGISTRY.histogram("face_detect_seconds", "YOLO forward pass + post-processing per frame")
+EMBED_SECONDS = REGISTRY.histogram("face_embed_seconds", "ArcFace pass per batch of crops")
+if METRICS_PATH:
+    REGISTRY.export(METRICS_PATH)
+
+
+def detect_faces(frame):
+    # Vectorized box post-processing; returns a detections.Detections.
+    with DETECT_SECONDS.time():
+        results = model(frame, verbose=False)
+        return postprocess(results[0].boxes, frame.shape, CONF_THRESH)
+
+
+def current_embedding():
+    # RAW (1, d) embedding of current_crop, computed only when the track is
+    # new, its cache entry expired, or the crop got noticeably better.
+    emb_np = embedding_cache.get(current_track_id, current_quality)
+    if emb_np is None:
+        rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
+        with EMBED_SECONDS.time():
+            emb_list = DeepFace.represent(
+                rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False
+            )[0]["embedding"]
+        emb_np = np.array(emb_list, dtype="float32").reshape(1, -1)  # RAW
+        embedding_cache.put(current_track_id, emb_np, current_quality)
+    return emb_np
+
+
+def handle_server_replies():
+    global banner
+    for job in client.poll():
+        kind, name = job.tag
+        reply = job.reply
+        if kind == "register":
+            if reply is not None and reply.ok:
+                print(f"[✅] Server commit OK for {name}")
+            elif reply is not None:
+                print(f"[❌] Server error {reply.status_code}: {reply.body}")
+            else:
+                print("[❌] Failed sending to server:", job.error)
+        elif reply is not None and reply.ok:
+            REGISTRY.counter("face_verifications_total", "Server verifications", result="unlocked").inc()
+            print("[✅] ZK Proof Valid — Biometrics UNLOCKED")
+            banner = ("UNLOCKED ✅", (0, 255, 0), time.monotonic() + 1.5)
+        else:
+            if reply is None:
+                print("[❌] Verification request failed:", job.error)
+            REGISTRY.counter("face_verifications_total", "Server verifications", result="denied").inc()
+            print("[❌] ZK Proof Failed — Access DENIED")
+            banner = ("ACCESS DENIED ❌", (0, 0, 255), time.monotonic() + 1.5)
+
 
 # Webcam
 cap = cv2.VideoCapture(0)
 print("[INFO] Press 'r' to register, 's' to search, 'v' to verify (ZK), 'q' to quit")
 
 current_crop = None
+current_track_id = None
+current_quality = 0.0
 register_counter = 0
 
 while True:
     ret, frame = cap.read()
     if not ret:
         break
-
-    # Detect faces
-    results = model(frame, verbose=False)
-    boxes = results[0].boxes
-
-    faces = []
-    for box in boxes:
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        conf = float(box.conf[0])
-        if conf < CONF_THRESH:
-            continue
-        area = (x2 - x1) * (y2 - y1)
-        faces.append((int(x1), int(y1), int(x2), int(y2), area, conf))
-
-    if faces:
-        x1, y1, x2, y2, area, conf = max(faces, key=lambda f: f[4])
-        pad = 10
-        x1p = max(x1 - pad, 0)
-        y1p = max(y1 - pad, 0)
-        x2p = min(x2 + pad, frame.shape[1])
-        y2p = min(y2 + pad, frame.shape[0])
+    FRAMES.inc()
+
+    # Detect faces (or predict tracked boxes between detections)
+    if tracker.needs_detection():
+        dets = detect_faces(frame)
+        faces = tracker.update_arrays(dets.xyxy, dets.conf)
+    else:
+        faces = tracker.predict(frame.shape)
+    embedding_cache.prune(t.track_id for t in tracker.tracks)
+
+    boxes = from_faces(faces, frame.shape)
+    if boxes.largest >= 0:
+        largest = faces[boxes.largest]
+        x1, y1, x2, y2, area, conf, current_track_id = largest
+        current_quality = face_quality(largest)
+        x1p, y1p, x2p, y2p = boxes.padded[boxes.largest].tolist()
         current_crop = frame[y1p:y2p, x1p:x2p]
         cv2.rectangle(frame, (x1p, y1p), (x2p, y2p), (0, 255, 0), 2)
         cv2.putText(frame, f"Face ({conf:.2f})", (x1p, y1p - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
+    handle_server_replies()
+    if banner is not None and time.monotonic() < banner[2]:
+        cv2.putText(frame, banner[0], (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.1, banner[1], 3)
+
     cv2.imshow("YOLO + ArcFace + FAISS", frame)
     key = cv2.waitKey(1) & 0xFF
     if key == 255:
@@ -86,41 +159,24 @@ while True:
         print(f"[+] Capturing embedding for {name}...")
 
         try:
-            rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            emb_list = DeepFace.represent(
-                rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False
-            )[0]["embedding"]
-
             # RAW (non-normalized) vector
-            emb_np = np.array(emb_list, dtype="float32").reshape(1, -1)
+            emb_np = current_embedding()
             emb_dim = emb_np.shape[1]
 
-            if index is None:
-                print(f"[+] Creating FAISS index with dimension {emb_dim}")
-                index = faiss.IndexFlatL2(emb_dim)
-
-            if index.d != emb_dim:
+            if index is not None and index.d != emb_dim:
                 print("[ERROR] Embedding dimension mismatch.")
                 continue
 
             # Store raw embedding in FAISS
-            index.add(emb_np)
-            labels.append(name)
-            faiss.write_index(index, DB_PATH)
-            with open(LABELS_PATH, "wb") as f:
-                pickle.dump(labels, f)
+            db.add(emb_np, name)
+            index = db.index
             print(f"[✓] {name} added to FAISS DB.")
 
-            # Send RAW embedding to server for on-chain commit
-            try:
-                payload = {"face_index": name, "embedding": emb_np.flatten().tolist()}
-                resp = requests.post(f"{SERVER_URL}/face-data", json=payload, timeout=10)
-                if resp.status_code == 200:
-                    print(f"[✅] Server commit OK for {name}")
-                else:
-                    print(f"[❌] Server error {resp.status_code}: {resp.text}")
-            except Exception as e:
-                print("[❌] Failed sending to server:", e)
+            # Send RAW embedding to server for on-chain commit (kept in the
+            # outbox until the server has it); the server normalizes both
+            # sides of every comparison, so RAW and normalized templates match
+            payload = {"face_index": name, "embedding": emb_np}
+            client.submit("/face-data", payload, tag=("register", name), buffer=True)
 
         except Exception as e:
             print("[ERROR] Registration failed:", e)
@@ -135,22 +191,16 @@ while True:
             continue
 
         try:
-            rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            emb_list = DeepFace.represent(
-                rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False
-            )[0]["embedding"]
+            emb_np = current_embedding()  # RAW (FaceDB normalizes cosine queries)
+            identities = db.search_identities(emb_np, 1)[0]
+            name, sim, _ = identities[0] if identities else (None, -1.0, 0)
 
-            emb_np = np.array(emb_list, dtype="float32").reshape(1, -1)  # RAW
-            D, I = index.search(emb_np, 1)
-            name = labels[I[0][0]]
-            dist = float(D[0][0])
-
-            if dist <= DIST_THRESHOLD:
-                print(f"[MATCH] {name} (dist={dist:.4f})")
+            if sim >= SIM_THRESHOLD:
+                print(f"[MATCH] {name} (similarity={sim:.4f})")
                 cv2.putText(frame, f"{name}", (x1, y1 - 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
             else:
-                print(f"[NO MATCH] (dist={dist:.4f})")
+                print(f"[NO MATCH] (similarity={sim:.4f})")
                 cv2.putText(frame, "Unknown", (x1, y1 - 30),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
@@ -168,57 +218,36 @@ while True:
         print("[+] Capturing embedding & sending to server for ZK verification...")
 
         try:
-            rgb = cv2.cvtColor(current_crop, cv2.COLOR_BGR2RGB)
-            live_list = DeepFace.represent(
-                rgb, model_name=EMBED_MODEL, detector_backend="skip", enforce_detection=False
-            )[0]["embedding"]
-
-            live_np = np.array(live_list, dtype="float32").reshape(1, -1)  # RAW
+            # Same vector the last 's' on this track produced, if any.
+            live_np = current_embedding()  # RAW
 
             if index is None or len(labels) == 0:
                 print("[!] No registered faces in DB.")
                 continue
 
-            # Nearest neighbor
-            D, I = index.search(live_np, 1)
-            idx = int(I[0][0])
-            label = labels[idx]
-            dist = float(D[0][0])
-
-            emb_dim = live_np.shape[1]
-
-            if dist <= DIST_THRESHOLD:
-                # Good match: send real enrolled
-                print(f"[+] Closest match: {label} (dist={dist:.4f})")
-                enrolled_vector = index.reconstruct(idx).tolist()
-                payload = {
-                    "face_index": label,
-                    "embedding": live_np.flatten().tolist(),   # RAW live
-                    "enrolled": enrolled_vector,               # RAW enrolled
-                }
-            else:
-                # No match: still go through ZK, but with enrolled = zeros; keep label to avoid revert
-                print(f"[!] No valid match (dist={dist:.4f}) — sending zero enrolled to ZK")
-                zeros = [0.0] * emb_dim
-                payload = {
-                    "face_index": label,                       # nearest known key to prevent contract revert
-                    "embedding": live_np.flatten().tolist(),   # RAW live
-                    "enrolled": zeros,                         # zero enrolled
-                }
-
-            resp = requests.post(f"{SERVER_URL}/face-verify", json=payload, timeout=30)
-
-            if resp.status_code == 200:
-                print("[✅] ZK Proof Valid — Biometrics UNLOCKED")
-                cv2.putText(frame, "UNLOCKED ✅", (50, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 255, 0), 3)
+            # Nearest enrolled face (removed faces and empty slots skipped)
+            identities = db.search_identities(live_np, 1)[0]
+            if not identities:
+                print("[!] No registered faces in DB.")
+                continue
+            label, sim, _ = identities[0]
+
+            if sim >= SIM_THRESHOLD:
+                print(f"[+] Closest match: {label} (similarity={sim:.4f})")
             else:
-                print("[❌] ZK Proof Failed — Access DENIED")
-                cv2.putText(frame, "ACCESS DENIED ❌", (50, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 0, 255), 3)
+                # No match: still go through ZK with the nearest known key
+                # (prevents a contract revert); the server rejects it.
+                print(f"[!] No valid match (similarity={sim:.4f}) — verifying against nearest key anyway")
 
-            cv2.imshow("YOLO + ArcFace + FAISS", frame)
-            cv2.waitKey(800)
+            # The server holds the enrolled template for `label` (registered
+            # via /face-data); only the live vector travels.
+            payload = {
+                "face_index": label,
+                "embedding": live_np,                          # RAW live
+            }
+
+            # Result arrives asynchronously (handle_server_replies)
+            client.submit("/face-verify", payload, tag=("verify", label))
 
         except Exception as e:
             print("[ERROR] Verification failed:", e)
@@ -228,3 +257,7 @@ while True:
 
 cap.release()
 cv2.destroyAllWindows()
+client.close()
+if METRICS_PATH:
+    REGISTRY.write(METRICS_PATH)
+db.close()
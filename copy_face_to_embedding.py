@@ -2,12 +2,13 @@ from ultralytics import YOLO
 from deepface import DeepFace
 import cv2
 import numpy as np
-import faiss
-import os
-import pickle
-import requests
+import time
 from datetime import datetime
 
+from detections import postprocess
+from face_db import FaceDB
+from server_client import ServerClient
+
 # ===== CONFIG =====
 YOLO_WEIGHTS = r"C:\YoLo-Face\runs\detect\train3\weights\best.pt"
 DB_PATH = "face_db.index"
@@ -16,6 +17,8 @@ CONF_THRESH = 0.5
 EMBED_MODEL = "ArcFace"   # ArcFace = better accuracy, no TensorFlow dependency
 DIST_THRESHOLD = 1.2      # Recommended for ArcFace embeddings
 SERVER_URL = "https://noe-uninducible-cheerlessly.ngrok-free.dev"  # change as needed
+WIRE_FORMAT = "legacy"    # "legacy" (JSON float lists) / "json" / "msgpack" (see wire_format.py)
+OUTBOX_PATH = "server_outbox.msgpack"  # registrations waiting for the server while offline
 # ===================
 
 # Load YOLO model
@@ -24,22 +27,17 @@ SERVER_URL = "https://noe-uninducible-cheerlessly.ngrok-free.dev"  # change as n
 model = YOLO(YOLO_WEIGHTS)
 
 # Initialize or load FAISS index
-# FAISS holds numeric embeddings for registered faces. `labels` keeps a parallel
-# Python list of string IDs/names so we can map an index search result back to
-# a human-readable label.
-index = None
-labels = []
-if os.path.exists(DB_PATH) and os.path.exists(LABELS_PATH):
-    # If we've previously saved an index and labels, load them so searches
-    # can be performed across runs.
-    print("[+] Loading existing FAISS index...")
-    index = faiss.read_index(DB_PATH)
-    with open(LABELS_PATH, "rb") as f:
-        labels = pickle.load(f)
-else:
-    # Otherwise we'll create the FAISS index lazily when the first face is
-    # registered (so we know the embedding dimension).
-    print("[+] No existing FAISS DB found. It will be created on first registration.")
+# FAISS holds numeric embeddings for registered faces under 64-bit face IDs.
+# `labels` maps those IDs to string names (and back) so we can turn an index
+# search result into a human-readable label.
+db = FaceDB(DB_PATH, LABELS_PATH)
+index = db.index
+labels = db.labels
+
+# Background sender (see server_client.py): requests are queued without
+# blocking the video loop and their replies shown on the next frames.
+client = ServerClient(SERVER_URL, WIRE_FORMAT, timeout=20, offline_path=OUTBOX_PATH)
+banner = None  # (text, color, shown until)
 
 # Open webcam
 # Open the default webcam (device 0). Change the index if you have multiple
@@ -63,29 +61,18 @@ while True:
     # Run YOLO on the frame to get detections. `results[0].boxes` contains
     # bounding boxes along with confidence scores.
     results = model(frame, verbose=False)
-    boxes = results[0].boxes
-
-    # Convert YOLO detections into a simpler list we can use: (x1,y1,x2,y2,area,conf)
-    faces = []
-    for box in boxes:
-        x1, y1, x2, y2 = box.xyxy[0].tolist()
-        conf = float(box.conf[0])
-        # Skip weak detections below the configured confidence threshold.
-        if conf < CONF_THRESH:
-            continue
-        area = (x2 - x1) * (y2 - y1)
-        faces.append((int(x1), int(y1), int(x2), int(y2), area, conf))
+
+    # Filter by CONF_THRESH, compute areas and padded crop boxes for all
+    # detections at once (see detections.py).
+    dets = postprocess(results[0].boxes, frame.shape, CONF_THRESH)
 
     # If multiple faces were found, pick the largest by area (assumed closest/
-    # most prominent). We add a small padding before cropping so the face isn't
-    # tightly clipped.
-    if faces:
-        x1, y1, x2, y2, area, conf = max(faces, key=lambda f: f[4])
-        pad = 10
-        x1p = max(x1 - pad, 0)
-        y1p = max(y1 - pad, 0)
-        x2p = min(x2 + pad, frame.shape[1])
-        y2p = min(y2 + pad, frame.shape[0])
+    # most prominent). Its padded box keeps the face from being tightly
+    # clipped.
+    if dets.largest >= 0:
+        x1, y1, x2, y2 = dets.xyxy[dets.largest].tolist()
+        conf = float(dets.conf[dets.largest])
+        x1p, y1p, x2p, y2p = dets.padded[dets.largest].tolist()
         # Save the cropped face (BGR color as returned by OpenCV)
         current_crop = frame[y1p:y2p, x1p:x2p]
 
@@ -94,6 +81,27 @@ while True:
         cv2.putText(frame, f"Face ({conf:.2f})", (x1p, y1p - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
+    # Server replies that arrived since the last frame.
+    for job in client.poll():
+        kind, name = job.tag
+        reply = job.reply
+        if kind == "register":
+            if reply is not None and reply.ok:
+                print(f"[✅] Server commit OK for {name}")
+                print(reply.body)
+            elif reply is not None:
+                print(f"[❌] Server error {reply.status_code}: {reply.body}")
+            else:
+                print("[❌] Failed sending to server:", job.error)
+        elif reply is not None and reply.ok:
+            print("[✅] Authentication verified — Biometrics UNLOCKED")
+            banner = ("UNLOCKED", (0, 255, 0), time.monotonic() + 1.5)
+        else:
+            print("[❌] Authentication failed — Access DENIED")
+            banner = ("ACCESS DENIED ❌", (0, 0, 255), time.monotonic() + 1.5)
+    if banner is not None and time.monotonic() < banner[2]:
+        cv2.putText(frame, banner[0], (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.1, banner[1], 3)
+
     # Show the live frame
     cv2.imshow("YOLO + ArcFace + FAISS", frame)
     key = cv2.waitKey(1) & 0xFF
@@ -130,44 +138,25 @@ while True:
             emb_np = np.array(emb, dtype="float32").reshape(1, -1)
             emb_np = emb_np / np.linalg.norm(emb_np)
 
+            # The FAISS index is created on the first add (see face_db.FaceDB).
             emb_dim = emb_np.shape[1]
-            if index is None:
-                print(f"[+] Creating FAISS index with dimension {emb_dim}")
-                index = faiss.IndexFlatL2(emb_dim)
 
-            if index.d != emb_dim:
+            if index is not None and index.d != emb_dim:
                 print("[ERROR] Embedding dimension mismatch. Skipping registration.")
                 continue
 
             # Save locally
-            index.add(emb_np)
-            labels.append(name)
-            faiss.write_index(index, DB_PATH)
-            with open(LABELS_PATH, "wb") as f:
-                pickle.dump(labels, f)
+            db.add(emb_np, name)
+            index = db.index
             print(f"[✓] {name} added to FAISS DB.")
 
-            # ✅ Send to server after saving
-            try:
-                payload = {
-                    "face_index": name,               # string label
-                    "embedding": emb                  # <-- raw float list
-                }
-
-                resp = requests.post(
-                    f"{SERVER_URL}/face-data",
-                    json=payload,
-                    timeout=10
-                )
-
-                if resp.status_code == 200:
-                    print(f"[✅] Server commit OK for {name}")
-                    print(resp.json())
-                else:
-                    print(f"[❌] Server error {resp.status_code}: {resp.text}")
-
-            except Exception as e:
-                print("[❌] Failed sending to server:", e)
+            # ✅ Send to server after saving (kept in the outbox until the
+            # server has it)
+            payload = {
+                "face_index": name,               # string label
+                "embedding": emb                  # <-- raw float list
+            }
+            client.submit("/face-data", payload, tag=("register", name), buffer=True)
 
         except Exception as e:
             print("[ERROR] Registration failed:", e)
@@ -248,23 +237,13 @@ while True:
 
             payload = {
                 "face_index": face_index,
-                "embedding": emb_np.flatten().tolist(),
+                "embedding": emb_np,
                 "timestamp": datetime.now().isoformat()
             }
 
-            resp = requests.post(SERVER_URL, json=payload)
-
-            if resp.status_code == 200:
-                print("[✅] Authentication verified — Biometrics UNLOCKED")
-                cv2.putText(frame, "UNLOCKED", (50, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 255, 0), 3)
-            else:
-                print("[❌] Authentication failed — Access DENIED")
-                cv2.putText(frame, "ACCESS DENIED ❌", (50, 50),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.1, (0, 0, 255), 3)
-
-            cv2.imshow("YOLO + ArcFace + FAISS", frame)
-            cv2.waitKey(800)
+            # Posted to SERVER_URL itself, as before; the result is shown
+            # when it arrives (see client.poll() above).
+            client.submit("", payload, tag=("verify", face_index))
 
         except Exception as e:
             print("[ERROR] Failed to process:", e)
@@ -274,3 +253,5 @@ while True:
 
 cap.release()
 cv2.destroyAllWindows()
+client.close()
+db.close()
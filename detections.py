@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Struct-of-arrays view of one frame's detections, after confidence filtering.
+#   xyxy    (N, 4) int32   face boxes (x1, y1, x2, y2)
+#   padded  (N, 4) int32   boxes grown by `pad` and clipped to the frame (crop coords)
+#   area    (N,)   float32 box areas
+#   conf    (N,)   float32 detection confidences
+#   largest int            row of the largest face, -1 when N == 0
+Detections = namedtuple("Detections", ["xyxy", "padded", "area", "conf", "largest"])
+
+
+def _to_numpy(t):
+    # Ultralytics gives torch tensors (possibly on GPU); plain arrays pass through.
+    if hasattr(t, "cpu"):
+        t = t.cpu().numpy()
+    return np.asarray(t, dtype="float32")
+
+
+def postprocess(boxes, frame_shape, conf_thresh=0.5, pad=10):
+    """Turn `results[0].boxes` into a `Detections` with one device->host copy
+    for all boxes instead of a `.tolist()` round trip per box."""
+    xyxy = _to_numpy(boxes.xyxy).reshape(-1, 4)
+    conf = _to_numpy(boxes.conf).reshape(-1)
+
+    keep = conf >= conf_thresh
+    xyxy = xyxy[keep]
+    conf = conf[keep]
+
+    area = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    xyxy = xyxy.astype("int32")
+    return _detections(xyxy, area, conf, frame_shape, pad)
+
+
+def from_faces(faces, frame_shape, pad=10):
+    """`Detections` from (x1, y1, x2, y2, area, conf[, track_id]) tuples,
+    e.g. FaceTracker output, so tracked frames get the same padded crop
+    boxes and largest-face pick as detected ones. Rows follow `faces`."""
+    rows = np.array([f[:6] for f in faces], dtype="float32").reshape(-1, 6)
+    return _detections(rows[:, :4].astype("int32"), rows[:, 4], rows[:, 5], frame_shape, pad)
+
+
+def _detections(xyxy, area, conf, frame_shape, pad):
+    h, w = frame_shape[:2]
+    padded = xyxy + np.array([-pad, -pad, pad, pad], dtype="int32")
+    padded[:, 0::2] = np.clip(padded[:, 0::2], 0, w)
+    padded[:, 1::2] = np.clip(padded[:, 1::2], 0, h)
+
+    largest = int(np.argmax(area)) if len(area) else -1
+    return Detections(xyxy, padded, area, conf, largest)
+
+
+def to_faces(dets):
+    """Legacy list of (x1, y1, x2, y2, area, conf) tuples."""
+    return [(x1, y1, x2, y2, float(a), float(c))
+            for (x1, y1, x2, y2), a, c in zip(dets.xyxy.tolist(), dets.area, dets.conf)]
@@ -0,0 +1,60 @@
+import threading
+import time
+
+
+def face_quality(face):
+    # Detection area x confidence: bigger, more confident crops give better
+    # embeddings. `face` is an (x1, y1, x2, y2, area, conf, ...) tuple.
+    return float(face[4]) * float(face[5])
+
+
+class EmbeddingCache:
+    """Embeddings keyed by track ID, so a tracked face is embedded once.
+
+    An entry is reused until it is older than `ttl` seconds or the caller
+    offers a crop whose quality beats the cached one by `quality_gain`x, in
+    which case `get` reports a miss and the fresh embedding replaces it.
+    """
+
+    def __init__(self, ttl=5.0, quality_gain=1.25, max_entries=256):
+        self.ttl = ttl
+        self.quality_gain = quality_gain
+        self.max_entries = max_entries
+        self.entries = {}  # track_id -> (embedding, quality, created)
+        self.hits = 0
+        self.misses = 0
+        # The pipeline touches the cache from the detect and embed threads.
+        self.lock = threading.Lock()
+
+    def get(self, track_id, quality=0.0):
+        with self.lock:
+            entry = self.entries.get(track_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            emb, cached_quality, created = entry
+            if time.monotonic() - created > self.ttl:
+                del self.entries[track_id]
+                self.misses += 1
+                return None
+            if quality > cached_quality * self.quality_gain:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return emb
+
+    def put(self, track_id, emb, quality=0.0):
+        with self.lock:
+            if track_id not in self.entries and len(self.entries) >= self.max_entries:
+                oldest = min(self.entries, key=lambda k: self.entries[k][2])
+                del self.entries[oldest]
+            self.entries[track_id] = (emb, quality, time.monotonic())
+
+    def prune(self, live_track_ids):
+        # Forget tracks the tracker no longer follows.
+        live = set(live_track_ids)
+        with self.lock:
+            for track_id in [k for k in self.entries if k not in live]:
+                del self.entries[track_id]
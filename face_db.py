@@ -0,0 +1,864 @@
+import math
+import os
+import pickle
+import shutil
+import struct
+import threading
+import zlib
+
+import faiss
+import numpy as np
+
+from label_store import LabelStore, LabelTable, label_table_path, write_label_table
+from vector_store import VectorStore, vector_store_path
+
+# One WAL record:  header | label (utf-8) | embedding (float32 LE) | crc32
+#   header = seq (u64), label length (u32), dim (u32)
+# `seq` is the face ID the record registers. IDs are assigned in increasing
+# order, so replaying is idempotent: IDs the snapshot already covers are
+# skipped. A record with dim 0 (and no label) removes face `seq`.
+_HEADER = struct.Struct("<QII")
+_CRC = struct.Struct("<I")
+
+# Read-only, memory-mapped index loading, tried in order. IO_FLAG_MMAP_IFC
+# (newer faiss) maps flat/HNSW vector storage instead of copying it into
+# RAM; IVF indexes reject that combination and take plain IO_FLAG_MMAP,
+# which maps the inverted lists.
+_MMAP_FLAGS = [faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY,
+               faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY]
+
+
+def read_index_mmap(path):
+    for i, flags in enumerate(_MMAP_FLAGS):
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError:
+            if i == len(_MMAP_FLAGS) - 1:
+                raise
+
+# Index kinds in the order a growing gallery moves through them.
+INDEX_KINDS = ("flat", "ivf", "hnsw")
+# "l2" stores squared L2 distances (lower = closer); "cosine" L2-normalizes
+# vectors and stores inner products (higher = closer).
+METRICS = ("l2", "cosine")
+# Compressed vector codes: 8-bit / fp16 scalar quantization, product quantization.
+CODECS = ("sq8", "fp16", "pq")
+
+
+def index_metric(index):
+    return "cosine" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def to_similarity(metric, score):
+    """Cosine similarity from a raw FAISS score. For "l2" this assumes
+    unit-length vectors, where squared L2 = 2 - 2 * cos."""
+    if metric == "cosine":
+        return score
+    return 1.0 - score / 2.0
+
+
+def base_index(index):
+    """The index doing the searching, under any IndexIDMap2 wrapper."""
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_kind(index):
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def index_ids(index):
+    """Face IDs held by an index, as an int64 array."""
+    if isinstance(index, faiss.IndexIDMap2):
+        return faiss.vector_to_array(index.id_map)
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        ids = [faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+               for l in range(index.nlist) if invlists.list_size(l)]
+        return np.concatenate(ids).astype("int64") if ids else np.empty(0, dtype="int64")
+    return np.arange(index.ntotal, dtype="int64")
+
+
+def with_ids(index, read_only=False):
+    """Give a pre-ID (row-addressed) index face IDs, ID = row, without
+    re-adding its vectors. ID-addressed indexes are returned as they are."""
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+    if isinstance(index, faiss.IndexIVF):
+        # IVF stores IDs itself (already 0..N-1); remove_ids and
+        # reconstruct by ID need the hashtable direct map.
+        if not read_only and index.direct_map.type != faiss.DirectMap.Hashtable:
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+    wrapped = faiss.IndexIDMap2(faiss.IndexFlat(index.d, index.metric_type))
+    wrapped.index = index
+    index.this.disown()
+    wrapped.own_fields = True
+    faiss.copy_array_to_vector(np.arange(index.ntotal, dtype="int64"), wrapped.id_map)
+    wrapped.ntotal = index.ntotal
+    wrapped.construct_rev_map()
+    return wrapped
+
+
+def index_codec(index):
+    """"sq8", "fp16" or "pq" for compressed indexes, None for exact float32 storage."""
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return None
+
+
+def describe(kind, codec):
+    return kind if codec is None else f"{kind}+{codec}"
+
+
+def default_pq_m(d):
+    # About d/8 one-byte sub-quantizers (64 bytes for 512-d ArcFace); PQ
+    # needs a divisor of d.
+    return max(m for m in range(1, max(d // 8, 1) + 1) if d % m == 0)
+
+
+def rerank(embs, ids, vectors, k, metric="l2"):
+    """Exact top-k among candidate `ids` ((n, c), -1 = empty) given their
+    exact `vectors` ((n, c, d)). Returns (distances, ids) like a FAISS search."""
+    valid = ids >= 0
+    if metric == "cosine":
+        D = np.einsum("ncd,nd->nc", vectors, embs)
+        D[~valid] = -np.inf
+        order = np.argsort(-D, axis=1)[:, :k]
+    else:
+        D = ((vectors - embs[:, None, :]) ** 2).sum(axis=2)
+        D[~valid] = np.inf
+        order = np.argsort(D, axis=1)[:, :k]
+    return np.take_along_axis(D, order, axis=1).astype("float32"), np.take_along_axis(ids, order, axis=1)
+
+
+def build_index(kind, vectors, ids=None, nlist=None, hnsw_m=32, ef_construction=80, metric="l2", codec=None,
+                pq_m=None, add=True):
+    """Build a `kind` index over `vectors` ((N, d) float32) under face IDs
+    `ids` (default 0..N-1). With add=False `vectors` are only the training
+    set and the index comes back empty, for the caller to fill in chunks
+    (pass `nlist` for the final size then).
+
+    IVF is trained on (a sample of) the vectors themselves; `nlist` defaults
+    to ~4*sqrt(N) lists. For metric="cosine" the vectors must already be
+    normalized. IVF stores the IDs natively (with a hashtable direct map for
+    removal and reconstruction); flat and HNSW are wrapped in IndexIDMap2.
+
+    `codec` stores compressed codes instead of float32 vectors: "sq8" (1
+    byte/dim), "fp16" (2 bytes/dim) or "pq" (`pq_m` bytes/vector, default
+    ~d/8). Their ranges / codebooks are trained on the vectors as well.
+    """
+    n, d = vectors.shape
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+    if codec is not None and codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec}")
+    qtype = faiss.ScalarQuantizer.QT_fp16 if codec == "fp16" else faiss.ScalarQuantizer.QT_8bit
+    pq_m = pq_m or default_pq_m(d)
+    # Training sample: IVF k-means wants ~39+ points per list, PQ's 256
+    # centroids per sub-quantizer ~10k points in all.
+    sample_size = 65536 if codec is not None else 0
+    if kind == "flat":
+        if codec is None:
+            index = faiss.IndexFlatIP(d) if metric == "cosine" else faiss.IndexFlatL2(d)
+        elif codec == "pq":
+            index = faiss.IndexPQ(d, pq_m, 8, faiss_metric)
+        else:
+            index = faiss.IndexScalarQuantizer(d, qtype, faiss_metric)
+    elif kind == "ivf":
+        if nlist is None:
+            nlist = int(4 * math.sqrt(n))
+        # k-means wants ~39 training points per centroid.
+        nlist = max(1, min(nlist, n // 39))
+        quantizer = faiss.IndexFlatIP(d) if metric == "cosine" else faiss.IndexFlatL2(d)
+        if codec is None:
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss_metric)
+        elif codec == "pq":
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, 8, faiss_metric)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, qtype, faiss_metric)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        sample_size = max(sample_size, 256 * nlist)
+    elif kind == "hnsw":
+        if codec is None:
+            index = faiss.IndexHNSWFlat(d, hnsw_m, faiss_metric)
+        elif codec == "pq":
+            index = faiss.IndexHNSWPQ(d, pq_m, hnsw_m, 8, faiss_metric)
+        else:
+            index = faiss.IndexHNSWSQ(d, qtype, hnsw_m, faiss_metric)
+        # Graph construction over PQ codes gets *worse* with a larger
+        # efConstruction (measured with compression_report.py); keep faiss's
+        # default there.
+        if codec != "pq":
+            index.hnsw.efConstruction = ef_construction
+    else:
+        raise ValueError(f"Unknown index kind: {kind}")
+    if not index.is_trained:
+        sample = vectors
+        if n > sample_size:
+            sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)]
+        index.train(sample)
+    if kind != "ivf":
+        index = faiss.IndexIDMap2(index)
+    if n and add:
+        if ids is None:
+            ids = np.arange(n, dtype="int64")
+        index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    return index
+
+
+def snapshot_exists(db_path, labels_path):
+    # Label table, or the pickled label list of databases from before IDs.
+    return os.path.exists(db_path) and (os.path.exists(label_table_path(labels_path))
+                                        or os.path.exists(labels_path))
+
+
+def _encode(seq, label, emb):
+    label_bytes = label.encode("utf-8")
+    emb = np.ascontiguousarray(emb, dtype="<f4").reshape(-1)
+    header = _HEADER.pack(seq, len(label_bytes), emb.shape[0])
+    body = label_bytes + emb.tobytes()
+    return header + body + _CRC.pack(zlib.crc32(header + body))
+
+
+def _read_wal(path):
+    """Yield (seq, label, embedding) from a WAL file, stopping at the first
+    torn or corrupt record (e.g. a crash mid-append)."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            seq, label_len, dim = _HEADER.unpack(header)
+            body = f.read(label_len + 4 * dim)
+            crc = f.read(_CRC.size)
+            if len(body) < label_len + 4 * dim or len(crc) < _CRC.size:
+                return
+            if zlib.crc32(header + body) != _CRC.unpack(crc)[0]:
+                print(f"[WARN] Corrupt WAL record in {path}; ignoring the rest of the log.")
+                return
+            label = body[:label_len].decode("utf-8")
+            emb = np.frombuffer(body[label_len:], dtype="<f4").reshape(1, dim)
+            yield seq, label, emb
+
+
+class FaceDB:
+    """FAISS index + label store, persisted as a snapshot plus a write-ahead log.
+
+    Every enrolled template gets a 64-bit face ID, assigned in increasing
+    order and never reused. The index is addressed by ID (IndexIDMap2, or
+    IVF's own IDs), `search` returns IDs, and `labels` (a LabelStore) maps
+    IDs to labels and labels to IDs in O(1). `remove_ids`, `remove_label`
+    and `reenroll` delete or replace faces without a rebuild; flat and IVF
+    drop the vectors at once, HNSW cannot delete in place and keeps them as
+    tombstones (filtered out of results) until the next migration.
+
+    `add` and removals append a record to `<db_path>.wal` and fsync it
+    before touching the in-memory index, so they cost one small append
+    instead of rewriting the database. Every `compact_every` records a
+    background thread writes a fresh snapshot (`db_path` and the label table
+    `<labels>.tbl`) and drops the log segment it covered. On startup the
+    snapshot is loaded and the log is replayed on top of it. Databases from
+    before face IDs (pickled label list at `labels_path`) are upgraded in
+    place, ID = old row, on first load.
+
+    The index starts as a flat (exact) index. With `index_type="auto"` it is
+    rebuilt as IVF once it holds `ivf_at` faces and as HNSW past `hnsw_at`;
+    "ivf" / "hnsw" go straight from flat to that kind at its threshold and
+    "flat" never migrates. Face IDs are kept across migrations.
+    `nprobe` (IVF) and `ef_search` (HNSW) trade latency for recall.
+
+    `metric` applies to newly created databases; an existing snapshot keeps
+    the metric it was built with (`self.metric` reflects what is in use).
+
+    `compression` ("sq8", "fp16" or "pq") keeps compressed codes in the index
+    instead of float32 vectors (512-d: 512 / 1024 / 64 bytes instead of
+    2 KB) once the gallery holds `compress_at` faces, enough to train the
+    codec. The exact vectors go to an on-disk store (`<db_path>.vectors`,
+    row = face ID) read through a memmap: searches take
+    `refine_factor` * k candidates from the codes and re-rank them exactly
+    against the store. Like the metric, an existing compressed index keeps
+    its codec. See compression_report.py for the recall / memory tradeoff.
+
+    `mmap=True` opens the database read-only for search processes: the
+    snapshot index and the label table (`<labels>.tbl`, written by
+    compaction) are memory-mapped rather than read into RAM, so startup does
+    not depend on gallery size and processes share pages via the OS cache.
+    Registrations logged since the snapshot are replayed into a small
+    in-memory tail index that is searched alongside it.
+    """
+
+    def __init__(self, db_path, labels_path, wal_path=None, compact_every=1000, index_type="auto",
+                 ivf_at=20000, hnsw_at=1000000, nlist=None, nprobe=16, hnsw_m=32, ef_search=64,
+                 metric="l2", mmap=False, compression=None, compress_at=10000, pq_m=None, refine_factor=8):
+        self.db_path = db_path
+        self.labels_path = labels_path
+        self.wal_path = wal_path or db_path + ".wal"
+        # Log segment being folded into a snapshot by compaction.
+        self.compacting_path = self.wal_path + ".compacting"
+        self.compact_every = compact_every
+
+        if index_type not in INDEX_KINDS + ("auto",):
+            raise ValueError(f"Unknown index_type: {index_type}")
+        self.index_type = index_type
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.metric = metric
+        self.ivf_at = ivf_at
+        self.hnsw_at = hnsw_at
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        if compression is not None and compression not in CODECS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.compression = compression
+        self.compress_at = compress_at
+        self.pq_m = pq_m
+        self.refine_factor = refine_factor
+        self.vectors_path = vector_store_path(db_path)
+        self.vectors = None
+
+        self.read_only = mmap
+        self.mapped = False
+        self.tail_index = None
+
+        self.index = None
+        self.labels = LabelStore()
+        # One past the largest face ID in the index. The snapshot index is
+        # written before the label table, so after a crash it can be ahead.
+        self.index_next_id = 0
+        self.lock = threading.RLock()
+        self.wal = None
+        self.wal_records = 0
+        self.compactor = None
+        self.load()
+
+    # ===== Loading =====
+    def load(self):
+        legacy = False
+        if self.read_only and self._load_mmap():
+            pass
+        elif snapshot_exists(self.db_path, self.labels_path):
+            print("[+] Loading existing FAISS index...")
+            index = faiss.read_index(self.db_path)
+            if index_metric(index) != self.metric:
+                print(f"[WARN] Existing FAISS DB uses the {index_metric(index)} metric; "
+                      f"ignoring metric={self.metric!r}.")
+                self.metric = index_metric(index)
+            self.labels, legacy = self._read_labels()
+            self.index = with_ids(index, self.read_only)
+            self._adopt_codec(self.index)
+            self._tune(self.index)
+            ids = index_ids(self.index)
+            self.index_next_id = int(ids.max()) + 1 if len(ids) else 0
+            self._open_vectors(self.index.d)
+            if self.vectors is not None and self.vectors.rows < self.index_next_id:
+                self._backfill_vectors(ids)
+        else:
+            print("[+] No existing FAISS DB found. It will be created on first registration.")
+
+        replayed = 0
+        for path in (self.compacting_path, self.wal_path):
+            for seq, label, emb in _read_wal(path):
+                replayed += self._apply(seq, label, emb)
+        if replayed:
+            print(f"[+] Replayed {replayed} records from the write-ahead log.")
+        if self.read_only:
+            return
+
+        # An interrupted compaction leaves its segment behind: merge it back
+        # into the live log so the next compaction covers it again.
+        if os.path.exists(self.compacting_path):
+            records = list(_read_wal(self.compacting_path)) + list(_read_wal(self.wal_path))
+            tmp = self.wal_path + ".tmp"
+            with open(tmp, "wb") as f:
+                for record in records:
+                    f.write(_encode(*record))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.wal_path)
+            os.remove(self.compacting_path)
+        self._open_wal()
+        self.wal_records = sum(1 for _ in _read_wal(self.wal_path))
+        if legacy:
+            print("[+] Upgrading FAISS DB to face IDs and a label table...")
+            self.compact(force=True)
+        self._maybe_migrate()
+
+    def _read_labels(self):
+        """(LabelStore, legacy) from the label table, else from the pickled
+        label list of a pre-ID database."""
+        table_path = label_table_path(self.labels_path)
+        if os.path.exists(table_path):
+            try:
+                return LabelStore.from_table(LabelTable(table_path)), False
+            except ValueError as e:
+                if not os.path.exists(self.labels_path):
+                    raise
+                print(f"[WARN] {e}; using {self.labels_path}.")
+        with open(self.labels_path, "rb") as f:
+            return LabelStore.from_list(pickle.load(f)), True
+
+    def _load_mmap(self):
+        table_path = label_table_path(self.labels_path)
+        if not (os.path.exists(self.db_path) and os.path.exists(table_path)):
+            print("[WARN] No memory-mappable snapshot yet; loading FAISS DB into RAM.")
+            return False
+        try:
+            table = LabelTable(table_path)
+        except ValueError as e:
+            print(f"[WARN] {e}; loading FAISS DB into RAM.")
+            return False
+
+        print("[+] Memory-mapping FAISS index...")
+        index = read_index_mmap(self.db_path)
+        ids = index_ids(index)
+        if not isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF)) or \
+                (len(ids) and int(ids.max()) >= table.slots):
+            print("[WARN] Snapshot index and label table disagree; loading FAISS DB into RAM.")
+            return False
+
+        self.index = index
+        self.index_next_id = table.slots
+        self.metric = index_metric(index)
+        self._adopt_codec(index)
+        self._tune(index)
+        self._open_vectors(index.d)
+        self.labels = LabelStore(base=table)
+        self.mapped = True
+        return True
+
+    def _adopt_codec(self, index):
+        codec = index_codec(index)
+        if codec is not None and codec != self.compression:
+            if self.compression is not None:
+                print(f"[WARN] Existing FAISS DB uses {codec} compression; "
+                      f"ignoring compression={self.compression!r}.")
+            self.compression = codec
+
+    def _open_vectors(self, d):
+        # The exact vector store is only needed (and kept up to date) when
+        # the index is, or will become, compressed.
+        if self.vectors is None and (self.compression is not None or os.path.exists(self.vectors_path)):
+            self.vectors = VectorStore(self.vectors_path, d, read_only=self.read_only)
+
+    def _backfill_vectors(self, ids):
+        if index_codec(self.index) is not None:
+            print("[WARN] Exact vectors missing for a compressed FAISS DB; searching without re-ranking.")
+            self.vectors.close()
+            self.vectors = None
+        elif not self.read_only:
+            # Compression was just switched on: the index still holds the
+            # exact vectors.
+            print(f"[+] Writing {len(ids)} exact vectors to {self.vectors_path}...")
+            self.vectors.write(ids, self.index.reconstruct_batch(ids))
+
+    def _apply(self, seq, label, emb):
+        if emb.shape[1] == 0:
+            return self._discard(seq)
+        if seq < self.labels.next_id:
+            return 0
+        if seq != self.labels.next_id:
+            print(f"[WARN] Gap in write-ahead log at record {seq}; stopping replay.")
+            return 0
+        ids = np.array([seq], dtype="int64")
+        if self.mapped:
+            # The mapped snapshot is read-only; newer faces live in the tail.
+            if self.tail_index is None:
+                self.tail_index = self._new_index(emb.shape[1])
+            self.tail_index.add_with_ids(emb, ids)
+        else:
+            if self.index is None:
+                self.index = self._new_index(emb.shape[1])
+                self._open_vectors(emb.shape[1])
+            if seq >= self.index_next_id:
+                self.index.add_with_ids(emb, ids)
+                self.index_next_id = seq + 1
+            if self.vectors is not None and not self.read_only:
+                self.vectors.write(ids, emb)
+        self.labels.add(seq, label)
+        return 1
+
+    def _discard(self, face_id):
+        # Drop a face from the labels and, where the index kind allows it,
+        # from the index; otherwise its vector stays behind as a tombstone.
+        if self.labels.remove(face_id) is None:
+            return 0
+        ids = np.array([face_id], dtype="int64")
+        if self.tail_index is not None:
+            self.tail_index.remove_ids(ids)
+        if self.index is not None and not self.mapped and index_kind(self.index) != "hnsw":
+            self.index.remove_ids(ids)
+        return 1
+
+    # ===== Index type selection =====
+    def _new_index(self, d):
+        return build_index("flat", np.empty((0, d), dtype="float32"), metric=self.metric)
+
+    def _prepare(self, embs):
+        embs = np.array(embs, dtype="float32").reshape(len(embs), -1)
+        if self.metric == "cosine":
+            faiss.normalize_L2(embs)
+        return embs
+
+    def target_codec(self, n):
+        if self.compression is not None and n >= self.compress_at:
+            return self.compression
+        return None
+
+    def target_kind(self, n):
+        if self.index_type == "auto":
+            if n >= self.hnsw_at:
+                return "hnsw"
+            if n >= self.ivf_at:
+                return "ivf"
+            return "flat"
+        threshold = {"flat": 0, "ivf": self.ivf_at, "hnsw": self.hnsw_at}[self.index_type]
+        return self.index_type if n >= threshold else "flat"
+
+    def _tune(self, index):
+        kind = index_kind(index)
+        if kind == "ivf":
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        elif kind == "hnsw":
+            base_index(index).hnsw.efSearch = self.ef_search
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        with self.lock:
+            if nprobe is not None:
+                self.nprobe = nprobe
+            if ef_search is not None:
+                self.ef_search = ef_search
+            if self.index is not None:
+                self._tune(self.index)
+
+    def _maybe_migrate(self):
+        if self.index is None or self.read_only:
+            return False
+        current = index_kind(self.index)
+        current_codec = index_codec(self.index)
+        n = len(self.labels)
+        target = self.target_kind(n)
+        # Only ever move forward (flat -> ivf -> hnsw, exact -> compressed).
+        if INDEX_KINDS.index(target) < INDEX_KINDS.index(current):
+            target = current
+        target_codec = current_codec or self.target_codec(n)
+        if (target, target_codec) == (current, current_codec):
+            return False
+
+        # Carry the live faces over under the same IDs; tombstones are dropped.
+        ids = index_ids(self.index)
+        ids = ids[np.fromiter((i in self.labels for i in ids.tolist()), dtype=bool, count=len(ids))]
+        print(f"[+] Migrating FAISS index {describe(current, current_codec)} -> "
+              f"{describe(target, target_codec)} ({len(ids)} vectors)...")
+        # A compressed index only reconstructs approximations; rebuild from
+        # the exact vectors when there are any.
+        if self.vectors is not None:
+            vectors = self.vectors.get(ids)
+        else:
+            vectors = self.index.reconstruct_batch(ids)
+        index = build_index(target, vectors, ids=ids, nlist=self.nlist, hnsw_m=self.hnsw_m,
+                            metric=self.metric, codec=target_codec, pq_m=self.pq_m)
+        self._tune(index)
+        self.index = index
+        # Persist the new index type right away instead of at the next
+        # scheduled compaction.
+        self.compact(force=True)
+        return True
+
+    # ===== Write-ahead log =====
+    def _open_wal(self):
+        if self.wal is None:
+            self.wal = open(self.wal_path, "ab")
+
+    def _append(self, seq, label, emb):
+        self._append_records([(seq, label, emb)])
+
+    def _append_records(self, records):
+        # One write and one fsync for the whole group.
+        self.wal.write(b"".join(_encode(seq, label, emb) for seq, label, emb in records))
+        self.wal.flush()
+        os.fsync(self.wal.fileno())
+
+    # ===== Public API =====
+    @property
+    def ntotal(self):
+        return len(self.labels)
+
+    @property
+    def tombstones(self):
+        """Vectors still in the index whose face was removed (HNSW, or the
+        read-only mapped snapshot)."""
+        n = sum(index.ntotal for index in (self.index, self.tail_index) if index is not None)
+        return max(0, n - len(self.labels))
+
+    def ids(self, label):
+        """Face IDs enrolled under `label`."""
+        return self.labels.ids(label)
+
+    def get_vectors(self, face_ids):
+        """(n, d) stored templates of `face_ids` (exact vectors when the
+        index is compressed and the vector store has them)."""
+        ids = np.asarray(face_ids, dtype="int64")
+        with self.lock:
+            if self.vectors is not None:
+                return self.vectors.get(ids)
+            return self.index.reconstruct_batch(ids)
+
+    def add(self, emb, label):
+        """Durably register one (1, d) embedding under `label`; returns its face ID."""
+        if self.read_only:
+            raise RuntimeError("FaceDB was opened read-only (mmap=True)")
+        if not label:
+            raise ValueError("Labels must be non-empty strings")
+        emb = self._prepare(np.asarray(emb).reshape(1, -1))
+        with self.lock:
+            if self.index is None:
+                print(f"[+] Creating FAISS index with dimension {emb.shape[1]} ({self.metric})")
+                self.index = self._new_index(emb.shape[1])
+                self._open_vectors(emb.shape[1])
+            if self.index.d != emb.shape[1]:
+                raise ValueError("Embedding dimension mismatch")
+
+            face_id = self.labels.next_id
+            ids = np.array([face_id], dtype="int64")
+            self._append(face_id, label, emb)
+            self.index.add_with_ids(emb, ids)
+            if self.vectors is not None:
+                self.vectors.write(ids, emb)
+            self.index_next_id = face_id + 1
+            self.labels.add(face_id, label)
+            self.wal_records += 1
+            self._maybe_migrate()
+
+            if self.compact_every and self.wal_records >= self.compact_every:
+                self.compact()
+            return face_id
+
+    def add_batch(self, embs, labels, migrate=True):
+        """Durably register (n, d) embeddings under `labels` with a single WAL
+        write + fsync and a single index add; returns their face IDs.
+
+        `migrate=False` defers the index type check (flat -> IVF -> ...) to
+        an explicit `migrate()`, so bulk loads build IVF / HNSW once, trained
+        on everything, instead of at each threshold they cross.
+        """
+        if self.read_only:
+            raise RuntimeError("FaceDB was opened read-only (mmap=True)")
+        if len(embs) != len(labels):
+            raise ValueError("Need one label per embedding")
+        if not all(labels):
+            raise ValueError("Labels must be non-empty strings")
+        if len(embs) == 0:
+            return []
+        embs = self._prepare(embs)
+        with self.lock:
+            if self.index is None:
+                print(f"[+] Creating FAISS index with dimension {embs.shape[1]} ({self.metric})")
+                self.index = self._new_index(embs.shape[1])
+                self._open_vectors(embs.shape[1])
+            if self.index.d != embs.shape[1]:
+                raise ValueError("Embedding dimension mismatch")
+
+            first = self.labels.next_id
+            ids = np.arange(first, first + len(embs), dtype="int64")
+            self._append_records([(int(i), label, emb[None]) for i, label, emb in zip(ids, labels, embs)])
+            self.index.add_with_ids(embs, ids)
+            if self.vectors is not None:
+                self.vectors.write(ids, embs)
+            self.index_next_id = int(ids[-1]) + 1
+            for face_id, label in zip(ids.tolist(), labels):
+                self.labels.add(face_id, label)
+            self.wal_records += len(embs)
+            if migrate:
+                self._maybe_migrate()
+
+            if self.compact_every and self.wal_records >= self.compact_every:
+                self.compact()
+            return ids.tolist()
+
+    def migrate(self):
+        """Move to the index type / codec the current size calls for; returns
+        True if the index was rebuilt (and a snapshot started)."""
+        with self.lock:
+            return self._maybe_migrate()
+
+    def remove_ids(self, face_ids):
+        """Durably remove faces by ID; returns how many were removed."""
+        if self.read_only:
+            raise RuntimeError("FaceDB was opened read-only (mmap=True)")
+        removed = 0
+        with self.lock:
+            for face_id in face_ids:
+                face_id = int(face_id)
+                if face_id not in self.labels:
+                    continue
+                self._append(face_id, "", np.empty((1, 0), dtype="float32"))
+                removed += self._discard(face_id)
+                self.wal_records += 1
+
+            if self.compact_every and self.wal_records >= self.compact_every:
+                self.compact()
+        return removed
+
+    def remove_label(self, label):
+        """Remove every template enrolled under `label`."""
+        return self.remove_ids(self.labels.ids(label))
+
+    def reenroll(self, label, embs):
+        """Replace the templates of `label` with `embs` ((n, d)); returns the new face IDs."""
+        embs = np.asarray(embs, dtype="float32")
+        if embs.ndim == 1:
+            embs = embs.reshape(1, -1)
+        with self.lock:
+            self.remove_label(label)
+            return [self.add(emb, label) for emb in embs]
+
+    def search(self, emb, k=1):
+        """Raw FAISS search: (distances, face IDs). IDs may include
+        tombstones; `search_labels` filters those out."""
+        emb = self._prepare(emb)
+        with self.lock:
+            D, I = self._search_index(emb, k)
+            if self.tail_index is None:
+                return D, I
+            # Merge the mapped snapshot's hits with the in-memory tail's.
+            D2, I2 = self.tail_index.search(emb, k)
+            D = np.hstack([D, D2])
+            I = np.hstack([I, I2])
+            order = np.argsort(-D if self.metric == "cosine" else D, axis=1)[:, :k]
+            return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+    def _search_index(self, emb, k):
+        if self.vectors is None or index_codec(self.index) is None:
+            return self.index.search(emb, k)
+        # Two-stage search: candidates from the compressed codes, then exact
+        # distances from the on-disk vectors.
+        _, I = self.index.search(emb, k * self.refine_factor)
+        return rerank(emb, I, self.vectors.get(np.where(I >= 0, I, 0)), k, self.metric)
+
+    def search_labels(self, embs, k=1):
+        """Search and map face IDs to labels: one [(label, face_id, distance), ...]
+        list per query row. Empty result slots (ID -1, possible with IVF and
+        a small nprobe) and removed faces are dropped."""
+        if self.index is None or self.ntotal == 0:
+            return [[] for _ in range(len(embs))]
+        # Fetch extra candidates so tombstones don't push live faces out.
+        D, I = self.search(embs, k + self.tombstones)
+        results = []
+        for drow, irow in zip(D, I):
+            hits = []
+            for d, i in zip(drow, irow):
+                label = self.labels.get(int(i)) if i >= 0 else None
+                if label is not None:
+                    hits.append((label, int(i), float(d)))
+            results.append(hits[:k])
+        return results
+
+    def search_identities(self, embs, k=10, agg="max"):
+        """Top-k search grouped by label (one label = one identity, possibly
+        with several enrolled templates).
+
+        Returns one ranked [(label, similarity, n_templates), ...] list per
+        query row, best first. Scores are cosine similarities whatever the
+        index metric, so one threshold works for both. `agg` combines the
+        templates of an identity: "max" (best template) or "mean".
+        """
+        if agg not in ("max", "mean"):
+            raise ValueError(f"Unknown aggregation: {agg}")
+        ranked = []
+        for hits in self.search_labels(embs, k):
+            scores = {}
+            for label, _, score in hits:
+                scores.setdefault(label, []).append(to_similarity(self.metric, score))
+            identities = [(label, max(s) if agg == "max" else sum(s) / len(s), len(s))
+                          for label, s in scores.items()]
+            identities.sort(key=lambda t: t[1], reverse=True)
+            ranked.append(identities)
+        return ranked
+
+    def compact(self, wait=False, force=False):
+        """Write a fresh snapshot in the background and drop the log it covers.
+        `force` writes one even when the log is empty. `wait` returns only
+        once everything logged before the call is in a snapshot on disk: a
+        compaction already running is joined, then the records logged since
+        it started are compacted too."""
+        if self.read_only:
+            return
+        with self.lock:
+            if self.compactor is not None and self.compactor.is_alive():
+                if not (wait or force):
+                    return
+                self.compactor.join()
+            if self.index is None or (self.wal_records == 0 and not force):
+                return
+            # Rotate the log: records added from now on go to a fresh file,
+            # and the snapshot taken below covers everything in the old one.
+            self.wal.close()
+            self.wal = None
+            if os.path.exists(self.compacting_path):
+                # Segment of an earlier compaction that failed: keep its
+                # records by appending the log to it, so this snapshot covers
+                # both. Replay skips records seen twice after a crash here.
+                with open(self.compacting_path, "ab") as dst, open(self.wal_path, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.wal_path)
+            else:
+                os.replace(self.wal_path, self.compacting_path)
+            self._open_wal()
+            self.wal_records = 0
+
+            index_copy = faiss.clone_index(self.index)
+            labels_copy = self.labels.copy()
+
+        self.compactor = threading.Thread(target=self._write_snapshot, args=(index_copy, labels_copy),
+                                          name="face-db-compactor", daemon=True)
+        self.compactor.start()
+        if wait:
+            self.compactor.join()
+
+    def _write_snapshot(self, index, labels):
+        try:
+            # Exact vectors of everything the snapshot covers must survive
+            # the log segment it replaces.
+            if self.vectors is not None:
+                self.vectors.flush()
+            tmp = self.db_path + ".tmp"
+            faiss.write_index(index, tmp)
+            os.replace(tmp, self.db_path)
+            table_path = label_table_path(self.labels_path)
+            write_label_table(labels, table_path)
+            # The label table replaces the pickled list of pre-ID databases.
+            if table_path != self.labels_path and os.path.exists(self.labels_path):
+                os.remove(self.labels_path)
+            os.remove(self.compacting_path)
+            print(f"[+] Compacted FAISS DB snapshot ({len(labels)} faces).")
+        except Exception as e:
+            # The rotated segment stays on disk and is replayed on next start.
+            print("[ERROR] FAISS DB compaction failed:", e)
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.join()
+        with self.lock:
+            if self.wal is not None:
+                self.wal.close()
+                self.wal = None
+            if self.vectors is not None:
+                self.vectors.close()
+                self.vectors = None
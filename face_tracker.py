@@ -0,0 +1,145 @@
+import itertools
+
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """Pairwise IoU between two (N, 4) and (M, 4) arrays of x1, y1, x2, y2 boxes."""
+    a = np.asarray(a, dtype="float32").reshape(-1, 4)
+    b = np.asarray(b, dtype="float32").reshape(-1, 4)
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class Track:
+    """One tracked face: box, per-frame velocity and a confidence that decays
+    while the track is only being predicted."""
+
+    def __init__(self, track_id, box, conf):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype="float32")
+        self.velocity = np.zeros(4, dtype="float32")
+        self.conf = conf
+        self.hits = 1
+        self.missed = 0
+        self.frames_since_detect = 0
+
+    def predict(self, conf_decay):
+        self.box = self.box + self.velocity
+        self.conf *= conf_decay
+        self.frames_since_detect += 1
+
+    def correct(self, box, conf, smoothing):
+        # Alpha-beta update: blend the measured box into the prediction and
+        # re-estimate the per-frame velocity from the observed displacement.
+        box = np.asarray(box, dtype="float32")
+        steps = max(self.frames_since_detect, 1)
+        measured_velocity = (box - self.box + self.velocity * steps) / steps
+        self.velocity = smoothing * self.velocity + (1 - smoothing) * measured_velocity
+        self.box = box
+        self.conf = conf
+        self.hits += 1
+        self.missed = 0
+        self.frames_since_detect = 0
+
+
+class FaceTracker:
+    """IoU tracker with constant-velocity prediction.
+
+    The detector only has to run every `detect_every` frames (or sooner when a
+    track's confidence decays below `redetect_conf`, or when nothing is being
+    tracked). In between, `predict()` moves every track along its estimated
+    velocity so boxes and crops stay current. Tracks keep a stable `track_id`
+    across detections, matched by IoU.
+    """
+
+    def __init__(self, detect_every=5, iou_thresh=0.3, max_missed=2, conf_decay=0.95, redetect_conf=0.3,
+                 smoothing=0.5):
+        self.detect_every = detect_every
+        self.iou_thresh = iou_thresh
+        self.max_missed = max_missed
+        self.conf_decay = conf_decay
+        self.redetect_conf = redetect_conf
+        self.smoothing = smoothing
+
+        self.tracks = []
+        self.frames_since_detect = 0
+        self._ids = itertools.count(1)
+
+    def needs_detection(self):
+        if not self.tracks:
+            return True
+        if self.frames_since_detect + 1 >= self.detect_every:
+            return True
+        return any(t.conf < self.redetect_conf for t in self.tracks)
+
+    def predict(self, frame_shape=None):
+        self.frames_since_detect += 1
+        for t in self.tracks:
+            t.predict(self.conf_decay)
+            if frame_shape is not None:
+                h, w = frame_shape[:2]
+                t.box = np.clip(t.box, 0, [w, h, w, h])
+        # Drop tracks that drifted out of the frame (zero-area box).
+        self.tracks = [t for t in self.tracks if t.box[2] - t.box[0] > 1 and t.box[3] - t.box[1] > 1]
+        return self.faces()
+
+    def update(self, detections):
+        """Feed detector output: a list of (x1, y1, x2, y2, area, conf)."""
+        boxes = np.array([d[:4] for d in detections], dtype="float32").reshape(-1, 4)
+        confs = np.array([d[5] for d in detections], dtype="float32")
+        return self.update_arrays(boxes, confs)
+
+    def update_arrays(self, det_boxes, det_confs):
+        """Feed detector output as an (N, 4) box array and (N,) confidences."""
+        self.frames_since_detect = 0
+        for t in self.tracks:
+            t.predict(1.0)
+
+        det_boxes = np.asarray(det_boxes, dtype="float32").reshape(-1, 4)
+        matched_tracks = set()
+        matched_dets = set()
+
+        if self.tracks and len(det_boxes):
+            ious = iou_matrix([t.box for t in self.tracks], det_boxes)
+            # Greedy assignment, best IoU first.
+            for ti, di in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape)):
+                if ious[ti, di] < self.iou_thresh:
+                    break
+                if ti in matched_tracks or di in matched_dets:
+                    continue
+                self.tracks[ti].correct(det_boxes[di], float(det_confs[di]), self.smoothing)
+                matched_tracks.add(ti)
+                matched_dets.add(di)
+
+        kept = []
+        for ti, t in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                t.missed += 1
+                if t.missed > self.max_missed:
+                    continue
+            kept.append(t)
+        for di in range(len(det_boxes)):
+            if di not in matched_dets:
+                kept.append(Track(next(self._ids), det_boxes[di], float(det_confs[di])))
+        self.tracks = kept
+        return self.faces()
+
+    def faces(self):
+        """Current tracks as (x1, y1, x2, y2, area, conf, track_id) tuples."""
+        faces = []
+        for t in self.tracks:
+            # Tracks that missed the latest detection are kept alive for
+            # matching but not reported.
+            if t.missed:
+                continue
+            x1, y1, x2, y2 = (int(v) for v in t.box)
+            faces.append((x1, y1, x2, y2, (x2 - x1) * (y2 - y1), float(t.conf), t.track_id))
+        return faces
@@ -0,0 +1,262 @@
+# Headless batch mode: run detection + embedding + search over a video file,
+# an image sequence or a stream URL without a display, writing one JSON line
+# per processed frame.
+#
+#     python headless.py footage.mp4 --every 5 --output footage.jsonl
+#     python headless.py frames/                        # directory of images
+#     python headless.py "frames/img_%05d.jpg"          # OpenCV sequence pattern
+#     python headless.py rtsp://camera/stream --live
+#
+# Output lines look like
+#     {"frame": 120, "time": 4.0, "faces": [{"box": [x1, y1, x2, y2],
+#      "track_id": 3, "label": "person_1", "similarity": 0.71}], "latency_ms": 48.2}
+# and a throughput report (fps, per-stage latency) is printed to stderr at
+# the end, as are all other log messages, so stdout stays pure JSON lines.
+# --metrics run.prom (or .json) keeps a metrics file (metrics.py) up to date
+# during the run, --metrics-port serves it to Prometheus.
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+import cv2
+
+# Nothing imported here may load the models: their import-time output would
+# land in the JSON lines. Face_To_Embedding_Class is imported in main(),
+# after stdout is redirected.
+from metrics import REGISTRY
+from pipeline import BlockingQueue, FacePipeline, StageStats
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+class ImageSequence:
+    """cv2.VideoCapture look-alike over the sorted images of a directory."""
+
+    def __init__(self, directory):
+        self.paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if os.path.splitext(name)[1].lower() in IMAGE_EXTS)
+        self.pos = 0
+        self.current = None
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def grab(self):
+        # Skipping a file costs nothing: it is never decoded.
+        if self.pos >= len(self.paths):
+            return False
+        self.current = self.paths[self.pos]
+        self.pos += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        frame = cv2.imread(self.current)
+        return frame is not None, frame
+
+    def get(self, prop):
+        return 0.0
+
+    def release(self):
+        self.paths = []
+
+
+def open_source(source):
+    if os.path.isdir(source):
+        return ImageSequence(source)
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    # Ask for hardware decoding where this OpenCV build and the codec allow
+    # it; plain software decoding otherwise.
+    accel = getattr(cv2, "CAP_PROP_HW_ACCELERATION", None)
+    if accel is not None and "%" not in source:
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, [accel, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+    return cv2.VideoCapture(source)
+
+
+class HeadlessPipeline(FacePipeline):
+    """FacePipeline without a window.
+
+    The capture thread decodes ahead of inference into a `prefetch`-deep
+    queue and only `grab()`s (demuxes without decoding) the frames skipped
+    by `every`. Offline sources use blocking queues, so every selected frame
+    is processed; `live=True` keeps the drop-oldest queues of the preview
+    pipeline so a slow model cannot make a stream fall behind.
+    """
+
+    def __init__(self, system, source, out, every=1, prefetch=8, live=False, max_frames=None):
+        self.live = live
+        super().__init__(system, source=source, queue_size=2, stats_every=0)
+        self.frame_q = self.new_queue(prefetch)
+        self.stages[0].in_q = self.frame_q
+
+        self.out = out
+        self.every = max(1, every)
+        self.max_frames = max_frames
+        self.source_frames = 0
+        self.enqueued = 0
+        self.published = 0
+        self.eof = threading.Event()
+        self.out_lock = threading.Lock()
+        self.total_stats = StageStats("total", self.pipeline_id)
+        self.started = None
+
+    def new_queue(self, size):
+        if self.live:
+            return super().new_queue(size)
+        return BlockingQueue(size, self.stop_event)
+
+    def capture(self, cap):
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        index = -1
+        while not self.stop_event.is_set():
+            if self.max_frames is not None and self.enqueued >= self.max_frames:
+                break
+            t0 = time.perf_counter()
+            index += 1
+            if index % self.every:
+                if not cap.grab():
+                    break
+                self.source_frames += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            self.source_frames += 1
+            self.capture_stats.record(time.perf_counter() - t0)
+
+            pkt = {"frame_id": index, "frame": frame, "t0": t0}
+            if fps:
+                pkt["time"] = round(index / fps, 3)
+            if isinstance(cap, ImageSequence):
+                pkt["file"] = cap.current
+            self.enqueued += 1
+            self.frame_q.put_latest(pkt)
+        self.eof.set()
+
+    def publish(self, pkt, results):
+        track_ids = pkt.get("track_ids", [])
+        faces = []
+        for i, (box, name, sim) in enumerate(results):
+            faces.append({
+                "box": [int(v) for v in box],
+                "track_id": track_ids[i] if i < len(track_ids) else None,
+                "label": name,
+                "similarity": None if sim is None else round(float(sim), 4),
+            })
+        latency = time.perf_counter() - pkt["t0"]
+        self.total_stats.record(latency)
+
+        record = {"frame": pkt["frame_id"]}
+        for key in ("time", "file"):
+            if key in pkt:
+                record[key] = pkt[key]
+        record["faces"] = faces
+        record["latency_ms"] = round(latency * 1000, 1)
+        with self.out_lock:
+            self.out.write(json.dumps(record) + "\n")
+            self.published += 1
+
+    def finished(self):
+        # Every enqueued frame was either written out, dropped by a queue or
+        # lost to a stage error.
+        lost = sum(stage.stats.errors + stage.in_q.dropped for stage in self.stages)
+        return self.eof.is_set() and self.published + lost >= self.enqueued
+
+    def run(self):
+        cap = open_source(self.source)
+        if not cap.isOpened():
+            print(f"[ERROR] Cannot open {self.source}")
+            return
+
+        self.started = time.perf_counter()
+        capture_thread = threading.Thread(target=self.capture, args=(cap,), name="capture", daemon=True)
+        capture_thread.start()
+        for stage in self.stages:
+            stage.start()
+
+        try:
+            while not self.stop_event.is_set() and not self.finished():
+                time.sleep(0.05)
+        except KeyboardInterrupt:
+            print("[!] Interrupted.")
+        finally:
+            self.stop_event.set()
+            capture_thread.join(timeout=1.0)
+            for stage in self.stages:
+                stage.join(timeout=1.0)
+            cap.release()
+            self.out.flush()
+            self.system.db.close()
+            self.report()
+
+    def report(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        print("[STATS] headless run")
+        print(f"  frames   {self.published} processed / {self.enqueued} decoded / {self.source_frames} read "
+              f"(every {self.every}) in {elapsed:.1f}s = {self.published / elapsed:.1f} fps")
+        stats = [self.capture_stats] + [stage.stats for stage in self.stages] + [self.total_stats]
+        for s in stats:
+            avg = s.busy / s.count * 1000 if s.count else 0.0
+            print(f"  {s.name:<8} avg {avg:7.1f} ms  p50 {s.percentile(50) * 1000:7.1f} ms  "
+                  f"p95 {s.percentile(95) * 1000:7.1f} ms  n={s.count} errors={s.errors}")
+        dropped = sum(stage.in_q.dropped for stage in self.stages)
+        if dropped:
+            print(f"  dropped  {dropped} frames (live mode)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless face recognition over a video, image sequence or stream.")
+    parser.add_argument("source", help="video file, image directory, OpenCV sequence pattern, stream URL or camera index")
+    parser.add_argument("--every", type=int, default=1, help="process every Nth frame")
+    parser.add_argument("--output", default="-", help="JSON-lines output file (default: stdout)")
+    parser.add_argument("--weights", default=r"C:\YoLo-Face\runs\detect\train3\weights\best.pt")
+    parser.add_argument("--db", default="face_db.index")
+    parser.add_argument("--labels", default="face_labels.pkl")
+    parser.add_argument("--detect-every", type=int, default=1, help="run YOLO every N processed frames, track between")
+    parser.add_argument("--largest-only", action="store_true", help="only the largest face per frame")
+    parser.add_argument("--prefetch", type=int, default=8, help="decoded frames buffered ahead of inference")
+    parser.add_argument("--live", action="store_true", help="drop frames instead of falling behind (streams)")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--mmap", action="store_true", help="open the FAISS DB read-only, memory-mapped")
+    parser.add_argument("--metrics", default=None, help="metrics file, Prometheus text or *.json")
+    parser.add_argument("--metrics-every", type=float, default=10.0, help="seconds between metrics file writes")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve /metrics on this port")
+    args = parser.parse_args()
+
+    # stdout carries the JSON lines; everything else goes to stderr.
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    with contextlib.redirect_stdout(sys.stderr):
+        from Face_To_Embedding_Class import FaceRecognitionSystem
+
+        system = FaceRecognitionSystem(
+            yolo_weights=args.weights,
+            db_path=args.db,
+            labels_path=args.labels,
+            multi_face=not args.largest_only,
+            detect_every=args.detect_every,
+            mmap=args.mmap
+        )
+        live = args.live or "://" in args.source
+        pipeline = HeadlessPipeline(system, args.source, out, every=args.every, prefetch=args.prefetch, live=live,
+                                    max_frames=args.max_frames)
+        if args.metrics:
+            REGISTRY.export(args.metrics, args.metrics_every)
+        if args.metrics_port:
+            REGISTRY.serve(args.metrics_port)
+        pipeline.run()
+        if args.metrics:
+            REGISTRY.write(args.metrics)
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
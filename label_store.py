@@ -0,0 +1,186 @@
+import os
+import struct
+
+import numpy as np
+
+# Label table file, one slot per face ID (IDs are never reused):
+#   magic "FLBL" | version (u32) | slots (u64) | live labels (u64)
+#   offsets: (slots + 1) x u64, byte offsets into the blob
+#   blob: all labels, utf-8, back to back
+# A removed face leaves an empty slot, so id -> label is one offset lookup.
+# The file is memory-mapped, so opening it costs the same for 10 or 10M
+# labels and several processes share its pages through the OS cache.
+_MAGIC = b"FLBL"
+_VERSION = 2
+_HEADER = struct.Struct("<4sIQQ")
+
+
+def label_table_path(labels_path):
+    return os.path.splitext(labels_path)[0] + ".tbl"
+
+
+def write_label_table(labels, path):
+    """Write a LabelStore (or anything with `next_id` and `get`) to `path`."""
+    encoded = []
+    for face_id in range(labels.next_id):
+        label = labels.get(face_id)
+        encoded.append(b"" if label is None else label.encode("utf-8"))
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(encoded), len(labels)))
+        f.write(offsets.tobytes())
+        f.write(b"".join(encoded))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class LabelTable:
+    """Read-only, memory-mapped id -> label table."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, slots, live = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} label table")
+        self.slots = slots
+        self.live = live
+        self.offsets = np.memmap(path, dtype="<u8", mode="r", offset=_HEADER.size, shape=(slots + 1,))
+        blob_start = _HEADER.size + 8 * (slots + 1)
+        blob_size = int(self.offsets[-1])
+        self.blob = np.memmap(path, dtype="u1", mode="r", offset=blob_start, shape=(blob_size,)) \
+            if blob_size else np.empty(0, dtype="u1")
+
+    def __len__(self):
+        return self.live
+
+    def get(self, face_id):
+        if not 0 <= face_id < self.slots:
+            return None
+        start, end = int(self.offsets[face_id]), int(self.offsets[face_id + 1])
+        if start == end:
+            return None
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def items(self):
+        lengths = np.diff(self.offsets)
+        for face_id in np.flatnonzero(lengths).tolist():
+            yield face_id, self.get(face_id)
+
+
+class LabelStore:
+    """Face ID <-> label mapping with O(1) lookups both ways.
+
+    IDs are 64-bit, assigned in increasing order and never reused, and are
+    the IDs stored in the FAISS index. One label can own several IDs (one
+    per enrolled template). With a `base` LabelTable the store is an
+    overlay: the mapped table answers for snapshot IDs, newer IDs and
+    removals live in memory.
+
+    Indexing with an ID (`labels[face_id]`) returns its label, so search
+    results map to names the same way row numbers did.
+    """
+
+    def __init__(self, base=None):
+        self.base = base
+        self.names = {}  # face_id -> label, IDs not in `base`
+        self.removed = set()  # `base` IDs removed since the snapshot
+        self._by_label = None if base is not None else {}  # label -> [face_id, ...]
+        self.next_id = base.slots if base is not None else 0
+
+    @classmethod
+    def from_list(cls, labels):
+        # Legacy label lists: the row number is the ID.
+        store = cls()
+        for face_id, label in enumerate(labels):
+            store.add(face_id, label)
+        return store
+
+    @classmethod
+    def from_table(cls, table):
+        store = cls()
+        for face_id, label in table.items():
+            store.add(face_id, label)
+        store.next_id = max(store.next_id, table.slots)
+        return store
+
+    def copy(self):
+        store = LabelStore(self.base)
+        store.names = dict(self.names)
+        store.removed = set(self.removed)
+        store._by_label = None
+        store.next_id = self.next_id
+        return store
+
+    def get(self, face_id, default=None):
+        label = self.names.get(face_id)
+        if label is not None:
+            return label
+        if self.base is not None and face_id not in self.removed:
+            label = self.base.get(face_id)
+            if label is not None:
+                return label
+        return default
+
+    def __getitem__(self, face_id):
+        label = self.get(int(face_id))
+        if label is None:
+            raise KeyError(face_id)
+        return label
+
+    def __contains__(self, face_id):
+        return self.get(int(face_id)) is not None
+
+    def __len__(self):
+        base = len(self.base) - len(self.removed) if self.base is not None else 0
+        return base + len(self.names)
+
+    def __iter__(self):
+        for _, label in self.items():
+            yield label
+
+    def items(self):
+        """(face_id, label) pairs in ID order."""
+        if self.base is not None:
+            for face_id, label in self.base.items():
+                if face_id not in self.removed:
+                    yield face_id, label
+        for face_id in sorted(self.names):
+            yield face_id, self.names[face_id]
+
+    def by_label(self):
+        if self._by_label is None:
+            # Overlay on a mapped table: build the reverse map on first use.
+            self._by_label = {}
+            for face_id, label in self.items():
+                self._by_label.setdefault(label, []).append(face_id)
+        return self._by_label
+
+    def ids(self, label):
+        return list(self.by_label().get(label, ()))
+
+    def add(self, face_id, label):
+        if not label:
+            raise ValueError("Labels must be non-empty strings")
+        self.names[face_id] = label
+        if self._by_label is not None:
+            self._by_label.setdefault(label, []).append(face_id)
+        self.next_id = max(self.next_id, face_id + 1)
+
+    def remove(self, face_id):
+        """Forget `face_id`; returns its label, or None if it was unknown."""
+        label = self.names.pop(face_id, None)
+        if label is None and self.base is not None and face_id not in self.removed:
+            label = self.base.get(face_id)
+            if label is not None:
+                self.removed.add(face_id)
+        if label is not None and self._by_label is not None:
+            ids = self._by_label[label]
+            ids.remove(face_id)
+            if not ids:
+                del self._by_label[label]
+        return label
@@ -0,0 +1,270 @@
+import collections
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide counters, gauges and latency histograms, shared by the client
+# side (Face_To_Embedding_Class, pipeline, server_client, copy3 / copy4) and
+# server.py, exported as Prometheus text or JSON.
+#
+#     from metrics import REGISTRY
+#     DETECT_SECONDS = REGISTRY.histogram("face_detect_seconds", "YOLO + post-processing per frame")
+#     with DETECT_SECONDS.time():
+#         ...
+#     REGISTRY.counter("face_matches_total", "Searches above sim_thresh").inc()
+#
+#     REGISTRY.export("client_metrics.prom")   # file rewritten every 10 s (.json -> JSON)
+#     REGISTRY.serve(9100)                     # or http://host:9100/metrics (/metrics.json)
+#
+# Recording costs a perf_counter() pair, a lock and a deque append (about a
+# microsecond) against stage latencies of milliseconds; percentiles are only
+# computed on export. Histograms are exported as Prometheus summaries:
+# p50 / p95 / p99 over the most recent samples plus all-time _sum / _count.
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Window:
+    """Count, total and percentiles over the most recent samples."""
+
+    def __init__(self, size=10000):
+        self.count = 0
+        self.total = 0.0
+        self.samples = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        with self.lock:
+            self.count += 1
+            self.total += value
+            self.samples.append(value)
+
+    def record_many(self, values):
+        # One lock round trip for a whole batch.
+        with self.lock:
+            self.count += len(values)
+            self.total += sum(values)
+            self.samples.extend(values)
+
+    def percentiles(self, qs):
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return [0.0 for _ in qs]
+        return [samples[min(len(samples) - 1, int(q / 100 * len(samples)))] for q in qs]
+
+    def percentile(self, q):
+        return self.percentiles([q])[0]
+
+    def summary(self, scale=1.0, digits=2):
+        mean = self.total / self.count if self.count else 0.0
+        p50, p95, p99 = self.percentiles([50, 95, 99])
+        return {
+            "count": self.count,
+            "mean": round(mean * scale, digits),
+            "p50": round(p50 * scale, digits),
+            "p95": round(p95 * scale, digits),
+            "p99": round(p99 * scale, digits),
+        }
+
+
+class _Timer:
+    __slots__ = ("window", "start")
+
+    def __init__(self, window):
+        self.window = window
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.window.record(time.perf_counter() - self.start)
+
+
+class Histogram(Window):
+    """Latency window (seconds) with a `with hist.time():` timer."""
+
+    def time(self):
+        return _Timer(self)
+
+
+class Counter:
+    """Monotonic count. With `fn`, the value is read from fn() on export
+    instead (for counts another object already keeps)."""
+
+    def __init__(self, fn=None):
+        self._value = 0
+        self.fn = fn
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self._value += n
+
+    @property
+    def value(self):
+        return self.fn() if self.fn is not None else self._value
+
+
+class Gauge(Counter):
+    """Current value: `set()`, or read from `fn()` on export."""
+
+    def set(self, value):
+        self._value = value
+
+
+def _series(name, labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return name
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return name + "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Registry:
+    """Metrics by (name, labels). The getters create a metric on first use
+    and return the same object afterwards, so modules can fetch their
+    metrics once at import time."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, kind, factory, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            entry = self.metrics.get(key)
+            if entry is None:
+                entry = self.metrics[key] = (kind, help, factory())
+            elif entry[0] != kind:
+                raise ValueError(f"Metric {name} is already a {entry[0]}")
+        return entry[2]
+
+    def counter(self, name, help="", fn=None, **labels):
+        counter = self._get("counter", Counter, name, help, labels)
+        if fn is not None:
+            counter.fn = fn
+        return counter
+
+    def gauge(self, name, help="", fn=None, **labels):
+        gauge = self._get("gauge", Gauge, name, help, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help="", size=10000, **labels):
+        return self._get("histogram", lambda: Histogram(size), name, help, labels)
+
+    def register(self, name, window, help="", **labels):
+        """Export an existing Window (e.g. MicroBatcher's) as a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.metrics[key] = ("histogram", help, window)
+        return window
+
+    def _values(self):
+        with self.lock:
+            entries = sorted(self.metrics.items())
+        for (name, labels), (kind, help, metric) in entries:
+            if kind == "histogram":
+                yield name, labels, kind, help, metric
+                continue
+            try:
+                value = metric.value
+            except Exception:
+                # A gauge whose owner is gone; skip rather than fail the export.
+                continue
+            yield name, labels, kind, help, value
+
+    def snapshot(self):
+        """JSON-ready dict. Histograms named *_seconds are reported in ms
+        (*_ms)."""
+        out = {"counters": {}, "gauges": {}, "histograms": {}}
+        for name, labels, kind, _, value in self._values():
+            if kind == "histogram":
+                if name.endswith("_seconds"):
+                    out["histograms"][_series(name[:-8] + "_ms", labels)] = value.summary(scale=1000, digits=3)
+                else:
+                    out["histograms"][_series(name, labels)] = value.summary(digits=3)
+            else:
+                out[kind + "s"][_series(name, labels)] = value
+        return out
+
+    def prometheus(self):
+        lines = []
+        described = set()
+        for name, labels, kind, help, value in self._values():
+            if name not in described:
+                described.add(name)
+                if help:
+                    lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {'summary' if kind == 'histogram' else kind}")
+            if kind != "histogram":
+                lines.append(f"{_series(name, labels)} {value}")
+                continue
+            for q, v in zip(QUANTILES, value.percentiles([q * 100 for q in QUANTILES])):
+                lines.append(f"{_series(name, labels, [('quantile', q)])} {v}")
+            lines.append(f"{_series(name + '_sum', labels)} {value.total}")
+            lines.append(f"{_series(name + '_count', labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write all metrics to `path`: JSON for *.json, Prometheus text
+        otherwise (e.g. for node_exporter's textfile collector)."""
+        if path.endswith(".json"):
+            text = json.dumps(self.snapshot(), indent=2)
+        else:
+            text = self.prometheus()
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def export(self, path, every=10.0):
+        """Rewrite `path` every `every` seconds from a daemon thread."""
+
+        def loop():
+            while True:
+                time.sleep(every)
+                try:
+                    self.write(path)
+                except OSError as e:
+                    print(f"[WARN] Could not write metrics to {path}: {e}")
+
+        thread = threading.Thread(target=loop, name="metrics-export", daemon=True)
+        thread.start()
+        print(f"[+] Writing metrics to {path} every {every:g}s")
+        return thread
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve GET /metrics (Prometheus) and /metrics.json from a daemon thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] == "/metrics":
+                    body, content_type = registry.prometheus().encode(), PROMETHEUS
+                elif self.path.split("?")[0] == "/metrics.json":
+                    body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[+] Metrics at http://{host}:{port}/metrics")
+        return server
+
+
+REGISTRY = Registry()
@@ -0,0 +1,136 @@
+import asyncio
+import collections
+import time
+
+from metrics import Window
+
+
+class Overloaded(Exception):
+    """The batcher queue has no room for the request."""
+
+
+class MicroBatcher:
+    """Collects items submitted by concurrent requests and hands them to
+    `run_batch` together.
+
+    A batch closes when it holds `max_batch` items or `max_wait` seconds
+    after its first item arrived, whichever comes first. `run_batch(items)`
+    is a coroutine returning one result per item; results are fanned back
+    out to the waiting `submit` calls. Up to `concurrency` batches run at
+    once (one per verifier worker), and at most `max_queue` items wait for
+    a batch; beyond that `submit` raises Overloaded.
+    """
+
+    def __init__(self, run_batch, max_batch=64, max_wait=0.005, concurrency=1, max_queue=4096):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.queue = collections.deque()
+        self.ready = asyncio.Event()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.task = None
+        self.running = set()
+
+        self.batch_sizes = Window()
+        self.queue_wait = Window()
+        self.batch_time = Window()
+        self.max_depth = 0
+        self.rejected = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+        for _, future, _ in self.queue:
+            if not future.done():
+                future.set_exception(Overloaded("server shutting down"))
+        self.queue.clear()
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def submit_many(self, items):
+        """Futures for `items`, queued all or nothing."""
+        if len(self.queue) + len(items) > self.max_queue:
+            self.rejected += len(items)
+            raise Overloaded(f"verification queue full ({len(self.queue)} waiting)")
+        loop = asyncio.get_running_loop()
+        now = time.perf_counter()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            self.queue.append((item, future, now))
+            futures.append(future)
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.ready.set()
+        return futures
+
+    async def submit(self, item):
+        return await self.submit_many([item])[0]
+
+    async def _loop(self):
+        while True:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+            # Wait for a free worker first: while all are busy the queue keeps
+            # filling, so the next batch comes out larger instead of later.
+            await self.slots.acquire()
+            deadline = self.queue[0][2] + self.max_wait
+            while len(self.queue) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.ready.clear()
+                try:
+                    await asyncio.wait_for(self.ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            n = min(self.max_batch, len(self.queue))
+            batch = [self.queue.popleft() for _ in range(n)]
+            task = asyncio.create_task(self._run(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch):
+        start = time.perf_counter()
+        try:
+            for _, _, queued in batch:
+                self.queue_wait.record(start - queued)
+            self.batch_sizes.record(len(batch))
+            try:
+                results = await self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.batch_time.record(time.perf_counter() - start)
+            self.slots.release()
+
+    def metrics(self):
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": len(self.queue),
+            "queue_depth_max": self.max_depth,
+            "batches_running": len(self.running),
+            "rejected": self.rejected,
+            "batch_size": self.batch_sizes.summary(),
+            "queue_wait_ms": self.queue_wait.summary(scale=1000),
+            "batch_ms": self.batch_time.summary(scale=1000),
+        }
@@ -0,0 +1,322 @@
+import itertools
+import queue
+import threading
+import time
+import weakref
+
+import cv2
+
+from embedding_cache import face_quality
+from detections import from_faces
+from metrics import REGISTRY
+
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue whose producer never blocks: when the queue is full the
+    oldest item is discarded to make room for the new one."""
+
+    def __init__(self, maxsize=2):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put_latest(self, item):
+        while True:
+            try:
+                self.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class BlockingQueue(queue.Queue):
+    """Bounded queue with backpressure: `put_latest` waits for room instead
+    of dropping, so offline footage is processed frame by frame. Gives up
+    once `stop_event` is set so shutdown never hangs on a full queue."""
+
+    def __init__(self, maxsize, stop_event):
+        super().__init__(maxsize)
+        self.stop_event = stop_event
+        self.dropped = 0
+
+    def put_latest(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+
+class StageStats:
+    """Throughput counters for one pipeline stage. Latencies also go to the
+    shared `pipeline_stage_seconds{pipeline=...,stage=...}` histogram
+    (metrics.py), whose recent samples give the percentiles; `pipeline`
+    keeps the series of pipelines in the same process apart."""
+
+    def __init__(self, name, pipeline="0"):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.started = time.perf_counter()
+        self.latency = REGISTRY.histogram("pipeline_stage_seconds", "Time per item in each pipeline stage",
+                                          pipeline=pipeline, stage=name)
+        self.failures = REGISTRY.counter("pipeline_stage_errors_total", "Items a stage failed on",
+                                         pipeline=pipeline, stage=name)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.busy += seconds
+        self.latency.record(seconds)
+
+    def percentile(self, q):
+        return self.latency.percentile(q)
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+        self.failures.inc()
+
+    def summary(self, dropped=0):
+        with self.lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            rate = self.count / elapsed
+            avg_ms = (self.busy / self.count * 1000) if self.count else 0.0
+        p95_ms = self.percentile(95) * 1000
+        return (f"{self.name:<8} {rate:6.1f}/s  avg {avg_ms:7.1f} ms  p95 {p95_ms:7.1f} ms  "
+                f"n={self.count} dropped={dropped} errors={self.errors}")
+
+
+class Stage(threading.Thread):
+    """Worker thread: pull an item from `in_q`, run `fn`, push the result to
+    `out_q`. Returning None from `fn` ends the item's trip down the pipeline."""
+
+    def __init__(self, name, fn, in_q, out_q, stop_event, pipeline="0"):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.in_q = in_q
+        self.out_q = out_q
+        self.stop_event = stop_event
+        self.stats = StageStats(name, pipeline)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                item = self.in_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                out = self.fn(item)
+            except Exception as e:
+                self.stats.error()
+                print(f"[ERROR] {self.name} stage failed:", e)
+                continue
+            self.stats.record(time.perf_counter() - t0)
+
+            if out is not None and self.out_q is not None:
+                self.out_q.put_latest(out)
+
+
+class FacePipeline:
+    """Runs capture, detection, embedding and search on separate threads.
+
+    capture -> frame_q -> detect -> det_q -> embed -> emb_q -> search
+
+    Every queue is bounded and drops the oldest packet when full, so a slow
+    model only lowers the recognition rate; the preview window keeps showing
+    the newest camera frame with the latest recognition results drawn on top.
+    """
+
+    # Numbers the pipelines of a process, for their metrics' `pipeline` label.
+    _ids = itertools.count()
+
+    def __init__(self, system, source=0, queue_size=2, stats_every=5.0):
+        self.pipeline_id = str(next(FacePipeline._ids))
+        self.system = system
+        self.source = source
+        self.stats_every = stats_every
+        self.stop_event = threading.Event()
+        self.register_requested = threading.Event()
+
+        self.frame_q = self.new_queue(queue_size)
+        self.det_q = self.new_queue(queue_size)
+        self.emb_q = self.new_queue(queue_size)
+
+        self.frame_lock = threading.Lock()
+        self.latest_frame = None
+        self.latest_frame_id = 0
+        self.results_lock = threading.Lock()
+        self.latest_results = []
+
+        self.capture_stats = StageStats("capture", self.pipeline_id)
+        # Looked up by attribute: subclasses may swap a queue after this.
+        # The registry only holds a weak reference, so it does not keep a
+        # finished pipeline alive; once the pipeline is freed the lookups
+        # fail and the export skips these series.
+        ref = weakref.ref(self)
+        for name, attr in (("frame", "frame_q"), ("detect", "det_q"), ("embed", "emb_q")):
+            REGISTRY.gauge("pipeline_queue_depth", "Packets waiting in each queue",
+                           fn=lambda attr=attr: getattr(ref(), attr).qsize(), pipeline=self.pipeline_id, queue=name)
+            REGISTRY.counter("pipeline_dropped_total", "Packets dropped by a full queue (drop-oldest)",
+                             fn=lambda attr=attr: getattr(ref(), attr).dropped, pipeline=self.pipeline_id,
+                             queue=name)
+        self.stages = [
+            Stage("detect", self.detect, self.frame_q, self.det_q, self.stop_event, self.pipeline_id),
+            Stage("embed", self.embed, self.det_q, self.emb_q, self.stop_event, self.pipeline_id),
+            Stage("search", self.search, self.emb_q, None, self.stop_event, self.pipeline_id),
+        ]
+
+    def new_queue(self, size):
+        return DropOldestQueue(size)
+
+    # ===== Stage functions =====
+    def capture(self, cap):
+        frame_id = 0
+        while not self.stop_event.is_set():
+            t0 = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                print("[!] Capture ended.")
+                self.stop_event.set()
+                break
+            self.capture_stats.record(time.perf_counter() - t0)
+
+            frame_id += 1
+            with self.frame_lock:
+                self.latest_frame = frame
+                self.latest_frame_id = frame_id
+            self.frame_q.put_latest({"frame_id": frame_id, "frame": frame})
+
+    def detect(self, pkt):
+        frame = pkt["frame"]
+        faces = self.system.locate_faces(frame)
+        if not faces:
+            # Empty frames still go down the pipeline (the later stages pass
+            # them straight through), so results are published in frame
+            # order and never overwritten by an older frame's.
+            pkt.update(faces=[], boxes=[], track_ids=[], qualities=[], crops=[])
+            return pkt
+        dets = from_faces(faces, frame.shape)
+        padded = dets.padded
+        if not self.system.multi_face:
+            faces = [faces[dets.largest]]
+            padded = padded[[dets.largest]]
+
+        pkt["faces"] = faces
+        pkt["boxes"] = [tuple(box) for box in padded.tolist()]
+        pkt["track_ids"] = [f[6] for f in faces]
+        pkt["qualities"] = [face_quality(f) for f in faces]
+        pkt["crops"] = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in pkt["boxes"]]
+        return pkt
+
+    def embed(self, pkt):
+        if pkt["crops"]:
+            pkt["embs"] = self.system.get_embeddings_cached(pkt["crops"], pkt["track_ids"], pkt["qualities"])
+        return pkt
+
+    def search(self, pkt):
+        if not pkt["faces"]:
+            self.publish(pkt, [])
+            return None
+        system = self.system
+        embs = pkt["embs"]
+
+        # Registration runs here so index writes never race with searches.
+        if self.register_requested.is_set():
+            self.register_requested.clear()
+            largest = max(range(len(pkt["faces"])), key=lambda i: pkt["faces"][i][4])
+            system.register_embedding(embs[largest:largest + 1], system.next_label())
+
+        results = []
+        if system.index is None or len(system.labels) == 0:
+            results = [(box, None, None) for box in pkt["boxes"]]
+        else:
+            for box, (name, sim) in zip(pkt["boxes"], system.identify(embs)):
+                results.append((box, name, sim))
+        self.publish(pkt, results)
+        return None
+
+    def publish(self, pkt, results):
+        with self.results_lock:
+            self.latest_results = results
+
+    # ===== Preview / control =====
+    def draw(self, frame):
+        with self.results_lock:
+            results = list(self.latest_results)
+        for (x1, y1, x2, y2), name, sim in results:
+            color = (0, 255, 255) if name else (0, 0, 255)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            if sim is not None:
+                text = f"{name or 'Unknown'} ({sim:.2f})"
+                cv2.putText(frame, text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        return frame
+
+    def print_stats(self):
+        print("[STATS]")
+        print("  " + self.capture_stats.summary())
+        for stage in self.stages:
+            print("  " + stage.stats.summary(dropped=stage.in_q.dropped))
+
+    def run(self):
+        cap = cv2.VideoCapture(self.source)
+        print("[INFO] r=register, q=quit (recognition runs continuously)")
+
+        capture_thread = threading.Thread(target=self.capture, args=(cap,), name="capture", daemon=True)
+        capture_thread.start()
+        for stage in self.stages:
+            stage.start()
+
+        last_stats = time.perf_counter()
+        shown_id = 0
+        try:
+            while not self.stop_event.is_set():
+                frame = None
+                with self.frame_lock:
+                    if self.latest_frame_id != shown_id:
+                        frame = self.latest_frame.copy()
+                        shown_id = self.latest_frame_id
+                if frame is not None:
+                    cv2.imshow("Face Recognition (pipelined)", self.draw(frame))
+
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('r'):
+                    self.register_requested.set()
+                elif key == ord('q'):
+                    break
+
+                if self.stats_every and time.perf_counter() - last_stats >= self.stats_every:
+                    self.print_stats()
+                    last_stats = time.perf_counter()
+        finally:
+            self.stop_event.set()
+            capture_thread.join(timeout=1.0)
+            for stage in self.stages:
+                stage.join(timeout=1.0)
+            cap.release()
+            cv2.destroyAllWindows()
+            self.system.db.close()
+            self.print_stats()
+
+
+if __name__ == "__main__":
+    # Imported here, not at the top: loading the models (ultralytics,
+    # deepface) prints, and headless.py imports this module before it has
+    # moved stdout out of the way of its JSON lines.
+    from Face_To_Embedding_Class import FaceRecognitionSystem
+
+    system = FaceRecognitionSystem(
+        yolo_weights=r"C:\YoLo-Face\runs\detect\train3\weights\best.pt",
+        db_path="face_db.index",
+        labels_path="face_labels.pkl",
+        multi_face=True
+    )
+    FacePipeline(system).run()
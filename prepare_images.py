@@ -0,0 +1,324 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+# Training-size copy of the YOLO dataset written by wider_to_yolo.py.
+#
+#     python prepare_images.py                     # dataset/ -> dataset_640/, resized JPEGs
+#     python prepare_images.py --letterbox         # padded to 640x640, boxes adjusted
+#     python prepare_images.py --memmap            # + dataset_640/<split>_640.u8 uint8 array store
+#     python prepare_images.py --benchmark         # loader img/s: original vs resized vs memmap
+#
+# Training runs at imgsz 640 (runs/detect/train3/args.yaml), so every epoch
+# decodes full-resolution WIDER JPEGs only to shrink them. Resizing once
+# (long side = imgsz, aspect kept) leaves normalized YOLO labels valid and
+# cuts decode cost per image several times; train with the data.yaml written
+# into the output root. --letterbox pads to a square instead and rewrites the
+# boxes to match. --memmap additionally stores every image letterboxed in one
+# uint8 file (N, imgsz, imgsz, 3) plus a JSON index, which loader workers open
+# with np.memmap and share through the page cache instead of each holding
+# decoded copies (cf. `cache: true`).
+
+# ========== CONFIGURE YOUR PATHS HERE ==========
+DATASET_ROOT = r"C:\YoLo-Face\dataset"
+IMGSZ = 640
+SPLITS = ("train", "val")
+# ==============================================
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+PAD_VALUE = 114  # Ultralytics' letterbox gray
+
+
+def letterbox_params(width, height, size):
+    """(scale, new_width, new_height, pad_x, pad_y) to fit an image in a
+    size x size square, never upscaling."""
+    r = min(size / max(width, height), 1.0)
+    new_w, new_h = round(width * r), round(height * r)
+    return r, new_w, new_h, (size - new_w) // 2, (size - new_h) // 2
+
+
+def resize_long_side(img, size):
+    h, w = img.shape[:2]
+    r, new_w, new_h, _, _ = letterbox_params(w, h, size)
+    if r == 1.0:
+        return img
+    return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+
+def letterbox(img, size):
+    h, w = img.shape[:2]
+    _, new_w, new_h, pad_x, pad_y = letterbox_params(w, h, size)
+    img = resize_long_side(img, size)
+    return cv2.copyMakeBorder(img, pad_y, size - new_h - pad_y, pad_x, size - new_w - pad_x,
+                              cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+
+
+def letterbox_labels(lines, width, height, size):
+    """Normalized YOLO lines of the original image -> normalized lines of
+    its letterboxed size x size version."""
+    r, _, _, pad_x, pad_y = letterbox_params(width, height, size)
+    out = []
+    for line in lines:
+        cls, xc, yc, w, h = line.split()
+        xc = (float(xc) * width * r + pad_x) / size
+        yc = (float(yc) * height * r + pad_y) / size
+        w = float(w) * width * r / size
+        h = float(h) * height * r / size
+        out.append(f"{cls} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}")
+    return out
+
+
+def list_images(images_dir):
+    return sorted(name for name in os.listdir(images_dir) if os.path.splitext(name)[1].lower() in IMAGE_EXTS)
+
+
+def split_paths(root, split):
+    return os.path.join(root, "images", split), os.path.join(root, "labels", split)
+
+
+def is_current(src, dst, src_label, dst_label):
+    """True if the copy of an image and its label are newer than the
+    originals (and no label is left over for an image that lost its own)."""
+    if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src):
+        return False
+    if not os.path.exists(src_label):
+        return not os.path.exists(dst_label)
+    return os.path.exists(dst_label) and os.path.getmtime(dst_label) >= os.path.getmtime(src_label)
+
+
+def settings_path(dst_root, split):
+    return os.path.join(dst_root, f"{split}.prepare.json")
+
+
+def read_settings(dst_root, split):
+    # {"imgsz": ..., "letterbox": ...} of the run that wrote the split.
+    try:
+        with open(settings_path(dst_root, split), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_settings(dst_root, split, settings):
+    path = settings_path(dst_root, split)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+    os.replace(path + ".tmp", path)
+
+
+# Per-worker memmap store, opened by the pool initializer.
+_store = None
+
+
+def _init_worker(store_path, shape):
+    global _store
+    _store = np.memmap(store_path, dtype=np.uint8, mode="r+", shape=shape) if store_path else None
+
+
+def _prepare(task):
+    """Worker: write the training-size copy of one image and its labels
+    (and its memmap row). Returns (name, original (h, w) or None, status)."""
+    row, name, src_images, src_labels, dst_images, dst_labels, size, boxed, quality, skip_existing = task
+    src = os.path.join(src_images, name)
+    stem = os.path.splitext(name)[0]
+    dst = os.path.join(dst_images, stem + ".jpg")
+    src_label = os.path.join(src_labels, stem + ".txt")
+    dst_label = os.path.join(dst_labels, stem + ".txt")
+
+    if skip_existing and _store is None and is_current(src, dst, src_label, dst_label):
+        return name, None, "unchanged"
+    img = cv2.imread(src)
+    if img is None:
+        return name, None, "unreadable"
+    h, w = img.shape[:2]
+
+    small = letterbox(img, size) if boxed else resize_long_side(img, size)
+    cv2.imwrite(dst, small, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if _store is not None:
+        _store[row] = small if boxed else letterbox(img, size)
+
+    if os.path.exists(src_label):
+        if boxed:
+            with open(src_label, encoding="utf-8") as f:
+                lines = [x for x in f.read().strip().splitlines() if x]
+            with open(dst_label, "w", encoding="utf-8") as f:
+                f.write("\n".join(letterbox_labels(lines, w, h, size)))
+        else:
+            # Normalized coordinates survive an aspect-preserving resize.
+            shutil.copyfile(src_label, dst_label)
+    elif os.path.exists(dst_label):
+        # The label was dropped upstream since the last run.
+        os.remove(dst_label)
+    return name, (h, w), "ok"
+
+
+def prepare_split(split, src_root, dst_root, size, boxed, quality, memmap, workers, force):
+    src_images, src_labels = split_paths(src_root, split)
+    dst_images, dst_labels = split_paths(dst_root, split)
+    os.makedirs(dst_images, exist_ok=True)
+    os.makedirs(dst_labels, exist_ok=True)
+    names = list_images(src_images)
+
+    # Copies made at another size or in the other mode (letterboxed boxes
+    # differ from plain ones) are all stale, whatever their mtimes.
+    settings = {"imgsz": size, "letterbox": boxed}
+    previous = read_settings(dst_root, split)
+    if not force and previous is not None and previous != settings:
+        print(f"[+] {split}: output was made with {previous}; rewriting everything.")
+        force = True
+    elif previous is None and not force and os.listdir(dst_images):
+        # Output from before settings were recorded: mode unknown.
+        force = True
+
+    store_path = None
+    shape = None
+    if memmap:
+        store_path = os.path.join(dst_root, f"{split}_{size}.u8")
+        shape = (len(names), size, size, 3)
+        np.memmap(store_path, dtype=np.uint8, mode="w+", shape=shape).flush()
+
+    tasks = [(row, name, src_images, src_labels, dst_images, dst_labels, size, boxed, quality, not force)
+             for row, name in enumerate(names)]
+    shapes = [None] * len(names)
+    counts = {"ok": 0, "unchanged": 0, "unreadable": 0}
+    start = time.perf_counter()
+    with mp.Pool(workers, initializer=_init_worker, initargs=(store_path, shape)) as pool:
+        for row, (name, orig, status) in enumerate(pool.imap(_prepare, tasks, chunksize=16)):
+            counts[status] += 1
+            shapes[row] = orig
+            if status == "unreadable":
+                print(f"[WARN] Unable to read {os.path.join(src_images, name)}")
+    seconds = time.perf_counter() - start
+    write_settings(dst_root, split, settings)
+
+    if memmap:
+        # Unreadable images leave all-zero rows; only readable ones are
+        # listed, with the row each one is stored in.
+        rows = [row for row, orig in enumerate(shapes) if orig is not None]
+        index = {"shape": list(shape), "files": [names[row] for row in rows], "rows": rows,
+                 "orig_shapes": [shapes[row] for row in rows], "pad_value": PAD_VALUE}
+        with open(store_path[:-3] + ".json", "w", encoding="utf-8") as f:
+            json.dump(index, f)
+    return counts, seconds, store_path
+
+
+class MemmapImages:
+    """Read-only view of a --memmap store: img (imgsz, imgsz, 3) uint8 BGR,
+    letterboxed. Cheap to open in every loader worker; pages are shared."""
+
+    def __init__(self, store_path):
+        with open(store_path[:-3] + ".json", encoding="utf-8") as f:
+            index = json.load(f)
+        self.files = index["files"]
+        self.rows = index.get("rows", list(range(len(self.files))))
+        self.orig_shapes = index["orig_shapes"]
+        self.images = np.memmap(store_path, dtype=np.uint8, mode="r", shape=tuple(index["shape"]))
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getitem__(self, i):
+        return np.array(self.images[self.rows[i]])
+
+
+def write_data_yaml(dst_root, size, path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# YOLOv8 dataset configuration for WIDER FACE, pre-resized to {size} (prepare_images.py)\n\n")
+        f.write(f"train: {os.path.join(dst_root, 'images', 'train')}\n")
+        f.write(f"val: {os.path.join(dst_root, 'images', 'val')}\n\n")
+        f.write("nc: 1\nnames: ['face']\n")
+
+
+# ----- loader benchmark -----
+_bench_store = None
+
+
+def _init_bench(store_path):
+    global _bench_store
+    _bench_store = MemmapImages(store_path) if store_path else None
+
+
+def _load_file(args):
+    # What a loader worker does per image: decode, then fit to imgsz.
+    path, size = args
+    img = cv2.imread(path)
+    return letterbox(img, size).shape[0]
+
+
+def _load_row(i):
+    return _bench_store[i].shape[0]
+
+
+def loader_rate(fn, items, workers, store_path=None):
+    with mp.Pool(workers, initializer=_init_bench, initargs=(store_path,)) as pool:
+        start = time.perf_counter()
+        for _ in pool.imap_unordered(fn, items, chunksize=8):
+            pass
+        return len(items) / (time.perf_counter() - start)
+
+
+def benchmark(split, src_root, dst_root, size, workers, limit, store_path):
+    src_images, _ = split_paths(src_root, split)
+    dst_images, _ = split_paths(dst_root, split)
+    names = list_images(src_images)[:limit]
+    print(f"\n=== Loader throughput, {split}, {len(names)} images, imgsz {size}, {workers} workers ===")
+    rows = [("original JPEG", loader_rate(_load_file, [(os.path.join(src_images, n), size) for n in names],
+                                         workers))]
+    resized = [os.path.join(dst_images, os.path.splitext(n)[0] + ".jpg") for n in names]
+    if all(os.path.exists(p) for p in resized):
+        rows.append(("resized JPEG", loader_rate(_load_file, [(p, size) for p in resized], workers)))
+    if store_path and os.path.exists(store_path):
+        count = min(len(names), len(MemmapImages(store_path)))
+        rows.append(("memmap uint8", loader_rate(_load_row, list(range(count)), workers, store_path)))
+    base = rows[0][1]
+    for name, rate in rows:
+        print(f"  {name:<15}{rate:>9.0f} img/s  x{rate / base:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a training-size copy of the YOLO dataset.")
+    parser.add_argument("splits", nargs="*", default=list(SPLITS))
+    parser.add_argument("--dataset-root", default=DATASET_ROOT)
+    parser.add_argument("--output", default=None, help="output root (default: <dataset-root>_<imgsz>)")
+    parser.add_argument("--imgsz", type=int, default=IMGSZ)
+    parser.add_argument("--letterbox", action="store_true", help="pad to imgsz x imgsz and adjust boxes")
+    parser.add_argument("--memmap", action="store_true", help="also write a uint8 memmap store per split")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality of the resized copies")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--force", action="store_true", help="rewrite images that are already up to date")
+    parser.add_argument("--benchmark", action="store_true", help="compare loader img/s before / after")
+    parser.add_argument("--benchmark-images", type=int, default=500)
+    args = parser.parse_args()
+
+    src_root = args.dataset_root.rstrip("\\/")
+    dst_root = args.output or f"{src_root}_{args.imgsz}"
+    stores = {}
+    for split in args.splits:
+        if not os.path.isdir(split_paths(src_root, split)[0]):
+            print(f"[WARN] {split}: no {split_paths(src_root, split)[0]}; skipped.")
+            continue
+        print(f"[+] {split}: resizing to {args.imgsz}{' (letterboxed)' if args.letterbox else ''} -> {dst_root}")
+        counts, seconds, stores[split] = prepare_split(split, src_root, dst_root, args.imgsz, args.letterbox,
+                                                 args.quality, args.memmap, args.workers, args.force)
+        done = counts["ok"] + counts["unchanged"]
+        print(f"[✓] {split}: {counts['ok']} written, {counts['unchanged']} unchanged, "
+              f"{counts['unreadable']} unreadable in {seconds:.1f}s ({done / max(seconds, 1e-9):.0f} img/s)"
+              + (f", memmap {stores[split]}" if stores[split] else ""))
+
+    yaml_path = os.path.join(dst_root, "data.yaml")
+    write_data_yaml(dst_root, args.imgsz, yaml_path)
+    print(f"[✓] Wrote {yaml_path}")
+
+    if args.benchmark:
+        for split, store_path in stores.items():
+            benchmark(split, src_root, dst_root, args.imgsz, args.workers, args.benchmark_images, store_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,25 @@
 import faiss
-import pickle
 import numpy as np
 import os
 
+from face_db import FaceDB, snapshot_exists
+
 DB_PATH = "face_db.index"
 LABELS_PATH = "face_labels.pkl"
 
 def main():
-    if not os.path.exists(DB_PATH) or not os.path.exists(LABELS_PATH):
+    if not snapshot_exists(DB_PATH, LABELS_PATH) and not os.path.exists(DB_PATH + ".wal"):
         print("[!] No FAISS database or labels file found.")
         return
 
-    # Load FAISS index
-    print("[+] Loading FAISS index...")
-    index = faiss.read_index(DB_PATH)
-
-    # Load labels
-    with open(LABELS_PATH, "rb") as f:
-        labels = pickle.load(f)
+    # Load FAISS index + labels (snapshot plus any write-ahead log records)
+    db = FaceDB(DB_PATH, LABELS_PATH)
+    db.close()
+    index = db.index
+    labels = db.labels
+    if index is None:
+        print("[!] FAISS database is empty.")
+        return
 
     ntotal = index.ntotal
     dim = index.d
@@ -27,25 +29,24 @@ def main():
     print(f"Embedding dimension: {dim}")
     print(f"Labels count       : {len(labels)}")
 
-    # Sanity check
+    # Sanity check (removed faces stay in an HNSW index as tombstones)
     if ntotal != len(labels):
-        print("Warning: number of embeddings and labels mismatch!")
+        print(f"Warning: {ntotal - len(labels)} embeddings without a label (removed faces)")
 
-    # Extract embeddings
+    # Extract embeddings, by face ID
     print("\n[+] Reading all vectors...")
-    if hasattr(index, "xb"):
-        vectors = faiss.vector_to_array(index.xb).reshape(ntotal, dim)
-    else:
-        vectors = np.array([index.reconstruct(i) for i in range(ntotal)])
+    items = list(labels.items())
+    ids = np.array([face_id for face_id, _ in items], dtype="int64")
+    vectors = index.reconstruct_batch(ids) if len(ids) else np.empty((0, dim), dtype="float32")
 
 
     # Print embeddings
     print("\n=== Stored Faces ===")
-    for i, label in enumerate(labels):
-        print(f"\n[{i}] Label: {label}")
-        # print(f"Embedding (first 10 dims): [{', '.join(f'{x:.6f}' for x in vectors[i])}]")
+    for (face_id, label), vector in zip(items, vectors):
+        print(f"\n[{face_id}] Label: {label}")
+        # print(f"Embedding (first 10 dims): [{', '.join(f'{x:.6f}' for x in vector)}]")
         # Uncomment below line to print the full 512-dim vector in clean format
-        print(f"Full Embedding: [{', '.join(map(str, vectors[i].tolist()))}]")
+        print(f"Full Embedding: [{', '.join(map(str, vector.tolist()))}]")
 
 print("\n Done.")
 
@@ -0,0 +1,286 @@
+import argparse
+import json
+import math
+import platform
+import time
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+from compression_report import CLUSTER_SPREAD, MODES, QUERY_NOISE, noise, normalize
+from face_db import base_index, build_index, describe
+
+# How the FaceDB index modes scale with gallery size, on synthetic
+# ArcFace-like embeddings (unit-length 512-d, identities grouped in
+# clusters, queries are noisy re-captures of enrolled identities, as in
+# compression_report.py). For every size and mode: build (train) time, add
+# throughput, single-query and batched search latency, index memory and
+# Recall@1 against an exact search of the same gallery; IVF / HNSW are
+# measured at every nprobe / efSearch setting given.
+#
+#     python scaling_report.py                                 # 1k .. 1M, all modes
+#     python scaling_report.py --sizes 1e6,1e7 --modes flat,ivf+sq8,hnsw+pq --json scaling.json
+#
+# The gallery is generated chunk by chunk (the same chunk always yields the
+# same vectors), so it never exists as one array: 10M x 512 float32 would be
+# 20 GB on its own. Modes whose index would not fit in --max-gb (estimated
+# from the previous size) are skipped. Index memory is the serialized size
+# up to SERIALIZE_MAX faces and extrapolated (marked ~) beyond, since
+# serializing copies the whole index. Recall is before FaceDB's exact
+# re-ranking of compressed modes; compression_report.py measures that step.
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+DIM = 512
+CLUSTERS = 1000
+QUERIES = 1000
+# Queries timed one at a time for the single-query latency percentiles.
+SINGLE_QUERIES = 200
+# FaceDB.search_identities fetches top_k = 5 templates per query.
+TOP_K = 5
+CHUNK = 100_000
+NPROBES = (8, 16, 64)
+EF_SEARCHES = (32, 64, 128)
+# Recommendation criteria: the fastest setting per size meeting both.
+MIN_RECALL = 0.95
+BUDGET_MS = 5.0
+MAX_GB = 16.0
+SERIALIZE_MAX = 1_000_000
+
+
+class SyntheticGallery:
+    """`n` unit-length embeddings, generated on demand in CHUNK-row chunks."""
+
+    def __init__(self, n, d=DIM, clusters=CLUSTERS, spread=CLUSTER_SPREAD, seed=0):
+        self.n = n
+        self.d = d
+        self.spread = spread
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.centers = normalize(rng.standard_normal((clusters, d), dtype="float32"))
+
+    def _generate(self, key, m):
+        rng = np.random.default_rng((self.seed, *key))
+        rows = self.centers[rng.integers(0, len(self.centers), m)]
+        return normalize(rows + noise(rng, m, self.d, self.spread))
+
+    def chunks(self):
+        """(first row, (m, d) vectors) for the whole gallery, in order."""
+        for start in range(0, self.n, CHUNK):
+            yield start, self._generate((0, start), min(CHUNK, self.n - start))
+
+    def training_sample(self, m):
+        # Fresh draws from the same distribution: as good as a subsample
+        # for training, without generating the gallery.
+        return self._generate((1, m), m)
+
+
+def queries_and_truth(gallery, n_queries, metric, seed=1):
+    """Noisy re-captures of random gallery rows and their exact nearest
+    neighbour (row ID), found by scanning the gallery chunk by chunk."""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(gallery.n, min(n_queries, gallery.n), replace=False))
+    sources = np.empty((len(rows), gallery.d), dtype="float32")
+    for start, chunk in gallery.chunks():
+        hit = (rows >= start) & (rows < start + len(chunk))
+        sources[hit] = chunk[rows[hit] - start]
+    queries = normalize(sources + noise(rng, len(rows), gallery.d, QUERY_NOISE))
+
+    best = np.full(len(queries), -np.inf if metric == "cosine" else np.inf, dtype="float32")
+    truth = np.full(len(queries), -1, dtype="int64")
+    for start, chunk in gallery.chunks():
+        flat = faiss.IndexFlatIP(gallery.d) if metric == "cosine" else faiss.IndexFlatL2(gallery.d)
+        flat.add(chunk)
+        D, I = flat.search(queries, 1)
+        better = D[:, 0] > best if metric == "cosine" else D[:, 0] < best
+        best[better] = D[better, 0]
+        truth[better] = I[better, 0] + start
+    return queries, truth
+
+
+def search_settings(kind, nprobes, ef_searches):
+    if kind == "ivf":
+        return [("nprobe", p) for p in nprobes]
+    if kind == "hnsw":
+        return [("efSearch", ef) for ef in ef_searches]
+    return [(None, None)]
+
+
+def apply_setting(index, name, value):
+    if name == "nprobe":
+        index.nprobe = value
+    elif name == "efSearch":
+        base_index(index).hnsw.efSearch = value
+
+
+def build(kind, codec, gallery, metric):
+    """(index, train seconds, add seconds): trained on a fresh sample sized
+    like build_index's, then filled chunk by chunk."""
+    nlist = int(4 * math.sqrt(gallery.n)) if kind == "ivf" else None
+    sample_size = 1
+    if codec is not None:
+        sample_size = 65536
+    if kind == "ivf":
+        sample_size = max(sample_size, 256 * nlist)
+    sample = gallery.training_sample(min(gallery.n, sample_size))
+
+    t0 = time.perf_counter()
+    index = build_index(kind, sample, nlist=nlist, metric=metric, codec=codec, add=False)
+    train_s = time.perf_counter() - t0
+    del sample
+
+    add_s = 0.0
+    for start, chunk in gallery.chunks():
+        ids = np.arange(start, start + len(chunk), dtype="int64")
+        t0 = time.perf_counter()
+        index.add_with_ids(chunk, ids)
+        add_s += time.perf_counter() - t0
+    return index, train_s, add_s
+
+
+def measure(index, queries, truth, single_queries):
+    single = []
+    for q in queries[:single_queries]:
+        t0 = time.perf_counter()
+        index.search(q[None], TOP_K)
+        single.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    _, I = index.search(queries, TOP_K)
+    batch_s = time.perf_counter() - t0
+    return {
+        "single_p50_ms": round(float(np.percentile(single, 50)), 4),
+        "single_p95_ms": round(float(np.percentile(single, 95)), 4),
+        "single_p99_ms": round(float(np.percentile(single, 99)), 4),
+        "batch_ms_per_query": round(batch_s * 1000 / len(queries), 4),
+        "batch_qps": round(len(queries) / batch_s, 1),
+        "recall_at_1": round(float(np.mean(I[:, 0] == truth)), 4),
+    }
+
+
+def print_table(n, rows):
+    print(f"\n=== {n:,} faces ({rows[0]['queries']} queries, top-{TOP_K}) ===")
+    print(f"{'mode':<11}{'setting':<13}{'train s':>8}{'add/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'batch ms/q':>11}{'QPS':>9}{'MB':>10}{'B/face':>8}{'R@1':>8}")
+    for r in rows:
+        setting = f"{r['setting']}={r['value']}" if r["setting"] else "-"
+        mb = ("~" if r["memory_extrapolated"] else "") + f"{r['memory_bytes'] / 2 ** 20:.0f}"
+        print(f"{r['mode']:<11}{setting:<13}{r['train_s']:>8.2f}{r['add_per_s']:>11,.0f}{r['single_p50_ms']:>9.3f}"
+              f"{r['single_p95_ms']:>9.3f}{r['single_p99_ms']:>9.3f}{r['batch_ms_per_query']:>11.4f}"
+              f"{r['batch_qps']:>9,.0f}{mb:>10}{r['bytes_per_face']:>8.0f}{r['recall_at_1']:>8.4f}")
+
+
+def recommend(n, rows, min_recall, budget_ms):
+    flat = [r for r in rows if r["mode"] == "flat"]
+    if flat:
+        verdict = "within" if flat[0]["single_p50_ms"] <= budget_ms else "OVER"
+        print(f"[+] {n:,}: exact flat search p50 {flat[0]['single_p50_ms']:.3f} ms, {verdict} the "
+              f"{budget_ms} ms budget")
+    good = [r for r in rows if r["recall_at_1"] >= min_recall and r["single_p50_ms"] <= budget_ms]
+    if not good:
+        print(f"[!] {n:,}: no mode reaches R@1 >= {min_recall} within {budget_ms} ms")
+        return None
+    best = min(good, key=lambda r: (r["single_p50_ms"], r["memory_bytes"]))
+    smallest = min(good, key=lambda r: (r["memory_bytes"], r["single_p50_ms"]))
+    for label, r in (("fastest", best), ("smallest", smallest)):
+        setting = f" {r['setting']}={r['value']}" if r["setting"] else ""
+        print(f"[✓] {n:,}: {label}: {r['mode']}{setting}  p50 {r['single_p50_ms']:.3f} ms, "
+              f"R@1 {r['recall_at_1']:.4f}, {format_bytes(r['memory_bytes'])}")
+    return {"fastest": best, "smallest": smallest}
+
+
+def format_bytes(n):
+    return f"{n / 2 ** 30:.2f} GB" if n >= 2 ** 30 else f"{n / 2 ** 20:.1f} MB"
+
+
+def write_json(path, args, results, recommendations):
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "platform": f"{platform.platform()}, Python {platform.python_version()}, faiss {faiss.__version__}",
+        "threads": faiss.omp_get_max_threads(),
+        "config": {"dim": DIM, "clusters": CLUSTERS, "cluster_spread": CLUSTER_SPREAD,
+                   "query_noise": QUERY_NOISE, "metric": args.metric, "top_k": TOP_K,
+                   "min_recall": args.min_recall, "budget_ms": args.budget_ms},
+        "results": results,
+        "recommendations": {str(n): r for n, r in recommendations.items()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+
+def parse_list(text, cast=int):
+    return [cast(float(v)) if cast is int else cast(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS gallery scaling benchmark for the FaceDB index modes.")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES), help="gallery sizes, e.g. 1e3,1e6,1e7")
+    parser.add_argument("--modes", default=",".join(describe(k, c) for k, c in MODES),
+                        help="kind[+codec] list, e.g. flat,ivf+sq8,hnsw")
+    parser.add_argument("--metric", default="cosine", choices=("cosine", "l2"),
+                        help="FaceDB metric (l2 = IndexFlatL2 and friends)")
+    parser.add_argument("--queries", type=int, default=QUERIES)
+    parser.add_argument("--single-queries", type=int, default=SINGLE_QUERIES)
+    parser.add_argument("--nprobe", default=",".join(map(str, NPROBES)))
+    parser.add_argument("--ef-search", default=",".join(map(str, EF_SEARCHES)))
+    parser.add_argument("--min-recall", type=float, default=MIN_RECALL)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="single-query latency budget")
+    parser.add_argument("--max-gb", type=float, default=MAX_GB, help="skip modes whose index would be larger")
+    parser.add_argument("--threads", type=int, default=None, help="FAISS OpenMP threads")
+    parser.add_argument("--json", default=None, help="write all results here")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    modes = []
+    for name in parse_list(args.modes, str):
+        kind, _, codec = name.partition("+")
+        if (kind, codec or None) not in MODES:
+            parser.error(f"unknown mode {name!r}")
+        modes.append((kind, codec or None))
+    nprobes = parse_list(args.nprobe)
+    ef_searches = parse_list(args.ef_search)
+
+    results = []
+    recommendations = {}
+    bytes_per_face = {}
+    for n in sorted(parse_list(args.sizes)):
+        gallery = SyntheticGallery(n)
+        print(f"[+] {n:,} faces: generating queries and exact neighbours...")
+        queries, truth = queries_and_truth(gallery, args.queries, args.metric)
+        rows = []
+        for kind, codec in modes:
+            name = describe(kind, codec)
+            estimate = bytes_per_face.get(name, 0) * n
+            if estimate > args.max_gb * 2 ** 30:
+                print(f"[!] {name} @ {n:,}: skipped, ~{estimate / 2 ** 30:.1f} GB > --max-gb {args.max_gb}")
+                continue
+            print(f"[+] {name} @ {n:,}: building...")
+            index, train_s, add_s = build(kind, codec, gallery, args.metric)
+            extrapolated = n > SERIALIZE_MAX and name in bytes_per_face
+            if extrapolated:
+                memory = int(bytes_per_face[name] * n)
+            else:
+                memory = faiss.serialize_index(index).nbytes
+                bytes_per_face[name] = memory / n
+
+            for setting, value in search_settings(kind, nprobes, ef_searches):
+                apply_setting(index, setting, value)
+                row = {"size": n, "mode": name, "setting": setting, "value": value, "queries": len(queries),
+                       "train_s": round(train_s, 3), "add_s": round(add_s, 3),
+                       "add_per_s": round(n / add_s, 1) if add_s else 0.0,
+                       "memory_bytes": memory, "memory_extrapolated": extrapolated,
+                       "bytes_per_face": round(memory / n, 1)}
+                row.update(measure(index, queries, truth, args.single_queries))
+                rows.append(row)
+            del index
+        if rows:
+            print_table(n, rows)
+            recommendations[n] = recommend(n, rows, args.min_recall, args.budget_ms)
+        results.extend(rows)
+        if args.json:
+            # Rewritten after every size: large sizes take hours.
+            write_json(args.json, args, results, recommendations)
+            print(f"[✓] Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
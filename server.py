@@ -1,18 +1,293 @@
-from flask import Flask, request, jsonify
+import asyncio
+import json
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import msgpack
+from quart import Quart, Response, request
+
+from metrics import PROMETHEUS, REGISTRY
+from micro_batcher import MicroBatcher, Overloaded
+from template_store import TemplateStore
+from verifiers import STAGES, make_verifier
+from wire_format import JSON, MSGPACK, to_vector, unpack
+
+# ===== CONFIG =====
+PORT = 5000
+VERIFY_WORKERS = os.cpu_count() or 4  # processes doing proof / verification work
+VERIFIER = "stand-in"                 # "stand-in" / "distance" / "zk" (see verifiers.py)
+DIST_THRESHOLD = 1.2                  # squared L2 between normalized live / enrolled (1.2 = cosine 0.4)
+PROOF_DELAY = 0.0                     # seconds of simulated proof work per item (stand-in only)
+ZK_PROVER = None                      # "module:function" hooks for the "zk" verifier
+ZK_CHECKER = None
+TEMPLATES_PATH = "server_templates.log"  # enrolled templates registered via /face-data
+MAX_REQUEST_ITEMS = 1024              # items accepted per request
+MAX_BATCH = 64                       # items verified together (micro-batch size)
+MAX_WAIT_MS = 5                      # longest an item waits for its batch to fill
+MAX_QUEUE = 4096                     # items waiting for a batch before requests get 503
+# ==================
+
+# ASGI app (Quart keeps Flask's API). `python server.py` serves it with
+# Hypercorn and a process pool for verification. Any other ASGI server works
+# too (`hypercorn server:app`), but Hypercorn's own worker processes are
+# daemonic and cannot start a pool, so there verification runs on threads.
+app = Quart(__name__)
+executor = None
+# One thread for template store writes, so log appends stay in request order.
+store_executor = None
+batcher = None
+templates = None
+# Per-item time in each verifier stage, request latency per endpoint and
+# item outcomes; all exported at GET /metrics (see metrics.py).
+stage_stats = {stage: REGISTRY.histogram("verify_stage_seconds", "Per-item time in each verifier stage",
+                                         stage=stage)
+               for stage in STAGES}
+request_time = {endpoint: REGISTRY.histogram("server_request_seconds", "Request handling time",
+                                             endpoint=endpoint)
+                for endpoint in ("face-data", "face-verify")}
+
+
+def parse_items(data):
+    """(items, batched) from a request body: a single payload object, an
+    object with an "items" list, or a bare list of payload objects."""
+    if isinstance(data, list):
+        return data, True
+    if isinstance(data, dict) and isinstance(data.get("items"), list):
+        return data["items"], True
+    if isinstance(data, dict):
+        return [data], False
+    raise ValueError("Expected a JSON object or a list of objects")
+
+
+def check_face_index(face_index):
+    """Raise ValueError unless `face_index` can key a template (a label
+    string or a face ID)."""
+    if isinstance(face_index, bool) or not isinstance(face_index, (str, int)):
+        raise ValueError("'face_index' must be a string or an integer")
+
+
+def verifier_options():
+    options = {"threshold": DIST_THRESHOLD}
+    if VERIFIER == "stand-in":
+        options["proof_delay"] = PROOF_DELAY
+    elif VERIFIER == "zk":
+        options.update(prover=ZK_PROVER, checker=ZK_CHECKER)
+    return options
+
+
+# Per-process verifier, built by the pool initializer.
+_verifier = None
+
+
+def init_worker(name, options):
+    global _verifier
+    _verifier = make_verifier(name, **options)
+
+
+def verify_batch(items):
+    return _verifier.run(items)
+
+
+async def run_batch(items):
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(executor, verify_batch, items)
+    timings = [result["timings_ms"] for result in results if "timings_ms" in result]
+    if timings:
+        for stage, stats in stage_stats.items():
+            stats.record_many([t[stage] / 1000 for t in timings if stage in t])
+    return results
+
+
+def with_template(item):
+    """`item` with its enrolled template and commitment from the store, or
+    None when its face_index was never enrolled. Items that still carry
+    their own "enrolled" vector (older clients) pass through unchanged."""
+    if not isinstance(item, dict) or item.get("enrolled") is not None:
+        return item
+    template = templates.get(item.get("face_index"))
+    if template is None:
+        return None
+    vector, digest = template
+    return dict(item, enrolled=vector, commitment=digest)
+
+
+async def verify(items):
+    # Items from every in-flight request share the batcher, so concurrent
+    # single-item requests are verified together and a large batch request
+    # is split into MAX_BATCH-sized pieces across the workers.
+    results = [None] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        if isinstance(item, dict) and item.get("face_index") is not None:
+            # Checked before the template lookup and the vectors, so a bad
+            # key is reported as such.
+            try:
+                check_face_index(item["face_index"])
+            except ValueError as e:
+                results[i] = {"face_index": item["face_index"], "status": "error", "error": str(e)}
+                continue
+        resolved = with_template(item)
+        if resolved is None:
+            # Faces enrolled before the server kept templates: the client
+            # re-sends them with backfill_templates.py (or sends "enrolled").
+            results[i] = {"face_index": item.get("face_index"), "status": "rejected",
+                          "error": "face_index is not enrolled on the server (run backfill_templates.py)"}
+        else:
+            pending.append((i, resolved))
+    if pending:
+        done = await asyncio.gather(*batcher.submit_many([item for _, item in pending]))
+        for (i, _), result in zip(pending, done):
+            results[i] = result
+    return results
+
+
+def register(items):
+    """Per-item results for a /face-data request. Runs on store_executor:
+    the template log write and fsync must not block the event loop."""
+    results = [None] * len(items)
+    entries = []
+    for i, item in enumerate(items):
+        face_index = item.get("face_index") if isinstance(item, dict) else None
+        results[i] = {"face_index": face_index}
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Each item must be a JSON object")
+            if face_index is None:
+                raise ValueError("'face_index' is required")
+            check_face_index(face_index)
+            entries.append((i, face_index, to_vector(item.get("embedding"), "embedding")))
+        except (TypeError, ValueError) as e:
+            results[i].update(status="error", error=str(e))
+    # One log write + fsync for the whole request.
+    digests = templates.put_many([(face_index, vector) for _, face_index, vector in entries])
+    for (i, _, _), digest in zip(entries, digests):
+        results[i].update(status="verified", commitment=digest.hex())
+    return results
+
+
+async def read_items():
+    # JSON (float lists or base64 vectors) or msgpack, see wire_format.py.
+    data = unpack(await request.get_data(), request.content_type)
+    items, batched = parse_items(data)
+    if len(items) > MAX_REQUEST_ITEMS:
+        raise ValueError(f"At most {MAX_REQUEST_ITEMS} items per request")
+    return items, batched
+
+
+def reply(body, code=200):
+    # msgpack for clients that ask for it, JSON for everyone else.
+    if MSGPACK in request.headers.get("Accept", ""):
+        return Response(msgpack.packb(body), status=code, content_type=MSGPACK)
+    return Response(json.dumps(body), status=code, content_type=JSON)
+
+
+def count_items(endpoint, counts):
+    for status, n in counts.items():
+        REGISTRY.counter("server_items_total", "Items handled, by outcome", endpoint=endpoint, status=status).inc(n)
+
+
+def respond(endpoint, results, batched):
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    count_items(endpoint, counts)
+    if batched:
+        return reply({"results": results, "counts": counts})
+    # Single payloads keep the old contract: 200 verified, 401 rejected.
+    result = results[0]
+    code = {"verified": 200, "rejected": 401}.get(result["status"], 400)
+    return reply(result, code)
 
-app = Flask(__name__)
 
 @app.route("/face-data", methods=["POST"])
-def receive_face():
-    data = request.get_json()
+async def receive_face():
+    with request_time["face-data"].time():
+        try:
+            items, batched = await read_items()
+        except ValueError as e:
+            count_items("face-data", {"bad_request": 1})
+            return reply({"status": "error", "error": str(e)}, 400)
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(store_executor, register, items)
+        return respond("face-data", results, batched)
 
-    # TODO: run your proof verification here
-    verified = True  # dummy result
 
-    if verified:
-        return jsonify({"status": "verified"}), 200
-    else:
-        return jsonify({"status": "rejected"}), 401
+@app.route("/face-verify", methods=["POST"])
+async def verify_face():
+    with request_time["face-verify"].time():
+        try:
+            items, batched = await read_items()
+        except ValueError as e:
+            count_items("face-verify", {"bad_request": 1})
+            return reply({"status": "error", "error": str(e)}, 400)
+        if not items:
+            return respond("face-verify", [], batched)
+        try:
+            results = await verify(items)
+        except Overloaded as e:
+            count_items("face-verify", {"overloaded": len(items)})
+            return reply({"status": "error", "error": str(e)}, 503)
+        return respond("face-verify", results, batched)
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    # Prometheus text for scrapers (?format=prometheus or Accept: text/plain),
+    # JSON otherwise.
+    if request.args.get("format") == "prometheus" or "text/plain" in request.headers.get("Accept", ""):
+        return Response(REGISTRY.prometheus(), content_type=PROMETHEUS)
+    stages = {stage: stats.summary(scale=1000, digits=3) for stage, stats in stage_stats.items()}
+    return reply({"verify": batcher.metrics(), "verifier": VERIFIER, "stages_ms": stages,
+                  "templates": len(templates), "metrics": REGISTRY.snapshot()})
+
+
+def register_metrics():
+    # State the batcher and the template store already track.
+    REGISTRY.register("verify_batch_size", batcher.batch_sizes, "Items per verification batch")
+    REGISTRY.register("verify_queue_wait_seconds", batcher.queue_wait, "Time an item waits for its batch")
+    REGISTRY.register("verify_batch_seconds", batcher.batch_time, "Time to verify one batch")
+    REGISTRY.gauge("verify_queue_depth", "Items waiting for a batch", fn=lambda: batcher.depth)
+    REGISTRY.gauge("verify_batches_running", "Batches being verified", fn=lambda: len(batcher.running))
+    REGISTRY.gauge("server_templates", "Enrolled templates", fn=lambda: len(templates))
+
+
+@app.before_serving
+async def start_pool():
+    global executor, store_executor, batcher, templates
+    templates = TemplateStore(TEMPLATES_PATH)
+    store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="template-store")
+    # Fail here, not in every worker, on a misconfigured backend.
+    options = verifier_options()
+    make_verifier(VERIFIER, **options)
+    pool = ProcessPoolExecutor
+    if mp.current_process().daemon:
+        print("[WARN] Running in a daemonic worker; verifying on threads instead of processes.")
+        pool = ThreadPoolExecutor
+    executor = pool(max_workers=VERIFY_WORKERS, initializer=init_worker, initargs=(VERIFIER, options))
+    # Start the workers now rather than on the first request.
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(executor, verify_batch, [])
+                           for _ in range(VERIFY_WORKERS)))
+    batcher = MicroBatcher(run_batch, max_batch=MAX_BATCH, max_wait=MAX_WAIT_MS / 1000,
+                           concurrency=VERIFY_WORKERS, max_queue=MAX_QUEUE)
+    batcher.start()
+    register_metrics()
+    print(f"[+] {VERIFIER} verification pool ready ({VERIFY_WORKERS} workers, batches of {MAX_BATCH} / {MAX_WAIT_MS} ms)")
+
+
+@app.after_serving
+async def stop_pool():
+    await batcher.stop()
+    executor.shutdown(wait=True)
+    store_executor.shutdown(wait=True)
+    templates.close()
+
 
 if __name__ == "__main__":
-    app.run(port=5000, debug=True)
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"0.0.0.0:{PORT}"]
+    asyncio.run(serve(app, config))
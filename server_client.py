@@ -0,0 +1,296 @@
+import collections
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import msgpack
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY
+from wire_format import pack, unpack
+
+# Status codes worth retrying: the server (or the ngrok tunnel) is busy or
+# briefly unavailable, the request itself is fine.
+RETRY_STATUS = {429, 502, 503, 504}
+
+RETRIES = REGISTRY.counter("client_retries_total", "Server requests retried (connection error, timeout, 429/5xx)")
+FAILURES = REGISTRY.counter("client_failures_total", "Server requests given up on")
+
+
+class Reply:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    @property
+    def ok(self):
+        return self.status_code == 200
+
+
+class Job:
+    def __init__(self, path, body, headers, tag=None, buffer=False):
+        self.path = path
+        self.body = body
+        self.headers = headers
+        self.tag = tag
+        self.buffer = buffer
+        self.future = Future()
+        self.attempts = 0
+        self.last_error = None
+        self.created = time.time()
+
+    @property
+    def reply(self):
+        return self.future.result() if self.future.done() and not self.future.exception() else None
+
+    @property
+    def error(self):
+        return self.future.exception() if self.future.done() else None
+
+
+class ServerClient:
+    """Background transport to server.py.
+
+    `submit` packs the payload (see wire_format.py) and queues it without
+    blocking; one sender thread posts jobs in order over a pooled keep-alive
+    `requests.Session`, so the TLS handshake to the server is paid once.
+    Request errors (connection, timeout, ...) and 429/502/503/504 are retried with
+    exponential backoff and jitter. Each job's Future resolves to a Reply;
+    the video loop picks finished jobs up with `poll()` and draws them on
+    the next frame.
+
+    Jobs submitted with `buffer=True` (registrations) are never dropped for
+    being unreachable: after the retries they move to an offline buffer,
+    persisted to `offline_path` if given (one appended record per job, so
+    buffering stays cheap on the caller's thread), and are flushed in order
+    as soon as a probe gets through. Other jobs (verifications, which are pointless
+    late) fail instead, and fail fast while the server is known offline.
+    """
+
+    def __init__(self, base_url, wire_format="msgpack", dtype="f32", timeout=30, max_queue=64, retries=3,
+                 backoff=0.5, max_backoff=30.0, probe_every=10.0, offline_path=None, pool_size=4):
+        self.base_url = base_url.rstrip("/")
+        self.wire_format = wire_format
+        self.dtype = dtype
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.probe_every = probe_every
+        self.offline_path = offline_path
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.jobs = queue.Queue(maxsize=max_queue)
+        self.done = queue.Queue()
+        self.offline = collections.deque(self._load_offline())
+        self.offline_lock = threading.Lock()
+        self.online = True
+        self.next_probe = 0.0
+        self.stop_event = threading.Event()
+        REGISTRY.gauge("client_queued", "Requests waiting for the sender thread", fn=self.jobs.qsize)
+        REGISTRY.gauge("client_offline_buffered", "Registrations held for an unreachable server",
+                       fn=lambda: len(self.offline))
+        REGISTRY.gauge("client_server_online", "1 while the server is reachable", fn=lambda: int(self.online))
+        self.thread = threading.Thread(target=self._run, name="server-client", daemon=True)
+        self.thread.start()
+
+    def submit(self, path, payload, tag=None, buffer=False):
+        """Queue a POST of `payload` to `path`; returns its Job (`job.future`)."""
+        body, headers = pack(payload, self.wire_format, self.dtype)
+        job = Job(path, body, headers, tag, buffer)
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            if buffer:
+                self._buffer(job)
+            else:
+                self._finish(job, error=RuntimeError("send queue full"))
+        return job
+
+    def poll(self):
+        """Jobs finished since the last call (for the main thread)."""
+        finished = []
+        while True:
+            try:
+                finished.append(self.done.get_nowait())
+            except queue.Empty:
+                return finished
+
+    @property
+    def pending(self):
+        return self.jobs.qsize() + len(self.offline)
+
+    def close(self, timeout=5.0):
+        # Give queued jobs a moment to go out; buffered ones stay on disk.
+        deadline = time.monotonic() + timeout
+        while not self.jobs.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.stop_event.set()
+        self.thread.join(timeout=max(0.0, deadline - time.monotonic()) + 1.0)
+        self.session.close()
+        if self.offline:
+            print(f"[!] {len(self.offline)} request(s) kept offline for the next run.")
+
+    def _run(self):
+        # The only sender thread: no single job or flush may take it down, or
+        # every pending Future would stay unresolved.
+        while not self.stop_event.is_set():
+            if self.offline and time.monotonic() >= self.next_probe:
+                try:
+                    self._flush_offline()
+                except Exception as e:
+                    print(f"[ERROR] Sending offline requests failed: {e}")
+                    self.next_probe = time.monotonic() + self.probe_every
+            try:
+                job = self.jobs.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                if job.buffer and self.offline:
+                    # Keep registrations in order behind the buffered ones.
+                    self._buffer(job)
+                    continue
+                self._deliver(job, retries=self.retries if self.online else 0)
+            except Exception as e:
+                self._finish(job, error=e)
+
+    def _post(self, job):
+        job.attempts += 1
+        with REGISTRY.histogram("client_request_seconds", "Server round trip per attempt", path=job.path).time():
+            resp = self.session.post(self.base_url + job.path, data=job.body, headers=job.headers,
+                                     timeout=self.timeout)
+        try:
+            body = unpack(resp.content, resp.headers.get("Content-Type"))
+        except ValueError:
+            body = resp.text
+        return Reply(resp.status_code, body)
+
+    def _attempt(self, job, retries):
+        """Reply, or None when the server could not be reached."""
+        for attempt in range(retries + 1):
+            if attempt:
+                RETRIES.inc()
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                if self.stop_event.wait(delay * random.uniform(0.5, 1.0)):
+                    return None
+            try:
+                reply = self._post(job)
+            except requests.RequestException as e:
+                job.last_error = e
+                continue
+            if reply.status_code in RETRY_STATUS:
+                job.last_error = RuntimeError(f"server returned {reply.status_code}")
+                continue
+            return reply
+        return None
+
+    def _deliver(self, job, retries):
+        reply = self._attempt(job, retries)
+        if reply is not None:
+            self._set_online(True)
+            self._finish(job, reply=reply)
+            return True
+        self._set_online(False)
+        if job.buffer:
+            self._buffer(job)
+        else:
+            self._finish(job, error=job.last_error or RuntimeError("server unreachable"))
+        return False
+
+    def _flush_offline(self):
+        sent = 0
+        try:
+            while self.offline and not self.stop_event.is_set():
+                job = self.offline[0]
+                reply = self._attempt(job, retries=0)
+                if reply is None:
+                    self._set_online(False)
+                    break
+                self._set_online(True)
+                with self.offline_lock:
+                    self.offline.popleft()
+                sent += 1
+                self._finish(job, reply=reply)
+        finally:
+            # One rewrite per flush. A crash before it re-sends the jobs
+            # already delivered; registering a template twice is harmless.
+            if sent:
+                self._save_offline()
+        self.next_probe = time.monotonic() + self.probe_every
+
+    def _set_online(self, online):
+        if online != self.online:
+            print("[+] Server reachable again." if online else "[WARN] Server unreachable; working offline.")
+        self.online = online
+        if not online:
+            self.next_probe = time.monotonic() + self.probe_every
+
+    def _buffer(self, job):
+        # Called from submit() on the caller's (video) thread when the queue
+        # is full: append one record rather than rewriting the outbox.
+        with self.offline_lock:
+            self.offline.append(job)
+            if self.offline_path:
+                with open(self.offline_path, "ab") as f:
+                    f.write(self._record(job))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def _finish(self, job, reply=None, error=None):
+        if job.future.done():
+            return
+        if error is not None:
+            FAILURES.inc()
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(reply)
+        self.done.put(job)
+
+    def _load_offline(self):
+        if not self.offline_path or not os.path.exists(self.offline_path):
+            return []
+        records = []
+        good = 0
+        with open(self.offline_path, "rb") as f:
+            unpacker = msgpack.Unpacker(f)
+            try:
+                for record in unpacker:
+                    records.append(record)
+                    good = unpacker.tell()
+            except ValueError:
+                pass
+        if good < os.path.getsize(self.offline_path):
+            # Torn last record from a crash mid-append; later appends must
+            # not land behind it.
+            print(f"[WARN] Outbox {self.offline_path}: dropping a partial record at byte {good}.")
+            with open(self.offline_path, "r+b") as f:
+                f.truncate(good)
+        jobs = [Job(r["path"], r["body"], r["headers"], r.get("tag"), buffer=True) for r in records]
+        if jobs:
+            print(f"[+] {len(jobs)} offline request(s) from the last run queued for sending.")
+        return jobs
+
+    @staticmethod
+    def _record(job):
+        return msgpack.packb({"path": job.path, "body": job.body, "headers": job.headers, "tag": job.tag})
+
+    def _save_offline(self):
+        """Rewrite the outbox with the jobs still buffered (sender thread)."""
+        if not self.offline_path:
+            return
+        with self.offline_lock:
+            tmp = self.offline_path + ".tmp"
+            with open(tmp, "wb") as f:
+                for job in self.offline:
+                    f.write(self._record(job))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.offline_path)
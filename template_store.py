@@ -0,0 +1,90 @@
+import hashlib
+import os
+
+import msgpack
+import numpy as np
+
+
+def commitment(face_index, vector):
+    """SHA-256 commitment to an enrolled template (key + float32 bytes)."""
+    h = hashlib.sha256()
+    h.update(str(face_index).encode())
+    h.update(b"\x00")
+    h.update(np.ascontiguousarray(vector, dtype="<f4").tobytes())
+    return h.digest()
+
+
+class TemplateStore:
+    """Server-side enrolled templates keyed by `face_index`.
+
+    Filled by /face-data, read by /face-verify, so clients send only the
+    live embedding and the key. Templates are kept as sent (RAW or
+    normalized); the verifier normalizes both sides of every comparison.
+    Each template keeps its commitment, computed once at enrollment instead
+    of on every verification. Persisted as an append-only log of msgpack
+    records, fsynced once per write call and replayed on start (a later
+    record for the same key replaces the earlier one), the same way FaceDB
+    treats its write-ahead log.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.templates = {}
+        self.log = None
+        if path:
+            self._replay()
+            self.log = open(path, "ab")
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, "rb") as f:
+            unpacker = msgpack.Unpacker(f)
+            try:
+                for record in unpacker:
+                    vector = np.frombuffer(record["vector"], dtype="<f4").astype("float32")
+                    self.templates[record["face_index"]] = (vector, commitment(record["face_index"], vector))
+                    good = unpacker.tell()
+            except ValueError:
+                pass
+        if good < os.path.getsize(self.path):
+            # Torn last record from a crash mid-write.
+            print(f"[WARN] Template log {self.path}: dropping a partial record at byte {good}.")
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+        print(f"[+] Loaded {len(self.templates)} enrolled templates from {self.path}")
+
+    def put_many(self, entries):
+        """Store (face_index, vector) pairs; returns their commitments."""
+        records = []
+        digests = []
+        for face_index, vector in entries:
+            vector = np.ascontiguousarray(vector, dtype="float32").reshape(-1)
+            digest = commitment(face_index, vector)
+            self.templates[face_index] = (vector, digest)
+            digests.append(digest)
+            records.append(msgpack.packb({"face_index": face_index, "vector": vector.astype("<f4").tobytes()}))
+        if self.log is not None and records:
+            self.log.write(b"".join(records))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+        return digests
+
+    def put(self, face_index, vector):
+        return self.put_many([(face_index, vector)])[0]
+
+    def get(self, face_index):
+        """(vector, commitment), or None if the key was never enrolled."""
+        return self.templates.get(face_index)
+
+    def __contains__(self, face_index):
+        return face_index in self.templates
+
+    def __len__(self):
+        return len(self.templates)
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
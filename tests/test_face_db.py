@@ -0,0 +1,195 @@
+import os
+import pickle
+import time
+
+import faiss
+import numpy as np
+import pytest
+
+import face_db
+from face_db import FaceDB, index_kind
+
+D = 16
+
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).random((n, D), dtype="float32")
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "db.index"), str(tmp_path / "labels.pkl")
+
+
+def open_db(paths, **kwargs):
+    kwargs.setdefault("compact_every", 0)
+    return FaceDB(*paths, **kwargs)
+
+
+def nearest(db, emb):
+    hits = db.search_labels(emb.reshape(1, -1), 1)[0]
+    return hits[0][:2] if hits else None
+
+
+def test_wal_replay_restores_adds_and_removals(paths):
+    v = vectors(5)
+    db = open_db(paths)
+    ids = [db.add(v[i], f"p{i}") for i in range(4)]
+    db.add_batch(v[4:], ["p4"])
+    db.remove_label("p1")
+    db.close()
+    assert not os.path.exists(paths[0])  # nothing compacted: log only
+
+    db = open_db(paths)
+    assert db.ntotal == 4
+    assert db.ids("p1") == []
+    assert nearest(db, v[2]) == ("p2", ids[2])
+    # IDs keep increasing after a replay; removed ones are not reused.
+    assert db.add(v[1], "p1") == 5
+    db.close()
+
+
+def test_torn_wal_tail_is_ignored(paths):
+    v = vectors(3)
+    db = open_db(paths)
+    for i in range(3):
+        db.add(v[i], f"p{i}")
+    db.close()
+    with open(db.wal_path, "ab") as f:
+        f.write(face_db._encode(3, "torn", v[:1])[:-7])
+
+    db = open_db(paths)
+    assert db.ntotal == 3
+    assert db.labels.get(3) is None
+    db.close()
+
+
+def test_compaction_snapshot_covers_the_log(paths):
+    v = vectors(10)
+    db = open_db(paths)
+    db.add_batch(v, [f"p{i}" for i in range(10)])
+    db.compact(wait=True)
+    db.add(v[0], "late")
+    db.close()
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(db.compacting_path)
+
+    db = open_db(paths)
+    assert db.ntotal == 11
+    assert nearest(db, v[3]) == ("p3", 3)
+    db.close()
+
+
+def test_failed_compaction_keeps_its_segment(paths, monkeypatch):
+    v = vectors(20)
+    db = open_db(paths)
+    db.add_batch(v[:10], [f"a{i}" for i in range(10)])
+    write_index = faiss.write_index
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(face_db.faiss, "write_index", fail)
+    db.compact(wait=True)
+    assert os.path.exists(db.compacting_path)
+
+    # The next rotation appends to the leftover segment instead of
+    # replacing it, then fails again: nothing may be lost.
+    db.add_batch(v[10:], [f"b{i}" for i in range(10)])
+    db.compact(wait=True)
+    db.close()
+    monkeypatch.setattr(face_db.faiss, "write_index", write_index)
+
+    db = open_db(paths)
+    assert db.ntotal == 20
+    assert not os.path.exists(db.compacting_path)  # merged back into the log
+    db.compact(wait=True)
+    db.close()
+    os.remove(db.wal_path)
+    db = open_db(paths)
+    assert db.ntotal == 20
+    db.close()
+
+
+def test_compact_wait_joins_a_running_compactor(paths, monkeypatch):
+    db = open_db(paths)
+    db.add_batch(vectors(5), [f"p{i}" for i in range(5)])
+    write_index = faiss.write_index
+    started = []
+
+    def slow(*args):
+        started.append(True)
+        time.sleep(0.3)
+        write_index(*args)
+
+    monkeypatch.setattr(face_db.faiss, "write_index", slow)
+    db.compact()
+    db.compact(wait=True)
+    assert started and not db.compactor.is_alive()
+    assert not os.path.exists(db.compacting_path)
+    db.close()
+
+
+def test_compact_wait_covers_records_logged_during_a_compaction(paths, monkeypatch):
+    v = vectors(6)
+    db = open_db(paths)
+    ids = db.add_batch(v[:5], [f"p{i}" for i in range(5)])
+    write_index = faiss.write_index
+
+    def slow(*args):
+        time.sleep(0.3)
+        write_index(*args)
+
+    monkeypatch.setattr(face_db.faiss, "write_index", slow)
+    db.compact()
+    # Logged after that compactor took its copy of the index.
+    db.remove_ids([ids[1]])
+    db.add(v[5], "late")
+    db.compact(wait=True)
+    assert db.wal_records == 0
+    db.close()
+
+    # The snapshot alone, without the log, has both changes.
+    os.remove(db.wal_path)
+    db = open_db(paths)
+    assert db.ntotal == 5
+    assert db.ids("p1") == []
+    assert nearest(db, v[5]) == ("late", 5)
+    db.close()
+
+
+def test_migrates_flat_to_ivf_keeping_ids(paths):
+    v = vectors(400)
+    db = open_db(paths, ivf_at=300, nlist=4, nprobe=4)
+    db.add_batch(v[:299], [f"p{i}" for i in range(299)])
+    assert index_kind(db.index) == "flat"
+    db.remove_label("p7")
+    db.add_batch(v[299:], [f"p{i}" for i in range(299, 400)])
+    assert index_kind(db.index) == "ivf"
+    assert nearest(db, v[350]) == ("p350", 350)
+    db.close()
+
+    db = open_db(paths, ivf_at=300, nlist=4, nprobe=4)
+    assert index_kind(db.index) == "ivf"
+    assert db.ntotal == 399
+    assert nearest(db, v[7])[0] != "p7"
+    db.close()
+
+
+def test_upgrades_a_pre_id_database(paths):
+    v = vectors(6)
+    index = faiss.IndexFlatL2(D)
+    index.add(v)
+    faiss.write_index(index, paths[0])
+    with open(paths[1], "wb") as f:
+        pickle.dump([f"p{i}" for i in range(6)], f)
+
+    db = open_db(paths)
+    assert db.ntotal == 6
+    assert nearest(db, v[4]) == ("p4", 4)  # ID = old row
+    db.close()
+    assert not os.path.exists(paths[1])  # replaced by the label table
+
+    db = open_db(paths)
+    assert db.labels.get(5) == "p5"
+    db.close()
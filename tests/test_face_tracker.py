@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from face_tracker import FaceTracker, iou_matrix
+
+
+def det(x1, y1, x2, y2, conf=0.9):
+    return (x1, y1, x2, y2, (x2 - x1) * (y2 - y1), conf)
+
+
+def ids(faces):
+    return [face[6] for face in faces]
+
+
+def test_iou_matrix():
+    a = [[0, 0, 10, 10], [100, 100, 110, 110]]
+    b = [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]]
+    ious = iou_matrix(a, b)
+    assert ious.shape == (2, 3)
+    assert ious[0] == pytest.approx([1.0, 50 / 150, 0.0])
+    assert not ious[1].any()
+    assert iou_matrix(np.empty((0, 4)), b).shape == (0, 3)
+
+
+def test_ids_persist_across_detections():
+    tracker = FaceTracker(iou_thresh=0.3)
+    first = tracker.update([det(0, 0, 50, 50), det(200, 0, 250, 50)])
+    assert ids(first) == [1, 2]
+    # Both faces moved a little; listed in the other order.
+    second = tracker.update([det(205, 2, 255, 52), det(4, 2, 54, 52)])
+    assert sorted((face[6], face[0]) for face in second) == [(1, 4), (2, 205)]
+
+
+def test_each_detection_matches_one_track():
+    tracker = FaceTracker(iou_thresh=0.3)
+    tracker.update([det(0, 0, 50, 50)])
+    # Two overlapping detections: the better one keeps the track, the other
+    # becomes a new one.
+    faces = tracker.update([det(20, 0, 70, 50), det(2, 0, 52, 50)])
+    by_id = {face[6]: face[0] for face in faces}
+    assert by_id == {1: 2, 2: 20}
+
+
+def test_unmatched_detection_starts_a_new_track():
+    tracker = FaceTracker(iou_thresh=0.3)
+    tracker.update([det(0, 0, 50, 50)])
+    assert ids(tracker.update([det(300, 300, 350, 350)])) == [2]
+
+
+def test_missed_tracks_are_kept_then_dropped():
+    tracker = FaceTracker(max_missed=2)
+    tracker.update([det(0, 0, 50, 50)])
+    for _ in range(2):
+        assert tracker.update([]) == []
+        assert len(tracker.tracks) == 1
+    # Seen again within max_missed: same ID.
+    assert ids(tracker.update([det(0, 0, 50, 50)])) == [1]
+    for _ in range(3):
+        tracker.update([])
+    assert tracker.tracks == []
+    assert ids(tracker.update([det(0, 0, 50, 50)])) == [2]
+
+
+def test_predict_follows_the_velocity():
+    tracker = FaceTracker(smoothing=0.0)
+    tracker.update([det(0, 0, 50, 50)])
+    tracker.update([det(10, 0, 60, 50)])
+    (face,) = tracker.predict()
+    assert face[:4] == (20, 0, 70, 50)
+    assert face[6] == 1
+
+
+def test_needs_detection_every_n_frames():
+    tracker = FaceTracker(detect_every=3, conf_decay=1.0)
+    assert tracker.needs_detection()  # nothing tracked
+    tracker.update([det(0, 0, 50, 50)])
+    schedule = []
+    for _ in range(5):
+        detect = tracker.needs_detection()
+        schedule.append(detect)
+        if detect:
+            tracker.update([det(0, 0, 50, 50)])
+        else:
+            tracker.predict()
+    assert schedule == [False, False, True, False, False]
+
+
+def test_needs_detection_when_confidence_decays():
+    tracker = FaceTracker(detect_every=100, conf_decay=0.5, redetect_conf=0.3)
+    tracker.update([det(0, 0, 50, 50, conf=0.9)])
+    tracker.predict()
+    assert not tracker.needs_detection()  # 0.45
+    tracker.predict()
+    assert tracker.needs_detection()  # 0.225
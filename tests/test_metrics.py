@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from metrics import Registry, Window
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_getters_return_the_same_metric(registry):
+    hits = registry.counter("cache_hits_total", "Cache hits", stage="embed")
+    assert registry.counter("cache_hits_total", stage="embed") is hits
+    assert registry.counter("cache_hits_total", stage="search") is not hits
+    with pytest.raises(ValueError):
+        registry.gauge("cache_hits_total", stage="embed")
+
+
+def test_counter_and_gauge_lines(registry):
+    registry.counter("face_matches_total", "Searches above sim_thresh").inc(3)
+    registry.gauge("queue_depth", "Frames waiting", stage="detect").set(2)
+    registry.gauge("queue_depth", stage="embed", fn=lambda: 5)
+    lines = registry.prometheus().splitlines()
+    assert lines == [
+        "# HELP face_matches_total Searches above sim_thresh",
+        "# TYPE face_matches_total counter",
+        "face_matches_total 3",
+        "# HELP queue_depth Frames waiting",
+        "# TYPE queue_depth gauge",
+        'queue_depth{stage="detect"} 2',
+        'queue_depth{stage="embed"} 5',
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    registry.counter("errors_total", error='bad "path"\\x\nnext').inc()
+    assert 'errors_total{error="bad \\"path\\"\\\\x\\nnext"} 1' in registry.prometheus()
+
+
+def test_histogram_exported_as_summary(registry):
+    hist = registry.histogram("face_detect_seconds", "YOLO per frame", pipeline="0")
+    for ms in range(1, 101):
+        hist.record(ms / 1000)
+    lines = registry.prometheus().splitlines()
+    assert "# TYPE face_detect_seconds summary" in lines
+    quantiles = [line for line in lines if "quantile=" in line]
+    assert [line.split()[0] for line in quantiles] == [
+        'face_detect_seconds{pipeline="0",quantile="0.5"}',
+        'face_detect_seconds{pipeline="0",quantile="0.95"}',
+        'face_detect_seconds{pipeline="0",quantile="0.99"}',
+    ]
+    assert [float(line.split()[1]) for line in quantiles] == [0.051, 0.096, 0.1]
+    total = next(line for line in lines if line.startswith("face_detect_seconds_sum"))
+    assert float(total.split()[1]) == pytest.approx(5.05)
+    assert 'face_detect_seconds_count{pipeline="0"} 100' in lines
+
+
+def test_snapshot_reports_seconds_in_ms(registry):
+    registry.histogram("face_embed_seconds").record(0.02)
+    registry.histogram("batch_size").record(8)
+    registry.register("queue_wait_seconds", Window(), stage="verify").record(0.004)
+    snap = registry.snapshot()
+    assert snap["histograms"]["face_embed_ms"]["p50"] == 20.0
+    assert snap["histograms"]["batch_size"]["mean"] == 8.0
+    assert snap["histograms"]['queue_wait_ms{stage="verify"}']["count"] == 1
+
+
+def test_failing_gauge_is_skipped(registry):
+    registry.gauge("gone", fn=lambda: 1 / 0)
+    registry.counter("kept_total").inc()
+    assert "gone" not in registry.prometheus()
+    assert registry.snapshot()["gauges"] == {}
+
+
+def test_write_picks_the_format_from_the_extension(registry, tmp_path):
+    registry.counter("face_matches_total").inc()
+    registry.write(str(tmp_path / "m.json"))
+    registry.write(str(tmp_path / "m.prom"))
+    assert json.loads((tmp_path / "m.json").read_text())["counters"] == {"face_matches_total": 1}
+    assert (tmp_path / "m.prom").read_text().endswith("face_matches_total 1\n")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["m.json", "m.prom"]
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+from micro_batcher import MicroBatcher, Overloaded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Recorder:
+    """run_batch stand-in: records batch sizes, answers item * 10."""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.batches = []
+        self.delay = delay
+        self.fail = fail
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("verifier down")
+        return [item * 10 for item in items]
+
+
+async def batched(recorder, items, **kwargs):
+    batcher = MicroBatcher(recorder, **kwargs)
+    batcher.start()
+    try:
+        return await asyncio.gather(*batcher.submit_many(items)), batcher
+    finally:
+        await batcher.stop()
+
+
+def test_flushes_full_batches_without_waiting():
+    recorder = Recorder()
+    start = time.perf_counter()
+    results, _ = run(batched(recorder, list(range(8)), max_batch=4, max_wait=10.0))
+    assert time.perf_counter() - start < 1.0
+    assert results == [i * 10 for i in range(8)]
+    assert recorder.batches == [[0, 1, 2, 3], [4, 5, 6, 7]]
+
+
+def test_flushes_a_partial_batch_after_max_wait():
+    recorder = Recorder()
+    start = time.perf_counter()
+    results, batcher = run(batched(recorder, [1, 2, 3], max_batch=64, max_wait=0.05))
+    assert time.perf_counter() - start >= 0.05
+    assert results == [10, 20, 30]
+    assert recorder.batches == [[1, 2, 3]]
+    assert batcher.batch_sizes.count == 1 and batcher.queue_wait.count == 3
+
+
+def test_concurrent_submits_share_a_batch():
+    recorder = Recorder()
+
+    async def main():
+        batcher = MicroBatcher(recorder, max_batch=64, max_wait=0.05)
+        batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        finally:
+            await batcher.stop()
+
+    assert run(main()) == [0, 10, 20, 30, 40]
+    assert len(recorder.batches) == 1
+
+
+def test_busy_workers_grow_the_next_batch():
+    recorder = Recorder(delay=0.1)
+
+    async def main():
+        batcher = MicroBatcher(recorder, max_batch=64, max_wait=0.0, concurrency=1)
+        batcher.start()
+        try:
+            first = batcher.submit_many([0])
+            await asyncio.sleep(0.02)  # batch [0] is running
+            rest = batcher.submit_many([1, 2, 3])
+            return await asyncio.gather(*first, *rest)
+        finally:
+            await batcher.stop()
+
+    assert run(main()) == [0, 10, 20, 30]
+    assert recorder.batches == [[0], [1, 2, 3]]
+
+
+def test_batch_failure_reaches_every_item():
+    async def main():
+        batcher = MicroBatcher(Recorder(fail=True), max_batch=2, max_wait=0.01)
+        batcher.start()
+        try:
+            return await asyncio.gather(*batcher.submit_many([1, 2, 3]), return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_rejects_when_the_queue_is_full():
+    async def main():
+        batcher = MicroBatcher(Recorder(), max_queue=2)
+        with pytest.raises(Overloaded):
+            batcher.submit_many([1, 2, 3])
+        assert batcher.depth == 0
+        return batcher.rejected
+
+    assert run(main()) == 3
@@ -0,0 +1,35 @@
+import gc
+import weakref
+
+from metrics import REGISTRY
+from pipeline import DropOldestQueue, FacePipeline
+
+
+def test_drop_oldest_queue():
+    q = DropOldestQueue(2)
+    for i in range(5):
+        q.put_latest(i)
+    assert q.dropped == 3
+    assert [q.get_nowait(), q.get_nowait()] == [3, 4]
+
+
+def test_queue_series_are_per_pipeline_and_go_away_with_it():
+    first, second = FacePipeline(system=None), FacePipeline(system=None)
+    first.frame_q.put_latest({"frame_id": 1})
+    for _ in range(3):
+        second.det_q.put_latest({"frame_id": 1})
+    gauges = REGISTRY.snapshot()["gauges"]
+    counters = REGISTRY.snapshot()["counters"]
+    assert gauges[f'pipeline_queue_depth{{pipeline="{first.pipeline_id}",queue="frame"}}'] == 1
+    assert gauges[f'pipeline_queue_depth{{pipeline="{second.pipeline_id}",queue="detect"}}'] == 2
+    assert counters[f'pipeline_dropped_total{{pipeline="{second.pipeline_id}",queue="detect"}}'] == 1
+
+    # The registry must not keep a finished pipeline alive.
+    pipeline_id = first.pipeline_id
+    ref = weakref.ref(first)
+    del first
+    gc.collect()
+    assert ref() is None
+    text = REGISTRY.prometheus()
+    assert f'pipeline_queue_depth{{pipeline="{pipeline_id}"' not in text
+    assert f'pipeline_queue_depth{{pipeline="{second.pipeline_id}",queue="detect"}} 2' in text
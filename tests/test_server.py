@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+import msgpack
+import numpy as np
+import pytest
+
+import server
+from wire_format import JSON, MSGPACK, pack
+
+D = 512
+
+
+def unit(seed):
+    v = np.random.default_rng(seed).standard_normal(D).astype("float32")
+    return v / np.linalg.norm(v)
+
+
+ALICE, BOB = unit(1), unit(2)
+# Alice again: a live embedding close to her template, RAW scale.
+ALICE_LIVE = (ALICE + 0.2 * unit(3)) * 20.0
+
+
+@pytest.fixture
+def serve(tmp_path, monkeypatch):
+    """Run `scenario(client)` against the app with its worker pool started."""
+    monkeypatch.setattr(server, "TEMPLATES_PATH", str(tmp_path / "templates.log"))
+    monkeypatch.setattr(server, "VERIFY_WORKERS", 1)
+
+    def run(scenario):
+        async def main():
+            async with server.app.test_app() as app:
+                return await scenario(app.test_client())
+
+        return asyncio.run(main())
+
+    return run
+
+
+async def post(client, path, payload, fmt="legacy"):
+    body, headers = pack(payload, fmt)
+    resp = await client.post(path, data=body, headers=headers)
+    data = await resp.get_data()
+    if resp.content_type == MSGPACK:
+        return resp.status_code, msgpack.unpackb(data)
+    return resp.status_code, json.loads(data)
+
+
+@pytest.mark.parametrize("fmt", ["legacy", "json", "msgpack"])
+def test_single_payloads(serve, fmt):
+    async def scenario(client):
+        code, body = await post(client, "/face-data", {"face_index": "alice", "embedding": ALICE}, fmt)
+        assert code == 200 and body["status"] == "verified" and len(body["commitment"]) == 64
+
+        code, body = await post(client, "/face-verify", {"face_index": "alice", "embedding": ALICE_LIVE}, fmt)
+        assert code == 200 and body["status"] == "verified"
+
+        # Someone else presenting alice's key.
+        code, body = await post(client, "/face-verify", {"face_index": "alice", "embedding": BOB}, fmt)
+        assert code == 401 and body["status"] == "rejected"
+        assert body["distance"] > server.DIST_THRESHOLD
+
+    serve(scenario)
+
+
+def test_batch_results_are_per_item(serve):
+    async def scenario(client):
+        code, body = await post(client, "/face-data", {"items": [
+            {"face_index": "alice", "embedding": ALICE},
+            {"face_index": 7, "embedding": BOB},
+            {"face_index": [1], "embedding": BOB},
+            {"embedding": BOB},
+        ]}, "msgpack")
+        assert code == 200
+        assert [r["status"] for r in body["results"]] == ["verified", "verified", "error", "error"]
+        assert "'face_index' must be" in body["results"][2]["error"]
+        assert body["counts"] == {"verified": 2, "error": 2}
+
+        code, body = await post(client, "/face-verify", {"items": [
+            {"face_index": "alice", "embedding": ALICE_LIVE},
+            {"face_index": 7, "embedding": ALICE},
+            {"face_index": "carol", "embedding": ALICE},
+            {"face_index": {"a": 1}, "embedding": ALICE},
+            {"face_index": "alice", "embedding": [1.0, 2.0]},
+            {"face_index": "old-client", "embedding": BOB, "enrolled": BOB * 3},
+        ]}, "msgpack")
+        assert code == 200
+        results = body["results"]
+        assert [r["status"] for r in results] == ["verified", "rejected", "rejected", "error", "error", "verified"]
+        assert [r["face_index"] for r in results[:3]] == ["alice", 7, "carol"]
+        assert "backfill_templates.py" in results[2]["error"]
+        assert results[3]["error"] == "'face_index' must be a string or an integer"
+        assert "differ in length" in results[4]["error"]
+        assert set(results[0]["timings_ms"]) == {"decode", "witness", "prove", "verify"}
+
+    serve(scenario)
+
+
+def test_bad_requests(serve, monkeypatch):
+    monkeypatch.setattr(server, "MAX_REQUEST_ITEMS", 2)
+
+    async def scenario(client):
+        resp = await client.post("/face-verify", data=b"{not json", headers={"Content-Type": JSON})
+        assert resp.status_code == 400
+        code, body = await post(client, "/face-verify", {"items": [{}, {}, {}]})
+        assert code == 400 and "At most 2" in body["error"]
+        code, body = await post(client, "/face-verify", {"items": []})
+        assert code == 200 and body["results"] == []
+        code, body = await post(client, "/face-verify", {"face_index": "nobody", "embedding": ALICE})
+        assert code == 401
+
+    serve(scenario)
+
+
+def test_templates_survive_a_restart(serve):
+    async def enroll(client):
+        await post(client, "/face-data", {"face_index": "alice", "embedding": ALICE})
+
+    async def verify(client):
+        return await post(client, "/face-verify", {"face_index": "alice", "embedding": ALICE_LIVE})
+
+    serve(enroll)
+    code, body = serve(verify)
+    assert code == 200 and body["status"] == "verified"
+
+
+def test_metrics(serve):
+    async def scenario(client):
+        await post(client, "/face-data", {"face_index": "alice", "embedding": ALICE})
+        await post(client, "/face-verify", {"face_index": "alice", "embedding": ALICE_LIVE})
+        resp = await client.get("/metrics")
+        snapshot = await resp.get_json()
+        text = await (await client.get("/metrics?format=prometheus")).get_data(as_text=True)
+        return snapshot, text
+
+    snapshot, text = serve(scenario)
+    assert snapshot["templates"] == 1 and snapshot["verifier"] == server.VERIFIER
+    assert snapshot["verify"]
+    assert 'server_items_total{endpoint="face-verify",status="verified"}' in text
+    assert "# TYPE verify_batch_size summary" in text
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+
+import msgpack
+import pytest
+import requests
+
+import server_client
+from server_client import ServerClient
+from wire_format import MSGPACK
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.content = msgpack.packb(body)
+        self.headers = {"Content-Type": MSGPACK}
+        self.text = ""
+
+
+class FakeServer:
+    """Stands in for session.post: answers from a script of status codes
+    (or exceptions), then 200 once the script runs out, or raises while
+    `down` is set."""
+
+    def __init__(self, script=()):
+        self.script = list(script)
+        self.down = False
+        self.posts = []
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        with self.lock:
+            self.posts.append((url, msgpack.unpackb(data)))
+            step = self.script.pop(0) if self.script else 200
+        if self.down:
+            raise requests.ConnectionError("server down")
+        if isinstance(step, Exception):
+            raise step
+        return FakeResponse(step, {"status": "verified" if step == 200 else "error"})
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault("backoff", 0.01)
+    kwargs.setdefault("probe_every", 0.05)
+    client = ServerClient("http://server", **kwargs)
+    client.session.post = server.post
+    return client
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_retries_connection_errors_and_busy_statuses():
+    server = FakeServer([requests.ConnectionError("reset"), 503, 429, 200])
+    client = make_client(server, retries=3)
+    try:
+        job = client.submit("/face-verify", {"face_index": "alice"})
+        reply = job.future.result(timeout=5)
+        assert reply.ok and reply.body == {"status": "verified"}
+        assert job.attempts == 4
+        assert client.poll() == [job]
+    finally:
+        client.close()
+
+
+def test_gives_up_after_the_retries():
+    server = FakeServer([503] * 10)
+    client = make_client(server, retries=2)
+    try:
+        job = client.submit("/face-verify", {"face_index": "alice"})
+        with pytest.raises(RuntimeError, match="503"):
+            job.future.result(timeout=5)
+        assert job.attempts == 3
+    finally:
+        client.close()
+
+
+def test_client_errors_are_not_retried():
+    server = FakeServer([401])
+    client = make_client(server)
+    try:
+        reply = client.submit("/face-verify", {"face_index": "alice"}).future.result(timeout=5)
+        assert reply.status_code == 401 and not reply.ok
+        assert len(server.posts) == 1
+    finally:
+        client.close()
+
+
+def test_unexpected_errors_do_not_stop_the_sender():
+    server = FakeServer([KeyError("boom")])
+    client = make_client(server)
+    try:
+        first = client.submit("/face-verify", {"face_index": "a"})
+        with pytest.raises(KeyError):
+            first.future.result(timeout=5)
+        second = client.submit("/face-verify", {"face_index": "b"})
+        assert second.future.result(timeout=5).ok
+    finally:
+        client.close()
+
+
+def test_registrations_wait_offline_and_flush_in_order(tmp_path):
+    outbox = str(tmp_path / "outbox.msgpack")
+    server = FakeServer()
+    server.down = True
+    client = make_client(server, retries=0, offline_path=outbox)
+    try:
+        jobs = [client.submit("/face-data", {"face_index": f"p{i}"}, tag=("register", f"p{i}"), buffer=True)
+                for i in range(3)]
+        wait_for(lambda: len(client.offline) == 3)
+        assert not any(job.future.done() for job in jobs)
+        # Verifications fail fast instead of waiting.
+        with pytest.raises(requests.ConnectionError):
+            client.submit("/face-verify", {"face_index": "p0"}).future.result(timeout=5)
+        with open(outbox, "rb") as f:
+            assert [r["tag"] for r in msgpack.Unpacker(f)] == [["register", f"p{i}"] for i in range(3)]
+
+        server.down = False
+        for job in jobs:
+            assert job.future.result(timeout=5).ok
+        # The outbox is rewritten once the flush is through.
+        wait_for(lambda: not client.offline and os.path.getsize(outbox) == 0)
+        sent = [body["face_index"] for url, body in server.posts if url.endswith("/face-data")]
+        assert sent[-3:] == ["p0", "p1", "p2"]
+    finally:
+        client.close()
+
+
+def test_outbox_survives_a_restart_and_a_torn_append(tmp_path):
+    outbox = str(tmp_path / "outbox.msgpack")
+    server = FakeServer()
+    server.down = True
+    client = make_client(server, retries=0, offline_path=outbox)
+    client.submit("/face-data", {"face_index": "p0"}, tag=("register", "p0"), buffer=True)
+    client.submit("/face-data", {"face_index": "p1"}, tag=("register", "p1"), buffer=True)
+    wait_for(lambda: len(client.offline) == 2)
+    client.close(timeout=0.1)
+    with open(outbox, "ab") as f:
+        f.write(ServerClient._record(client.offline[0])[:-5])
+
+    server = FakeServer()
+    server.down = True
+    client = make_client(server, retries=0, offline_path=outbox)
+    try:
+        assert [job.tag for job in client.offline] == [["register", "p0"], ["register", "p1"]]
+        # Appends after the dropped partial record stay readable.
+        client._buffer(server_client.Job("/face-data", msgpack.packb({"face_index": "p2"}), {}, ["register", "p2"],
+                                         buffer=True))
+        server.down = False
+        wait_for(lambda: not client.offline)
+        sent = [body["face_index"] for _, body in server.posts]
+        assert sent[-3:] == ["p0", "p1", "p2"]
+    finally:
+        client.close()
+
+
+def test_full_queue_appends_one_record(tmp_path, monkeypatch):
+    outbox = str(tmp_path / "outbox.msgpack")
+    server = FakeServer()
+    client = make_client(server, max_queue=1, offline_path=outbox)
+    client.stop_event.set()
+    client.thread.join()
+    saves = []
+    monkeypatch.setattr(client, "_save_offline", lambda: saves.append(True))
+    client.submit("/face-data", {"face_index": "p0"}, buffer=True)  # fills the queue
+    for i in range(1, 4):
+        client.submit("/face-data", {"face_index": f"p{i}"}, buffer=True)
+    assert len(client.offline) == 3 and not saves
+    with open(outbox, "rb") as f:
+        assert len(list(msgpack.Unpacker(f))) == 3
+    client.session.close()
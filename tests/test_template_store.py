@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from template_store import TemplateStore, commitment
+
+
+def vec(seed, d=8):
+    return np.random.default_rng(seed).random(d, dtype="float32")
+
+
+def test_replay_restores_templates_and_commitments(tmp_path):
+    path = str(tmp_path / "templates.log")
+    store = TemplateStore(path)
+    digests = store.put_many([("alice", vec(1)), (7, vec(2))])
+    store.put("alice", vec(3))  # re-enrollment replaces the template
+    store.close()
+
+    store = TemplateStore(path)
+    assert len(store) == 2 and "alice" in store and 7 in store
+    vector, digest = store.get("alice")
+    np.testing.assert_array_equal(vector, vec(3))
+    assert digest == commitment("alice", vec(3)) != digests[0]
+    assert store.get(7)[1] == digests[1]
+    assert store.get("bob") is None
+    store.close()
+
+
+def test_torn_tail_is_truncated(tmp_path, capsys):
+    path = str(tmp_path / "templates.log")
+    store = TemplateStore(path)
+    store.put("alice", vec(1))
+    store.close()
+    good = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b"\x82\xaaface_index\xa3bob\xa6vector\xc4\x20" + b"\x00" * 5)
+
+    store = TemplateStore(path)
+    assert len(store) == 1
+    assert os.path.getsize(path) == good
+    assert "partial record" in capsys.readouterr().out
+    # Appends after the truncation replay cleanly.
+    store.put("bob", vec(2))
+    store.close()
+    assert len(TemplateStore(path)) == 2
+
+
+def test_in_memory_store(tmp_path):
+    store = TemplateStore()
+    store.put("alice", vec(1))
+    assert "alice" in store
+    store.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_commitment_depends_on_key_and_vector():
+    assert commitment("alice", vec(1)) == commitment("alice", vec(1).astype("float64"))
+    assert commitment("alice", vec(1)) != commitment("bob", vec(1))
+    assert commitment("alice", vec(1)) != commitment("alice", vec(2))
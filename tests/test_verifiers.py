@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from verifiers import THRESHOLD, make_verifier
+
+D = 512
+
+
+def unit(seed):
+    v = np.random.default_rng(seed).standard_normal(D).astype("float32")
+    return v / np.linalg.norm(v)
+
+
+def near(v, seed, noise=0.3):
+    # The same face seen again: a small perturbation, far above the threshold.
+    return v + noise * unit(seed) / np.sqrt(2)
+
+
+@pytest.fixture(params=["distance", "stand-in"])
+def verifier(request):
+    return make_verifier(request.param)
+
+
+def test_different_identity_is_rejected(verifier):
+    (result,) = verifier.run([{"face_index": "alice", "embedding": unit(2), "enrolled": unit(1)}])
+    assert result["status"] == "rejected"
+    # Unrelated unit vectors are about 2.0 apart; the old 5.0 threshold
+    # accepted them.
+    assert result["distance"] == pytest.approx(2.0, abs=0.2)
+
+
+def test_same_identity_is_verified(verifier):
+    alice = unit(1)
+    (result,) = verifier.run([{"face_index": "alice", "embedding": near(alice, 3), "enrolled": alice}])
+    assert result["status"] == "verified"
+    assert result["distance"] < THRESHOLD
+
+
+def test_raw_and_normalized_vectors_compare_on_one_scale(verifier):
+    # A raw live embedding against a normalized (cosine DB / backfilled)
+    # template, and the reverse, decide the same as two unit vectors.
+    alice, bob = unit(1), unit(2)
+    items = [
+        {"face_index": "alice", "embedding": near(alice, 3) * 25.0, "enrolled": alice},
+        {"face_index": "alice", "embedding": near(alice, 3), "enrolled": alice * 25.0},
+        {"face_index": "alice", "embedding": bob * 25.0, "enrolled": alice},
+        {"face_index": "alice", "embedding": bob, "enrolled": alice * 25.0},
+    ]
+    assert [r["status"] for r in verifier.run(items)] == ["verified", "verified", "rejected", "rejected"]
+
+
+def test_bad_items_are_reported_per_item(verifier):
+    alice = unit(1)
+    items = [
+        {"face_index": "a", "embedding": alice, "enrolled": alice},
+        {"face_index": "b", "embedding": np.zeros(D, dtype="float32"), "enrolled": alice},
+        {"face_index": "c", "embedding": alice[:10], "enrolled": alice},
+        {"face_index": "d", "embedding": [1.0, float("nan")], "enrolled": [1.0, 0.0]},
+        "not an object",
+    ]
+    results = verifier.run(items)
+    assert results[0]["status"] == "verified"
+    assert "zero vector" in results[1]["error"]
+    assert "differ in length" in results[2]["error"]
+    assert results[3]["status"] == "error"
+    assert results[4] == {"face_index": None, "status": "error", "error": "Each item must be a JSON object"}
+    assert set(results[0]["timings_ms"]) == {"decode", "witness", "prove", "verify"}
+
+
+def test_stand_in_commitment_binds_the_template():
+    verifier = make_verifier("stand-in")
+    alice = unit(1)
+    witness = verifier.witness([{"face_index": "alice", "commitment": b"x" * 32}], alice[None], alice[None])[0]
+    proof = verifier.prove(witness)
+    assert verifier.check(witness, proof)
+    assert not verifier.check(dict(witness, commitment=b"y" * 32), proof)
+
+
+def test_unknown_verifier():
+    with pytest.raises(ValueError):
+        make_verifier("nope")
+    with pytest.raises(ValueError):
+        make_verifier("zk")
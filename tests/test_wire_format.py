@@ -0,0 +1,70 @@
+import base64
+
+import numpy as np
+import pytest
+
+from wire_format import DTYPES, decode_vector, encode_vector, pack, to_vector, unpack
+
+# Worst-case element error per dtype, relative to the vector's peak.
+TOLERANCE = {"f32": 0.0, "f16": 1e-3, "q8": 0.5 / 127, "q16": 0.5 / 32767}
+
+
+@pytest.fixture
+def vec():
+    return np.random.default_rng(0).normal(size=512).astype("float32")
+
+
+@pytest.mark.parametrize("dtype", list(DTYPES))
+def test_round_trip_per_dtype(vec, dtype):
+    data = encode_vector(vec, dtype)
+    assert len(data) == 16 + 512 * np.dtype(DTYPES[dtype][1]).itemsize
+    out = decode_vector(data)
+    assert out.dtype == np.float32 and out.shape == vec.shape
+    peak = np.abs(vec).max()
+    assert np.abs(out - vec).max() <= TOLERANCE[dtype] * peak + 1e-7
+
+
+@pytest.mark.parametrize("dtype", list(DTYPES))
+def test_base64_round_trip(vec, dtype):
+    text = base64.b64encode(encode_vector(vec, dtype)).decode("ascii")
+    np.testing.assert_array_equal(decode_vector(text), decode_vector(encode_vector(vec, dtype)))
+
+
+@pytest.mark.parametrize("dtype", ["q8", "q16"])
+def test_zero_vector_quantizes_to_zeros(dtype):
+    np.testing.assert_array_equal(decode_vector(encode_vector(np.zeros(8), dtype)), np.zeros(8))
+
+
+@pytest.mark.parametrize("fmt", ["msgpack", "json", "legacy"])
+def test_pack_unpack_payload(vec, fmt):
+    payload = {"items": [{"face_index": "alice", "embedding": vec}, {"face_index": "bob", "embedding": vec[:4]}]}
+    body, headers = pack(payload, fmt)
+    data = unpack(body, headers["Content-Type"])
+    items = data["items"]
+    assert [item["face_index"] for item in items] == ["alice", "bob"]
+    np.testing.assert_array_equal(to_vector(items[0]["embedding"], "embedding"), vec)
+    np.testing.assert_array_equal(to_vector(items[1]["embedding"], "embedding"), vec[:4])
+
+
+@pytest.mark.parametrize("data", [
+    b"short",
+    b"XXXX" + encode_vector(np.ones(4))[4:],
+    encode_vector(np.ones(4))[:-1],
+    "not base64!",
+])
+def test_rejects_malformed_vectors(data):
+    with pytest.raises(ValueError):
+        decode_vector(data)
+
+
+def test_rejects_unknown_dtype_and_format(vec):
+    with pytest.raises(ValueError):
+        encode_vector(vec, "f64")
+    with pytest.raises(ValueError):
+        pack({"embedding": vec}, "xml")
+
+
+@pytest.mark.parametrize("value", [[], [1.0, float("nan")], encode_vector(np.zeros(0))])
+def test_to_vector_rejects_empty_or_non_finite(value):
+    with pytest.raises(ValueError):
+        to_vector(value, "embedding")
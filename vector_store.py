@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+
+def vector_store_path(db_path):
+    return db_path + ".vectors"
+
+
+class VectorStore:
+    """Exact float32 embeddings on disk, row = face ID, read through a memmap.
+
+    Compressed indexes (SQ8 / fp16 / PQ) only keep approximate codes in RAM;
+    this file keeps the exact vectors for re-ranking their candidates and for
+    rebuilding the index at migrations. Rows are written in place (`pwrite`)
+    and never fsynced: the write-ahead log is what makes a registration
+    durable, and replaying it rewrites the rows. Rows of removed faces are
+    left behind; nothing looks them up.
+    """
+
+    def __init__(self, path, dim, read_only=False):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = 4 * dim
+        self.read_only = read_only
+        self.fd = None
+        if not read_only:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.map = None
+        self._remap()
+
+    @property
+    def rows(self):
+        return os.path.getsize(self.path) // self.row_bytes if os.path.exists(self.path) else 0
+
+    def _remap(self):
+        rows = self.rows
+        self.map = np.memmap(self.path, dtype="<f4", mode="r", shape=(rows, self.dim)) if rows else None
+
+    def write(self, face_ids, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype="<f4").reshape(-1, self.dim)
+        face_ids = np.asarray(face_ids, dtype="int64")
+        if len(face_ids) > 1 and np.all(np.diff(face_ids) == 1):
+            # Consecutive IDs (batch enrollment): one write.
+            os.pwrite(self.fd, vectors.tobytes(), int(face_ids[0]) * self.row_bytes)
+            return
+        for face_id, vector in zip(face_ids, vectors):
+            os.pwrite(self.fd, vector.tobytes(), int(face_id) * self.row_bytes)
+
+    def get(self, face_ids):
+        """(len(face_ids), dim) float32 copy of the given rows."""
+        face_ids = np.asarray(face_ids, dtype="int64")
+        if face_ids.size and (self.map is None or int(face_ids.max()) >= len(self.map)):
+            # The file grew since it was mapped.
+            self._remap()
+            if self.map is None or int(face_ids.max()) >= len(self.map):
+                raise IndexError("face ID beyond the exact vector store")
+        if self.map is None:
+            return np.empty(face_ids.shape + (self.dim,), dtype="float32")
+        return np.asarray(self.map[face_ids], dtype="float32")
+
+    def flush(self):
+        if self.fd is not None:
+            os.fsync(self.fd)
+
+    def close(self):
+        self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
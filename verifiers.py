@@ -0,0 +1,188 @@
+import hashlib
+import importlib
+import time
+
+import numpy as np
+
+from wire_format import to_vector
+
+# Verification backends for server.py. A backend turns each verify item
+# (live + enrolled embedding) into a decision in four timed stages:
+#
+#   decode   payload fields -> float32 vectors (wire_format.to_vector),
+#            L2-normalized
+#   witness  private inputs for the proof: the vectors and their distance,
+#            computed for the whole batch at once
+#   prove    proof generation, per item
+#   verify   proof verification, per item
+#
+# Subclasses override witness() / prove() / check(). Timings come back per
+# item in milliseconds; batch-wide stages are split evenly over the batch.
+#
+# Clients send raw or unit-length embeddings (copy3 / copy4, cosine or L2
+# FaceDB, backfilled templates), so both vectors are normalized here, in
+# one place, and `threshold` is a squared L2 distance between unit vectors:
+# 2 - 2 * cosine similarity, 1.2 = similarity 0.4 (the clients'
+# SIM_THRESHOLD). Any two unit vectors are at most 4.0 apart.
+STAGES = ("decode", "witness", "prove", "verify")
+THRESHOLD = 1.2
+
+
+def normalize(vector, field):
+    norm = np.linalg.norm(vector)
+    if not norm > 0:
+        raise ValueError(f"'{field}' must not be a zero vector")
+    return vector / norm
+
+
+class Verifier:
+    name = "base"
+
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+
+    def witness(self, items, live, enrolled):
+        """One witness per item. `live` / `enrolled` are (n, d) arrays."""
+        dists = np.sum((live - enrolled) ** 2, axis=1)
+        return [{"face_index": item.get("face_index"), "live": a, "enrolled": b, "distance": float(d),
+                 "commitment": item.get("commitment")}
+                for item, a, b, d in zip(items, live, enrolled, dists)]
+
+    def prove(self, witness):
+        raise NotImplementedError
+
+    def check(self, witness, proof):
+        """True when the proof verifies and attests a match."""
+        raise NotImplementedError
+
+    def run(self, items):
+        """Per-item result dicts (status, distance, timings_ms), errors
+        included, in the order of `items`."""
+        results = [None] * len(items)
+        groups = {}
+
+        t0 = time.perf_counter()
+        for i, item in enumerate(items):
+            face_index = item.get("face_index") if isinstance(item, dict) else None
+            results[i] = {"face_index": face_index}
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each item must be a JSON object")
+                a = to_vector(item.get("embedding"), "embedding")
+                b = to_vector(item.get("enrolled"), "enrolled")
+                if a.shape != b.shape:
+                    raise ValueError("'embedding' and 'enrolled' differ in length")
+                a = normalize(a, "embedding")
+                b = normalize(b, "enrolled")
+                # Valid items grouped by embedding length (one group in practice).
+                rows, live, enrolled = groups.setdefault(a.size, ([], [], []))
+                rows.append(i)
+                live.append(a)
+                enrolled.append(b)
+            except (TypeError, ValueError) as e:
+                results[i].update(status="error", error=str(e))
+        decode_ms = (time.perf_counter() - t0) * 1000 / max(1, len(items))
+
+        for rows, live, enrolled in groups.values():
+            t0 = time.perf_counter()
+            witnesses = self.witness([items[i] for i in rows], np.stack(live), np.stack(enrolled))
+            witness_ms = (time.perf_counter() - t0) * 1000 / len(rows)
+            for i, w in zip(rows, witnesses):
+                timings = {"decode": decode_ms, "witness": witness_ms}
+                try:
+                    t0 = time.perf_counter()
+                    proof = self.prove(w)
+                    t1 = time.perf_counter()
+                    ok = self.check(w, proof)
+                    t2 = time.perf_counter()
+                except Exception as e:
+                    results[i].update(status="error", error=f"{self.name} backend: {e}")
+                    continue
+                timings["prove"] = (t1 - t0) * 1000
+                timings["verify"] = (t2 - t1) * 1000
+                results[i].update(status="verified" if ok else "rejected", distance=w["distance"],
+                                  timings_ms={k: round(v, 3) for k, v in timings.items()})
+        return results
+
+
+class DistanceVerifier(Verifier):
+    """Pure NumPy check, no proof: the decision is the distance test."""
+    name = "distance"
+
+    def prove(self, witness):
+        return None
+
+    def check(self, witness, proof):
+        return witness["distance"] <= self.threshold
+
+
+class StandInVerifier(Verifier):
+    """Deterministic local stand-in for the ZK prover. The "proof" is a
+    SHA-256 commitment to the inputs and the claimed decision, which the
+    verify stage recomputes; `proof_delay` simulates prover time so the
+    worker pool can be sized against a real backend."""
+    name = "stand-in"
+
+    def __init__(self, threshold=THRESHOLD, proof_delay=0.0):
+        super().__init__(threshold)
+        self.proof_delay = proof_delay
+
+    def commitment(self, witness, claim):
+        h = hashlib.sha256()
+        h.update(str(witness["face_index"]).encode())
+        h.update(witness["live"].tobytes())
+        # The server's template store hands in the enrolled template's
+        # cached commitment; older clients' inline templates get hashed.
+        h.update(witness["commitment"] or witness["enrolled"].tobytes())
+        h.update(b"\x01" if claim else b"\x00")
+        return h.digest()
+
+    def prove(self, witness):
+        if self.proof_delay:
+            time.sleep(self.proof_delay)
+        claim = witness["distance"] <= self.threshold
+        return {"claim": claim, "digest": self.commitment(witness, claim)}
+
+    def check(self, witness, proof):
+        return proof["claim"] and proof["digest"] == self.commitment(witness, proof["claim"])
+
+
+class ZKVerifier(Verifier):
+    """Hook for the real ZK prover (the `server` branch implementation).
+
+    `prover` and `checker` are "module:function" paths, imported in each
+    worker process:
+        prover(witness, threshold) -> proof
+        checker(proof, witness) -> bool
+    where `witness` holds face_index, live, enrolled (unit-length float32
+    arrays), distance and commitment (the enrolled template's SHA-256, see
+    template_store.py; None for templates sent inline by older clients).
+    """
+    name = "zk"
+
+    def __init__(self, threshold=THRESHOLD, prover=None, checker=None):
+        super().__init__(threshold)
+        if not prover or not checker:
+            raise ValueError("The zk verifier needs prover= and checker= ('module:function')")
+        self.prover = load_function(prover)
+        self.checker = load_function(checker)
+
+    def prove(self, witness):
+        return self.prover(witness, self.threshold)
+
+    def check(self, witness, proof):
+        return bool(self.checker(proof, witness))
+
+
+def load_function(path):
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+VERIFIERS = {cls.name: cls for cls in (StandInVerifier, DistanceVerifier, ZKVerifier)}
+
+
+def make_verifier(name, **options):
+    if name not in VERIFIERS:
+        raise ValueError(f"Unknown verifier {name!r}; expected one of {', '.join(VERIFIERS)}")
+    return VERIFIERS[name](**options)
@@ -1,78 +1,77 @@
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing as mp
 import os
-from PIL import Image
+import time
 
-# ========== CONFIGURE YOUR PATHS HERE ==========
-# Example:
-# source_label_file = r"C:\YoLo-Face\dataset_raw\wider_face_split\wider_face_train_bbx_gt.txt"
-# images_base_dir = r"C:\YoLo-Face\dataset_raw\WIDER_train\images"
-# target_dir = r"C:\YoLo-Face\dataset\labels\train"
-
-# source_label_file = r"C:\YoLo-Face\dataset_raw\wider_face_split\wider_face_train_bbx_gt.txt"
-# images_base_dir = r"C:\YoLo-Face\dataset_raw\WIDER_train\images"
-# target_dir = r"C:\YoLo-Face\dataset\labels\train"
-
-source_label_file = r"C:\YoLo-Face\dataset_raw\wider_face_split\wider_face_val_bbx_gt.txt"
-images_base_dir = r"C:\YoLo-Face\dataset_raw\WIDER_val\images"
-target_dir = r"C:\YoLo-Face\dataset\labels\val"
+import numpy as np
+from PIL import Image, ImageOps
 
+# ========== CONFIGURE YOUR PATHS HERE ==========
+RAW_ROOT = r"C:\YoLo-Face\dataset_raw"
+DATASET_ROOT = r"C:\YoLo-Face\dataset"
 
+# split: (annotation file, image directory), relative to RAW_ROOT. Labels go
+# to DATASET_ROOT/labels/<split>. The test split ships an image list without
+# boxes, so its label files come out empty.
+SPLITS = {
+    "train": (os.path.join("wider_face_split", "wider_face_train_bbx_gt.txt"), os.path.join("WIDER_train", "images")),
+    "val": (os.path.join("wider_face_split", "wider_face_val_bbx_gt.txt"), os.path.join("WIDER_val", "images")),
+    "test": (os.path.join("wider_face_split", "wider_face_test_filelist.txt"), os.path.join("WIDER_test", "images")),
+}
 # ==============================================
 
-# Create target directory if not exists
-os.makedirs(target_dir, exist_ok=True)
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
 
-# Read annotation lines
-with open(source_label_file, "r", encoding="utf-8") as f:
-    lines = [line.strip() for line in f.readlines() if line.strip()]
+# Ultralytics label cache format (ultralytics.data.dataset); the installed
+# package's values take precedence, see write_label_cache().
+CACHE_VERSION = "1.0.3"
+CACHE_IMG_FORMATS = {"bmp", "dng", "jpeg", "jpg", "mpo", "png", "tif", "tiff", "webp", "pfm", "heic"}
 
-i = 0
-while i < len(lines):
-    line = lines[i]
 
-    # Detect image line (always contains '/' or ends with an image extension)
-    if not ("/" in line or line.lower().endswith(('.jpg', '.jpeg', '.png'))):
-        i += 1
-        continue
+def is_image_line(line):
+    # Image lines always contain '/' or end with an image extension
+    return "/" in line or line.lower().endswith(IMAGE_EXTS)
 
-    image_path = line
-    i += 1
 
-    # Get bounding box count (next line)
-    if i >= len(lines):
-        break
-    try:
-        bbox_count = int(lines[i])
-    except ValueError:
-        bbox_count = 0
-    i += 1
-
-    bboxes = []
-    for _ in range(bbox_count):
-        if i >= len(lines):
-            break
-        try:
-            bbox = list(map(float, lines[i].split()[:4]))  # x, y, w, h
-            bboxes.append(bbox)
-        except ValueError:
-            pass
-        i += 1
+def parse_annotations(path):
+    """Stream (image_path, [(x, y, w, h), ...]) records from a WIDER FACE
+    annotation file (or a plain image list), one image at a time."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = (line.strip() for line in f)
+        lines = (line for line in lines if line)
+        pending = next(lines, None)
+        while pending is not None:
+            line, pending = pending, next(lines, None)
+            if not is_image_line(line):
+                continue
+            image_path = line
 
-    # Locate image
-    image_full_path = os.path.join(images_base_dir, image_path)
-    if not os.path.exists(image_full_path):
-        print(f"[WARN] Missing image: {image_full_path}")
-        continue
+            # Box count on the next line; image lists have none.
+            bbox_count = 0
+            if pending is not None and not is_image_line(pending):
+                try:
+                    bbox_count = int(pending)
+                    pending = next(lines, None)
+                except ValueError:
+                    pass
 
-    # Get image dimensions
-    try:
-        with Image.open(image_full_path) as img:
-            img_width, img_height = img.size
-    except Exception as e:
-        print(f"[ERROR] Unable to open image {image_full_path}: {e}")
-        continue
+            bboxes = []
+            for _ in range(bbox_count):
+                if pending is None or is_image_line(pending):
+                    break
+                try:
+                    bboxes.append(tuple(map(float, pending.split()[:4])))  # x, y, w, h
+                except ValueError:
+                    pass
+                pending = next(lines, None)
+            yield image_path, bboxes
 
-    # Convert boxes to YOLO format
-    yolo_lines = []
+
+def yolo_lines(bboxes, img_width, img_height):
+    lines = []
     for (x, y, w, h) in bboxes:
         if w <= 0 or h <= 0:
             continue
@@ -80,12 +79,313 @@ while i < len(lines):
         y_center = (y + h / 2.0) / img_height
         w_norm = w / img_width
         h_norm = h / img_height
-        yolo_lines.append(f"0 {x_center:.6f} {y_center:.6f} {w_norm:.6f} {h_norm:.6f}")
+        lines.append(f"0 {x_center:.6f} {y_center:.6f} {w_norm:.6f} {h_norm:.6f}")
+    return lines
+
+
+def label_path(target_dir, image_path):
+    return os.path.join(target_dir, os.path.splitext(os.path.basename(image_path))[0] + ".txt")
+
+
+def image_size(path):
+    """(width, height) as displayed, i.e. after EXIF rotation (what
+    Ultralytics records). PIL reads only the header; pixels are never
+    decoded."""
+    with Image.open(path) as img:
+        width, height = img.size
+        if img.format in ("JPEG", "MPO") and img.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+    return width, height
+
+
+def check_image(task):
+    """Worker: the image checks Ultralytics runs before caching a label
+    (ultralytics.data.utils.verify_image_label): PIL verify, EXIF size of at
+    least 10 px, a known format, and a JPEG that is not truncated (restored
+    and re-saved, as Ultralytics does). Returns ((width, height), message),
+    or (None, error) for an image Ultralytics would reject."""
+    path, img_formats = task
+    try:
+        with Image.open(path) as img:
+            img.verify()
+            fmt = (img.format or "").lower()
+        width, height = image_size(path)
+        if width < 10 or height < 10:
+            raise ValueError(f"image size {(width, height)} <10 pixels")
+        if fmt not in img_formats:
+            raise ValueError(f"invalid image format {fmt}")
+        msg = ""
+        if fmt in ("jpg", "jpeg"):
+            with open(path, "rb") as f:
+                f.seek(-2, 2)
+                if f.read() != b"\xff\xd9":
+                    with Image.open(path) as img:
+                        ImageOps.exif_transpose(img).save(path, "JPEG", subsampling=0, quality=100)
+                    msg = f"WARNING ⚠️ {path}: corrupt JPEG restored and saved"
+        return (width, height), msg
+    except Exception as e:
+        return None, f"WARNING ⚠️ {path}: ignoring corrupt image/label: {e}"
+
+
+def annotation_key(bboxes):
+    return hashlib.sha1(repr(bboxes).encode()).hexdigest()
+
+
+def convert_record(task):
+    """Worker: probe one image's size and write its YOLO label file.
+    Returns (status, image_path, image_full_path, size, mtime_ns, lines)."""
+    image_path, bboxes, images_base_dir, target_dir = task
+    image_full_path = os.path.join(images_base_dir, image_path)
+    try:
+        mtime_ns = os.stat(image_full_path).st_mtime_ns
+        img_width, img_height = image_size(image_full_path)
+    except FileNotFoundError:
+        return "missing", image_path, image_full_path, None, None, None
+    except Exception as e:
+        return f"error: {e}", image_path, image_full_path, None, None, None
+
+    lines = yolo_lines(bboxes, img_width, img_height)
+    with open(label_path(target_dir, image_path), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return "ok", image_path, image_full_path, (img_width, img_height), mtime_ns, lines
+
+
+def manifest_path(target_dir):
+    return target_dir.rstrip("\\/") + ".manifest.json"
+
+
+def load_manifest(target_dir):
+    # image path -> [annotation key, image mtime_ns, width, height]
+    path = manifest_path(target_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(target_dir, manifest):
+    path = manifest_path(target_dir)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def convert_split(pool, name, annotation_file, images_base_dir, target_dir, incremental=True):
+    """Convert one split. Returns (stats, labels), labels mapping each
+    label file stem to ((width, height), YOLO lines) for the label cache."""
+    os.makedirs(target_dir, exist_ok=True)
+    old = load_manifest(target_dir) if incremental else {}
+    manifest = {}
+    labels = {}
+    stats = {"images": 0, "unchanged": 0, "faces": 0, "missing": 0, "errors": 0}
+
+    # Split the records here, in the main thread: images whose annotation and
+    # file are unchanged since the last run (and whose label file is still
+    # there) are not sent to the pool. Only plain task tuples reach imap, whose
+    # task-handler thread must not touch stats / manifest / labels.
+    start = last_report = time.perf_counter()
+    tasks = []
+    pending_keys = {}
+    for image_path, bboxes in parse_annotations(annotation_file):
+        key = annotation_key(bboxes)
+        entry = old.get(image_path)
+        if entry is not None and entry[0] == key:
+            image_full_path = os.path.join(images_base_dir, image_path)
+            try:
+                unchanged = (os.stat(image_full_path).st_mtime_ns == entry[1]
+                             and os.path.exists(label_path(target_dir, image_path)))
+            except OSError:
+                unchanged = False
+            if unchanged:
+                size = (entry[2], entry[3])
+                lines = yolo_lines(bboxes, *size)
+                manifest[image_path] = entry
+                labels[os.path.splitext(os.path.basename(image_path))[0]] = (size, lines)
+                stats["unchanged"] += 1
+                stats["faces"] += len(lines)
+                continue
+        pending_keys[image_path] = key
+        tasks.append((image_path, bboxes, images_base_dir, target_dir))
+
+    for status, image_path, image_full_path, size, mtime_ns, lines in pool.imap_unordered(
+            convert_record, tasks, chunksize=64):
+        if status == "ok":
+            stats["images"] += 1
+            stats["faces"] += len(lines)
+            manifest[image_path] = [pending_keys.pop(image_path), mtime_ns, size[0], size[1]]
+            labels[os.path.splitext(os.path.basename(image_path))[0]] = (size, lines)
+        elif status == "missing":
+            stats["missing"] += 1
+            print(f"[WARN] Missing image: {image_full_path}")
+        else:
+            stats["errors"] += 1
+            print(f"[ERROR] Unable to open image {image_full_path}: {status[len('error: '):]}")
+        now = time.perf_counter()
+        if now - last_report >= 5.0:
+            print(f"[+] {name}: {stats['images']} images, {stats['images'] / (now - start):.0f} img/s")
+            last_report = now
+    save_manifest(target_dir, manifest)
+    stats["seconds"] = time.perf_counter() - start
+    return stats, labels
+
+
+def get_hash(paths):
+    # Same as ultralytics.data.utils.get_hash: total file size + path list.
+    size = 0
+    for p in paths:
+        try:
+            size += os.stat(p).st_size
+        except OSError:
+            continue
+    h = hashlib.sha256(str(size).encode())
+    h.update("".join(paths).encode())
+    return h.hexdigest()
+
+
+def write_label_cache(pool, images_dir, labels_dir, labels):
+    """Write the Ultralytics label cache (`<labels_dir>.cache`) for the
+    images in `images_dir` from what the conversion already knows, so the
+    first training run skips its scan of every label file.
+
+    Image and label lists, hash and per-image records follow
+    YOLODataset.cache_labels(): images found recursively and sorted, label
+    rows range-checked and de-duplicated the same way. Ultralytics trusts
+    every cached entry, so each image first gets the checks it would have
+    run (check_image, on the pool); images that fail are left out and
+    counted as corrupt. If the hash does not match what Ultralytics computes
+    (e.g. data.yaml resolves to other paths), it ignores the file and
+    rescans as before."""
+    version, img_formats, hasher = CACHE_VERSION, CACHE_IMG_FORMATS, get_hash
+    try:
+        from ultralytics.data.dataset import DATASET_CACHE_VERSION
+        from ultralytics.data.utils import IMG_FORMATS, get_hash as ultralytics_get_hash
+        version, img_formats, hasher = DATASET_CACHE_VERSION, IMG_FORMATS, ultralytics_get_hash
+    except ImportError:
+        pass
+
+    images_dir = os.path.abspath(images_dir)
+    im_files = sorted(p for p in glob.glob(os.path.join(images_dir, "**", "*.*"), recursive=True)
+                      if p.rpartition(".")[-1].lower() in img_formats)
+    # Ultralytics maps .../images/... to .../labels/... (last occurrence).
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    label_files = [sb.join(p.rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt" for p in im_files]
+
+    records = []
+    nm = nf = ne = nc = 0
+    msgs = []
+    checks = pool.imap(check_image, ((p, img_formats) for p in im_files), chunksize=64)
+    for im_file, lb_file, (size, msg) in zip(im_files, label_files, checks):
+        if msg:
+            msgs.append(msg)
+        if size is None:
+            nc += 1
+            continue
+        width, height = size
+        stem = os.path.splitext(os.path.basename(im_file))[0]
+        try:
+            lines = None
+            if stem in labels and os.path.isfile(lb_file):
+                lines = labels[stem][1]
+            elif os.path.isfile(lb_file):
+                with open(lb_file, encoding="utf-8") as f:
+                    lines = [x for x in f.read().strip().splitlines() if len(x)]
+        except Exception as e:
+            nc += 1
+            msgs.append(f"WARNING ⚠️ {im_file}: ignoring corrupt image/label: {e}")
+            continue
+
+        if lines is None:
+            nm += 1
+            lb = np.zeros((0, 5), dtype=np.float32)
+        elif not lines:
+            nf += 1
+            ne += 1
+            lb = np.zeros((0, 5), dtype=np.float32)
+        else:
+            nf += 1
+            lb = np.array([x.split() for x in lines], dtype=np.float32)
+            if lb.shape[1] != 5 or lb[:, 1:].max() > 1 or lb.min() < -0.01:
+                nc += 1
+                msgs.append(f"WARNING ⚠️ {im_file}: ignoring corrupt image/label: non-normalized or out of "
+                            f"bounds coordinates")
+                continue
+            _, i = np.unique(lb, axis=0, return_index=True)
+            if len(i) < len(lb):
+                lb = lb[i]
+                msgs.append(f"WARNING ⚠️ {im_file}: {len(lines) - len(i)} duplicate labels removed")
+        records.append({
+            "im_file": im_file,
+            "shape": (height, width),
+            "cls": lb[:, 0:1],
+            "bboxes": lb[:, 1:],
+            "segments": [],
+            "keypoints": None,
+            "normalized": True,
+            "bbox_format": "xywh",
+        })
+
+    cache = {
+        "labels": records,
+        "hash": hasher(label_files + im_files),
+        "results": (nf, nm, ne, nc, len(im_files)),
+        "msgs": msgs,
+        "version": version,
+    }
+    path = labels_dir.rstrip("\\/") + ".cache"
+    with open(path, "wb") as f:
+        np.save(f, cache)
+    return path, cache["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert WIDER FACE annotations to YOLO label files.")
+    parser.add_argument("splits", nargs="*", default=list(SPLITS), help=f"splits to convert (default: {' '.join(SPLITS)})")
+    parser.add_argument("--raw-root", default=RAW_ROOT)
+    parser.add_argument("--dataset-root", default=DATASET_ROOT)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--cache", action="store_true",
+                        help="also write the Ultralytics label cache (<dataset>/labels/<split>.cache)")
+    parser.add_argument("--full", action="store_true", help="reconvert every image, not just changed ones")
+    args = parser.parse_args()
+
+    results = {}
+    caches = {}
+    with mp.Pool(args.workers) as pool:
+        for name in args.splits:
+            if name not in SPLITS:
+                print(f"[ERROR] Unknown split {name!r}; expected one of {', '.join(SPLITS)}")
+                continue
+            annotation_file, images_dir = (os.path.join(args.raw_root, p) for p in SPLITS[name])
+            if not os.path.exists(annotation_file):
+                print(f"[WARN] {name}: no annotation file {annotation_file}; skipped.")
+                continue
+            target_dir = os.path.join(args.dataset_root, "labels", name)
+            print(f"[+] Converting {name} -> {target_dir}")
+            results[name], labels = convert_split(pool, name, annotation_file, images_dir, target_dir,
+                                                  incremental=not args.full)
+            if args.cache:
+                train_images = os.path.join(args.dataset_root, "images", name)
+                if not os.path.isdir(train_images):
+                    print(f"[WARN] {name}: no {train_images}; label cache skipped.")
+                    continue
+                t0 = time.perf_counter()
+                path, (nf, nm, ne, nc, n) = write_label_cache(pool, train_images, target_dir, labels)
+                caches[name] = (path, nf, nm, ne, nc, time.perf_counter() - t0)
+
+    total_images = sum(s["images"] + s["unchanged"] for s in results.values())
+    total_seconds = sum(s["seconds"] for s in results.values())
+    for name, s in results.items():
+        done = s["images"] + s["unchanged"]
+        print(f"[✓] {name}: {s['images']} label files written, {s['unchanged']} unchanged, {s['faces']} faces, "
+              f"{s['missing']} missing, {s['errors']} unreadable in {s['seconds']:.1f}s "
+              f"({done / max(s['seconds'], 1e-9):.0f} img/s)")
+    for name, (path, nf, nm, ne, nc, seconds) in caches.items():
+        print(f"[✓] {name}: label cache {path}: {nf} labels, {nm} missing, {ne} empty, {nc} corrupt "
+              f"({seconds:.1f}s)")
+    if results:
+        print(f"[✓] Total: {total_images} images in {total_seconds:.1f}s "
+              f"({total_images / max(total_seconds, 1e-9):.0f} img/s, {args.workers} workers)")
 
-    # Write YOLO label file
-    out_path = os.path.join(target_dir, os.path.splitext(os.path.basename(image_path))[0] + ".txt")
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(yolo_lines))
 
-    print(f"[OK] Created label file: {out_path} ({len(yolo_lines)} faces)")
+if __name__ == "__main__":
+    main()
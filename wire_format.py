@@ -0,0 +1,140 @@
+import base64
+import json
+import struct
+
+import msgpack
+import numpy as np
+
+# Binary embedding encoding shared by the clients and server.py.
+#
+# A vector is a 16-byte header followed by its little-endian elements:
+#     magic "FVEC" | version u8 | dtype u8 | reserved u16 | length u32 | scale f32
+# Fixed-point dtypes store round(x / scale); float dtypes ignore the scale.
+# 512-d ArcFace: 2064 B as f32, 1040 B as f16, 528 B as q8, against ~10 KB
+# of JSON text.
+#
+# Bodies are framed as msgpack (vectors as raw bytes, Content-Type
+# application/msgpack) or JSON (vectors as base64 strings). The "legacy"
+# format is the original JSON with float lists, for servers that predate
+# this module; server.py accepts all three and answers in msgpack only
+# when the request's Accept header asks for it.
+MAGIC = b"FVEC"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHIf")
+DTYPES = {
+    # name: (code, numpy dtype, fixed-point range or None)
+    "f32": (0, "<f4", None),
+    "f16": (1, "<f2", None),
+    "q8": (2, "<i1", 127),
+    "q16": (3, "<i2", 32767),
+}
+DTYPE_CODES = {code: (name, np_dtype, qmax) for name, (code, np_dtype, qmax) in DTYPES.items()}
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+FORMATS = ("msgpack", "json", "legacy")
+
+
+def encode_vector(vec, dtype="f32"):
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown dtype {dtype!r}; expected one of {', '.join(DTYPES)}")
+    code, np_dtype, qmax = DTYPES[dtype]
+    vec = np.asarray(vec, dtype="float32").reshape(-1)
+    scale = 0.0
+    if qmax is not None:
+        peak = float(np.max(np.abs(vec))) if vec.size else 0.0
+        scale = peak / qmax if peak > 0 else 1.0
+        data = np.clip(np.rint(vec / scale), -qmax, qmax).astype(np_dtype)
+    else:
+        data = vec.astype(np_dtype)
+    return HEADER.pack(MAGIC, VERSION, code, 0, vec.size, scale) + data.tobytes()
+
+
+def decode_vector(data):
+    """float32 vector from encode_vector() output, raw or base64."""
+    if isinstance(data, str):
+        try:
+            data = base64.b64decode(data, validate=True)
+        except ValueError:
+            raise ValueError("Vector string is not valid base64")
+    if len(data) < HEADER.size:
+        raise ValueError("Vector shorter than its header")
+    magic, version, code, _, length, scale = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded vector (bad magic)")
+    if version != VERSION:
+        raise ValueError(f"Unsupported vector version {version}")
+    if code not in DTYPE_CODES:
+        raise ValueError(f"Unknown vector dtype code {code}")
+    _, np_dtype, qmax = DTYPE_CODES[code]
+    body = memoryview(data)[HEADER.size:]
+    if len(body) != length * np.dtype(np_dtype).itemsize:
+        raise ValueError("Vector length does not match its header")
+    vec = np.frombuffer(body, dtype=np_dtype).astype("float32")
+    if qmax is not None:
+        vec *= scale
+    return vec
+
+
+def _encode_vectors(obj, dtype, as_text):
+    # numpy arrays anywhere in the payload become encoded vectors.
+    if isinstance(obj, np.ndarray):
+        raw = encode_vector(obj, dtype)
+        return base64.b64encode(raw).decode("ascii") if as_text else raw
+    if isinstance(obj, dict):
+        return {k: _encode_vectors(v, dtype, as_text) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_encode_vectors(v, dtype, as_text) for v in obj]
+    return obj
+
+
+def _legacy(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.reshape(-1).tolist()
+    if isinstance(obj, dict):
+        return {k: _legacy(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_legacy(v) for v in obj]
+    return obj
+
+
+def pack(payload, fmt="msgpack", dtype="f32"):
+    """(body, headers) for a request whose numpy arrays are embeddings.
+
+        body, headers = pack({"face_index": name, "embedding": emb_np})
+        requests.post(url, data=body, headers=headers)
+    """
+    if fmt == "msgpack":
+        body = msgpack.packb(_encode_vectors(payload, dtype, as_text=False))
+        return body, {"Content-Type": MSGPACK, "Accept": MSGPACK}
+    if fmt == "json":
+        body = json.dumps(_encode_vectors(payload, dtype, as_text=True)).encode()
+        return body, {"Content-Type": JSON, "Accept": JSON}
+    if fmt == "legacy":
+        return json.dumps(_legacy(payload)).encode(), {"Content-Type": JSON}
+    raise ValueError(f"Unknown wire format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+
+def unpack(body, content_type):
+    """Decoded request / response body (vectors stay encoded)."""
+    if content_type and content_type.split(";")[0].strip() in (MSGPACK, "application/x-msgpack"):
+        try:
+            return msgpack.unpackb(body)
+        except ValueError:
+            raise ValueError("Body is not valid msgpack")
+    try:
+        return json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        raise ValueError("Body is not valid JSON")
+
+
+def to_vector(value, name):
+    """float32 vector from a payload field: encoded bytes / base64 or a
+    plain list of numbers."""
+    if isinstance(value, (bytes, str)):
+        vec = decode_vector(value)
+    else:
+        vec = np.asarray(value, dtype="float32").reshape(-1)
+    if vec.size == 0 or not np.all(np.isfinite(vec)):
+        raise ValueError(f"'{name}' must be a non-empty vector of finite numbers")
+    return vec